@@ -1,38 +1,120 @@
+import os
+import sys
 import pickle
+import argparse
 import numpy as np
-import faiss
 from tqdm.auto import tqdm
 
-def sample_tf(x,y,ndim=1000):
+sys.path.append('../Interface')
+from retrieval.turning_function import sample_tf
+from retrieval.ann_index import minibatch_kmeans, assign_clusters, brute_force_search, PCAReducer, squared_l2, topk
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+parser = argparse.ArgumentParser(description='Cluster the sampled turning functions of the training data')
+parser.add_argument('--mode', default='auto', choices=['auto','gpu','cpu'],
+                    help='gpu: faiss.Kmeans on GPU, cpu: mini-batch k-means in NumPy (BLAS threads, OMP_NUM_THREADS), auto: gpu when available')
+parser.add_argument('--ncentroids', default=1000, type=int)
+parser.add_argument('--nNN', default=1000, type=int, help='training samples kept per cluster')
+parser.add_argument('--niter', default=200, type=int)
+parser.add_argument('--batch_size', default=4096, type=int, help='cpu: samples per mini-batch step')
+parser.add_argument('--pca_dim', default=None, type=int, help='cpu: cluster in a PCA space of this dimension')
+parser.add_argument('--sweep', default=None, help='comma separated cluster counts: print the quality report of each, save nothing')
+parser.add_argument('--num_queries', default=1000, type=int, help='queries of the quality report')
+args = parser.parse_args()
+
+
+def cluster_cpu(tf, ncentroids, niter, batch_size, pca_dim=None):
     '''
-    input: tf.x,tf.y, ndim
-    return: n-dim tf values
+    mini-batch k-means, optionally on PCA-reduced vectors; the returned
+    centroids are the means of their clusters in the original space
     '''
-    t = np.linspace(0,1,ndim)
-    return np.piecewise(t,[t>=xx for xx in x],y)
+    if pca_dim is None:
+        return minibatch_kmeans(tf, ncentroids, batch_size, niter)
+    pca = PCAReducer.fit(tf, pca_dim)
+    x = pca.transform(tf)
+    assign = assign_clusters(x, minibatch_kmeans(x, ncentroids, batch_size, niter))
+    counts = np.bincount(assign, minlength=ncentroids)
+    centroids = np.zeros((ncentroids,tf.shape[1]),dtype=np.float32)
+    np.add.at(centroids, assign, tf)
+    return centroids/np.maximum(counts,1)[:,None]
+
+
+def cluster_gpu(tf, ncentroids, niter):
+    kmeans = faiss.Kmeans(tf.shape[1], ncentroids, niter=niter, verbose=True, gpu=True)
+    kmeans.train(tf)
+    return kmeans.centroids
+
+
+def quality_report(tf, centroids, clusters, queries, k=20):
+    '''
+    inertia: mean squared distance of the training samples to their nearest centroid
+    recall@k: DataRetriever.retrieve_cluster (nearest centroid, its cluster ranked
+        exactly) against brute force over tf, for 1 and log2(k) probed clusters
+    '''
+    assign = assign_clusters(tf, centroids)
+    inertia = sum(
+        ((tf[s:s+8192]-centroids[assign[s:s+8192]])**2).sum()
+        for s in range(0,len(tf),8192)
+    )/len(tf)
+    sizes = np.bincount(assign, minlength=len(centroids))
+    print(f'clusters={len(centroids)} nNN={clusters.shape[1]} samples={len(tf)}')
+    print(f'  inertia {inertia:.4f}, cluster size min {sizes.min()} median {int(np.median(sizes))} max {sizes.max()} (nNN kept per cluster)')
+
+    exact = brute_force_search(tf, queries, k)
+    near = topk(squared_l2(queries, centroids), 5)
+    for nprobe in (1, int(np.clip(np.log2(k),1,5))):
+        hits = 0
+        for q, e, c in zip(queries, exact, near):
+            cand = np.unique(clusters[c[:nprobe]].reshape(-1))
+            found = cand[topk(squared_l2(q[None], tf[cand]), k)[0]]
+            hits += len(np.intersect1d(found, e))
+        print(f'  recall@{k} probing {nprobe} cluster(s): {hits/exact.size:.3f}')
 
-tf_train = pickle.load(open('./data/trainTF.pkl','rb'))
 
-tf = []
-for i in tqdm(range(len(tf_train))):
-    tf_i = tf_train[i]
-    tf.append(sample_tf(tf_i['x'],tf_i['y']))
+# sampled turning functions of the training data (tf_train.npy of step 1)
+if os.path.exists('./data/tf_train.npy'):
+    tf = np.load('./data/tf_train.npy')
+else:
+    tf_train = pickle.load(open('./data/trainTF.pkl','rb'))
+    tf = [sample_tf(tf_i['x'],tf_i['y']) for tf_i in tqdm(tf_train)]
+tf = np.ascontiguousarray(tf,dtype=np.float32)
 
-d = 1000
-tf = np.array(tf).astype(np.float32)
+mode = args.mode
+if mode == 'auto':
+    mode = 'gpu' if faiss is not None and faiss.get_num_gpus() > 0 else 'cpu'
+if mode == 'gpu' and faiss is None:
+    raise ImportError('--mode gpu needs faiss (faiss-gpu), use --mode cpu')
 
-ncentroids = 1000
-niter = 200
-verbose = True
+# report queries: the test boundaries when available, training samples otherwise
+rng = np.random.default_rng(0)
+if os.path.exists('./data/tf_test.npy'):
+    queries = np.load('./data/tf_test.npy').astype(np.float32)
+else:
+    queries = tf
+queries = queries[rng.choice(len(queries), min(args.num_queries,len(queries)), replace=False)]
 
-kmeans = faiss.Kmeans(d, ncentroids, niter=niter, verbose=verbose,gpu=True)
-kmeans.train(tf)
-centroids = kmeans.centroids
+ncentroids_list = [int(n) for n in args.sweep.split(',')] if args.sweep else [args.ncentroids]
+for ncentroids in ncentroids_list:
+    print(f'k-means ({mode}), {ncentroids} centroids')
+    if mode == 'gpu':
+        centroids = cluster_gpu(tf, ncentroids, args.niter)
+    else:
+        centroids = cluster_cpu(tf, ncentroids, args.niter, args.batch_size, args.pca_dim)
+    centroids = np.ascontiguousarray(centroids,dtype=np.float32)
 
-index = faiss.IndexFlatL2(d)
-index.add(tf)
-nNN = 1000
-D, I = index.search (kmeans.centroids, nNN)
+    # nNN exact nearest training samples of each centroid
+    if mode == 'gpu':
+        index = faiss.IndexFlatL2(tf.shape[1])
+        index.add(tf)
+        D, I = index.search(centroids, args.nNN)
+    else:
+        I = brute_force_search(tf, centroids, args.nNN)
+    quality_report(tf, centroids, I, queries)
 
-np.save(f'./data/centroids_train.npy',centroids)
-np.save(f'./data/clusters_train.npy',I)
\ No newline at end of file
+if not args.sweep:
+    np.save(f'./data/centroids_train.npy',centroids)
+    np.save(f'./data/clusters_train.npy',I)
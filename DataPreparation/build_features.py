@@ -0,0 +1,199 @@
+'''
+One-pass build of the retrieval features of steps 1, 3 and 4:
+    trainTF.pkl, testTF.pkl, tf_train.npy, tf_test.npy  (1.tf_train.py)
+    rNum_train.npy                                       (3.rNum_train.py)
+    data_train_eNum.pkl                                  (4.data_train_eNum.py)
+    D_test_train.npy                                     (1.tf_train.py)
+
+data.mat is read once, train.txt/test.txt are cut into shards, and every shard
+(turning functions, sampled turning functions, rNum, eNum) is computed by a
+process pool and saved to {out}/feature_shards. A shard already saved for the
+same input (sha1 of its names, boundaries, rType and rEdge) is reused, so an
+interrupted run resumes and a refreshed data.mat rebuilds the changed shards. Every artifact is written
+to a temporary file and renamed.
+
+build_features and tf_dist_matrix start a process pool, call them from an
+`if __name__ == '__main__':` block (as here and in 1.tf_train.py): with the
+spawn start method (Windows) every worker re-imports the calling script.
+
+    python build_features.py --workers 8
+'''
+import os
+import sys
+import json
+import shutil
+import pickle
+import hashlib
+import argparse
+import numpy as np
+import scipy.io as sio
+from multiprocessing import Pool
+from tqdm.auto import tqdm
+
+sys.path.append('../Interface')
+from retrieval.turning_function import compute_tf, sample_tfs, pack_tf, tf_dist_to_many
+from retrieval.plan_filter import plan_room_counts, plan_edge_signature
+
+
+def save_atomic(path, save):
+    '''save(f) writes to an open binary file, renamed to path once complete'''
+    tmp = path+'.tmp'
+    with open(tmp,'wb') as f:
+        save(f)
+    os.replace(tmp,path)
+
+
+def digest(*arrays):
+    '''sha1 of the arrays (dtype, shape and content), keys the resumable outputs'''
+    h = hashlib.sha1()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f'{a.dtype.str}{a.shape}'.encode())
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+def shard_key(records):
+    '''sha1 of the shard input, records [(name, boundary, rType, rEdge)]'''
+    return digest(*[np.asarray(v) for r in records for v in r])
+
+
+def build_shard(args):
+    '''
+    args: records [(name, boundary, rType, rEdge)], output path, shard_key of the records
+    saves the key, names, packed turning functions, sampled turning functions, rNum, eNum
+    '''
+    records, path, key = args
+    names = np.array([r[0] for r in records])
+    tfs = [dict(zip('xy',compute_tf(r[1]))) for r in records]
+    x,y,offsets = pack_tf(tfs)
+    features = dict(
+        key=key,names=names,x=x,y=y,offsets=offsets,
+        tf=sample_tfs(tfs),
+        rNum=np.stack([plan_room_counts(r[2]) for r in records]),
+        eNum=np.stack([plan_edge_signature(r[2],r[3]) for r in records])
+    )
+    save_atomic(path,lambda f: np.savez(f,**features))
+    return len(records)
+
+
+def load_shard(path, key):
+    '''return: the shard features, or None if missing or built from another input'''
+    if not os.path.exists(path):
+        return None
+    shard = dict(np.load(path))
+    if 'key' not in shard or str(shard['key'])!=key:
+        return None
+    return shard
+
+
+def build_split(data_dict, names, shard_dir, split, shard_size, pool):
+    '''return: features of the split, shards concatenated in the order of names'''
+    jobs, paths = [], []
+    for s in range(0,len(names),shard_size):
+        path = os.path.join(shard_dir,f'{split}_{s//shard_size:05d}.npz')
+        records = [(n,data_dict[n].boundary,data_dict[n].rType,data_dict[n].rEdge) for n in names[s:s+shard_size]]
+        key = shard_key(records)
+        paths.append((path,key))
+        if load_shard(path,key) is None:
+            jobs.append((records,path,key))
+    print(f'{split}: {len(paths)-len(jobs)}/{len(paths)} shards done')
+    for _ in tqdm(pool.imap_unordered(build_shard,jobs),total=len(jobs),desc=split):
+        pass
+
+    shards = [load_shard(path,key) for path,key in paths]
+    features = {k:np.concatenate([s[k] for s in shards]) for k in ('tf','rNum','eNum')}
+    features['TF'] = [
+        {'x':s['x'][a:b],'y':s['y'][a:b]}
+        for s in shards for a,b in zip(s['offsets'][:-1],s['offsets'][1:])
+    ]
+    return features
+
+
+_train_packed = None
+
+
+def _init_dist(train_packed):
+    global _train_packed
+    _train_packed = train_packed
+
+
+def _dist_rows(args):
+    testTF, path = args
+    D = np.stack([tf_dist_to_many(tf['x'],tf['y'],*_train_packed) for tf in testTF])
+    save_atomic(path,lambda f: np.save(f,D.astype('float32')))
+    return len(testTF)
+
+
+def tf_dist_matrix(testTF, trainTF, parts_dir, chunk_size=64, workers=None, names=None):
+    '''
+    (ntest,ntrain) float32 turning function distances (tf_dist_to_many), chunks of
+    test rows over a process pool; finished chunks are kept in parts_dir and
+    reused while its manifest (chunk_size, sizes, hashes of the turning functions
+    and of names: (test names, train names)) matches, discarded otherwise
+    '''
+    train_packed = pack_tf(trainTF)
+    manifest = {
+        'chunk_size': chunk_size,
+        'ntest': len(testTF),
+        'ntrain': len(trainTF),
+        'test': digest(*pack_tf(testTF)),
+        'train': digest(*train_packed),
+        'names': digest(*[np.array(n) for n in names]) if names is not None else None,
+    }
+    manifest_path = os.path.join(parts_dir,'manifest.json')
+    if os.path.isdir(parts_dir):
+        old = json.load(open(manifest_path)) if os.path.exists(manifest_path) else None
+        if old != manifest:
+            print(f'{parts_dir} was computed for other inputs, recomputing')
+            shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir,exist_ok=True)
+    save_atomic(manifest_path,lambda f: f.write(json.dumps(manifest).encode()))
+    paths = [f'{parts_dir}/{s:06d}.npy' for s in range(0,len(testTF),chunk_size)]
+    jobs = [(testTF[s:s+chunk_size],path) for s,path in zip(range(0,len(testTF),chunk_size),paths) if not os.path.exists(path)]
+    with Pool(workers,initializer=_init_dist,initargs=(train_packed,)) as pool:
+        for _ in tqdm(pool.imap_unordered(_dist_rows,jobs),total=len(jobs),desc='D_test_train'):
+            pass
+    return np.concatenate([np.load(path) for path in paths])
+
+
+def build_features(data_path, out_dir='./data', shard_size=2000, workers=None, dist=True):
+    names_train = open(os.path.join(out_dir,'train.txt')).read().split('\n')
+    names_test = open(os.path.join(out_dir,'test.txt')).read().split('\n')
+    data = sio.loadmat(data_path, squeeze_me=True, struct_as_record=False)['data']
+    data_dict = {d.name:d for d in data}
+    del data
+
+    shard_dir = os.path.join(out_dir,'feature_shards')
+    os.makedirs(shard_dir,exist_ok=True)
+    with Pool(workers) as pool:
+        train = build_split(data_dict,names_train,shard_dir,'train',shard_size,pool)
+        test = build_split(data_dict,names_test,shard_dir,'test',shard_size,pool)
+
+    out = lambda name: os.path.join(out_dir,name)
+    save_atomic(out('trainTF.pkl'),lambda f: pickle.dump(train['TF'],f))
+    save_atomic(out('testTF.pkl'),lambda f: pickle.dump(test['TF'],f))
+    save_atomic(out('tf_train.npy'),lambda f: np.save(f,train['tf']))
+    save_atomic(out('tf_test.npy'),lambda f: np.save(f,test['tf']))
+    save_atomic(out('rNum_train.npy'),lambda f: np.save(f,train['rNum']))
+    save_atomic(out('data_train_eNum.pkl'),lambda f: pickle.dump({'eNum':train['eNum']},f))
+
+    if dist:
+        D_test_train = tf_dist_matrix(test['TF'],train['TF'],out('D_test_train_parts'),workers=workers,
+                                      names=(names_test,names_train))
+        save_atomic(out('D_test_train.npy'),lambda f: np.save(f,D_test_train))
+    print(f'{len(names_train)} train / {len(names_test)} test plans -> {out_dir}')
+
+
+if __name__ == '__main__':
+    from config import data_path
+
+    parser = argparse.ArgumentParser(description='Build the turning function, rNum and eNum features of train.txt / test.txt')
+    parser.add_argument('--data_path', default=data_path)
+    parser.add_argument('--out_dir', default='./data')
+    parser.add_argument('--shard_size', default=2000, type=int)
+    parser.add_argument('--workers', default=None, type=int, help='processes, all cores by default')
+    parser.add_argument('--no_dist', action='store_true', help='skip D_test_train.npy')
+    args = parser.parse_args()
+
+    build_features(args.data_path, args.out_dir, args.shard_size, args.workers, dist=not args.no_dist)
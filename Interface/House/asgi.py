@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'House.settings')
 
 application = get_asgi_application()
+
+# load datasets and model in the background now, not on the first request
+if os.environ.get('PRELOAD_COMPONENTS', '1') != '0':
+    from Houseweb import views
+    views.components.start()
@@ -132,4 +132,15 @@ STATICFILES_DIRS = (
 # The ALLOWED_HOSTS at the bottom of the file was redundant or specific to a deployment
 # We will consolidate this.
 
-CSRF_TRUSTED_ORIGINS = os.getenv('CSRF_TRUSTED_ORIGINS', '').split(',')
\ No newline at end of file
+CSRF_TRUSTED_ORIGINS = os.getenv('CSRF_TRUSTED_ORIGINS', '').split(',')
+
+# Layout model inference, read from the environment by model/test.py:
+# MODEL_DEVICE: auto (first GPU if available, else CPU) / cpu / cuda:0
+# TORCH_NUM_THREADS / TORCH_NUM_INTEROP_THREADS: CPU thread pools, torch defaults if unset
+# MODEL_TRACED: path of a module exported by `python -m model.export`, served instead of model.pth
+# MODEL_QUANTIZE: dynamic, int8 Linear layers on CPU (accuracy report: `python -m model.quantize`)
+# MODEL_LAYOUT: grid_sample (default) / matmul, refinement input built from rasterized box masks (`python -m model.benchmark`)
+
+# Server start (House/wsgi.py, House/asgi.py):
+# PRELOAD_COMPONENTS: 1 (default) loads test/train data, retrieval arrays and the model in background threads at
+# process start, 0 loads them on the first request that needs them; status at /index/Ready/
\ No newline at end of file
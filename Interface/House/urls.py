@@ -26,6 +26,7 @@ urlpatterns = [
     path(r'index/TransGraph/', views.TransGraph),
     path(r'index/TransGraph_net/', views.TransGraph_net),
     path(r'index/Init/', views.Init),
+    path(r'index/Ready/', views.Ready),  # per-component loading status
     path(r'index/AdjustGraph/', views.AdjustGraph),
     path(r'index/GraphSearch/', views.GraphSearch),
     path(r'index/RelBox/', views.RelBox),
@@ -0,0 +1,131 @@
+"""
+Component registry for the server's datasets and model.
+
+Every component (test data, train data, retrieval arrays, model, ...) has a
+loader and the components it depends on. start() loads all of them in
+background threads at process start, each as soon as its dependencies are
+ready. An endpoint waits only for the components it uses (the requires
+decorator), so lightweight endpoints answer once test data is loaded instead of
+waiting for the whole corpus and the model.
+"""
+import time
+import threading
+import traceback
+from functools import wraps
+
+from django.http import JsonResponse
+
+PENDING, LOADING, READY, FAILED = 'pending', 'loading', 'ready', 'failed'
+
+
+class ComponentError(RuntimeError):
+    pass
+
+
+class Component():
+    def __init__(self, name, loader, deps=()):
+        self.name = name
+        self.loader = loader
+        self.deps = tuple(deps)
+        self.state = PENDING
+        self.error = None
+        self.seconds = None
+        self.started = False
+        self.done = threading.Event()
+
+
+class ComponentRegistry():
+    def __init__(self):
+        self.components = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, deps=()):
+        '''
+        loader: called once without arguments, sets the module globals of the component
+        deps: names of the components that must be ready before loader runs
+        '''
+        for dep in deps:
+            if dep not in self.components:
+                raise ValueError(f'component {name!r} depends on unknown component {dep!r}')
+        self.components[name] = Component(name, loader, deps)
+
+    def _load(self, component):
+        try:
+            self._wait(component.deps)
+            component.state = LOADING
+            start = time.perf_counter()
+            component.loader()
+            component.seconds = time.perf_counter() - start
+            component.state = READY
+            print(f'component {component.name} ready in {component.seconds:.2f} Seconds')
+        except Exception as e:
+            component.state = FAILED
+            component.error = f'{type(e).__name__}: {e}'
+            traceback.print_exc()
+        finally:
+            component.done.set()
+
+    def _claim(self, names):
+        '''marks the components as started, return: the ones not started before'''
+        with self._lock:
+            todo = [self.components[name] for name in names if not self.components[name].started]
+            for component in todo:
+                component.started = True
+        return todo
+
+    def start(self):
+        '''loads every component not loaded yet in its own background thread'''
+        for component in self._claim(list(self.components)):
+            threading.Thread(target=self._load, args=(component,), name=f'load-{component.name}', daemon=True).start()
+
+    def load(self, *names):
+        '''
+        loads the components (and their dependencies) in the calling thread, e.g.
+        in a server master process before it forks, where no thread may be running
+        '''
+        for name in names:
+            self.load(*self.components[name].deps)
+            for component in self._claim([name]):
+                self._load(component)
+        self._wait(names)
+
+    def wait(self, *names, timeout=None):
+        '''
+        blocks until the components are loaded (all of them if no name is given),
+        starting the background loading if it has not been started yet
+        raises ComponentError if one of them failed or timed out
+        '''
+        self.start()
+        self._wait(names or list(self.components), timeout)
+
+    def _wait(self, names, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for name in names:
+            component = self.components[name]
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            if not component.done.wait(remaining):
+                raise ComponentError(f'component {name!r} is still {component.state}')
+            if component.state == FAILED:
+                raise ComponentError(f'component {name!r} failed to load: {component.error}')
+
+    def ready(self, *names):
+        return all(self.components[name].state == READY for name in names or self.components)
+
+    def status(self):
+        return {
+            name: {'state': c.state, 'seconds': c.seconds, 'error': c.error, 'deps': list(c.deps)}
+            for name, c in self.components.items()
+        }
+
+    def requires(self, *names):
+        '''endpoint decorator: waits for the components, answers 503 if one of them failed'''
+        def decorator(view):
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                try:
+                    self.wait(*names)
+                except ComponentError as e:
+                    return JsonResponse({'error': str(e)}, status=503)
+                return view(request, *args, **kwargs)
+            return wrapper
+        return decorator
@@ -1,3 +1,79 @@
-from django.test import TestCase
+import os
+import tempfile
+import numpy as np
+import scipy.io as sio
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from retrieval.ann_index import RetrievalEngine
+from retrieval.query_tf import QueryTFCache
+from model.corpus_store import TrainRecord
+
+
+class PlanDataTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.record = TrainRecord('0', rng.integers(0, 256, (6, 4)), rng.integers(0, 256, (3, 5)),
+                                  np.array([[0, 1, 2], [1, 2, 0]]), np.array([1, 2, 3]), [])
+        self.path = os.path.join(tempfile.mkdtemp(), 'plan.mat')
+
+    def test_savemat_round_trip(self):
+        from model.floorplan import PlanData
+        view = PlanData(self.record)
+        view.box = self.record.box + 1
+        view.doors = np.array([[1, 2, 3, 4]])
+        sio.savemat(self.path, {'data': view.to_dict()})
+        data = sio.loadmat(self.path, squeeze_me=True, struct_as_record=False)['data']
+
+        self.assertEqual(set(data._fieldnames), {'name', 'boundary', 'box', 'edge', 'order', 'rBoundary', 'doors'})
+        self.assertEqual(data.name, '0')
+        np.testing.assert_array_equal(data.boundary, self.record.boundary)
+        np.testing.assert_array_equal(data.box, self.record.box + 1)
+        np.testing.assert_array_equal(data.edge, self.record.edge)
+        np.testing.assert_array_equal(data.doors, [1, 2, 3, 4])
+        # the source record is not modified
+        self.assertFalse(hasattr(self.record, 'doors'))
+
+    def test_savemat_round_trip_of_loaded_record(self):
+        from model.floorplan import PlanData
+        sio.savemat(self.path, {'data': vars(self.record)})
+        record = sio.loadmat(self.path, squeeze_me=True, struct_as_record=False)['data']
+        view = PlanData(record)
+        view.box = record.box * 2
+        sio.savemat(self.path, {'data': view.to_dict()})
+        data = sio.loadmat(self.path, squeeze_me=True, struct_as_record=False)['data']
+
+        self.assertEqual(set(data._fieldnames), set(record._fieldnames))
+        np.testing.assert_array_equal(data.box, record.box * 2)
+        np.testing.assert_array_equal(data.boundary, record.boundary)
+
+
+class RetrievalEngineTests(SimpleTestCase):
+    def setUp(self):
+        # 400 lists of 50 vectors: the default 8 probes cover 400 < k
+        rng = np.random.default_rng(0)
+        centroids = rng.random((400, 1000), dtype=np.float32)
+        self.tf_train = np.repeat(centroids, 50, 0) + 0.01 * rng.random((20000, 1000), dtype=np.float32)
+        self.engine = RetrievalEngine.build(self.tf_train, centroids, nprobe=8, backend='numpy')
+        self.queries = rng.random((3, 1000), dtype=np.float32)
+
+    def test_search_returns_k_results(self):
+        result = self.engine.search(self.queries, k=1000)
+        self.assertEqual(result.shape, (3, 1000))
+        self.assertTrue((result >= 0).all())
+        for row in result:
+            self.assertEqual(len(np.unique(row)), 1000)
+
+    def test_retrieve_ann_returns_k_results(self):
+        from retrieval.retrieval import DataRetriever
+        retriever = DataRetriever(self.tf_train, None, None, self.engine, QueryTFCache(self.queries))
+        result = retriever.retrieve_ann(None, k=1000, index=0)
+        self.assertEqual(len(result), 1000)
+
+
+class QueryTFCacheTests(SimpleTestCase):
+    def test_load_cache_ignores_tf_test_of_another_test_set(self):
+        from retrieval.query_tf import load_cache
+        path = os.path.join(tempfile.mkdtemp(), 'tf_test.npy')
+        np.save(path, np.zeros((5, 1000)))
+        self.assertEqual(len(load_cache(path, 5).tf_test), 5)
+        self.assertIsNone(load_cache(path, 6).tf_test)
@@ -3,8 +3,14 @@ from django.http import HttpResponse, JsonResponse
 import json
 import model.test as mltest
 import model.utils as mdul
+import model.corpus_store as corpus_store
+from model.name_registry import NameRegistry
 from model.floorplan import *
 import retrieval.retrieval as rt
+import retrieval.ann_index as ann_index
+import retrieval.query_tf as query_tf
+import retrieval.plan_filter as plan_filter
+import retrieval.ingest as ingest
 import time
 import pickle
 import scipy.io as sio
@@ -12,7 +18,6 @@ import numpy as np
 from model.decorate import *
 import math
 import pandas as pd
-import threading
 # import matlab.engine
 import sys
 import os
@@ -26,32 +31,39 @@ import model.llm_service as llm_service
 import model.graph_preprocessor as graph_preprocessor
 from PostProcess.image_processor import ImageProcessor
 from django.views.decorators.csrf import csrf_exempt
+from Houseweb.components import ComponentRegistry
 
-global test_data, test_data_topk, testNameList, trainNameList
-global train_data, trainNameList, trainTF, train_data_eNum, train_data_rNum
+global test_data, test_data_topk, testNameList, trainNameList, ntest
+global train_data, trainNameList, trainTF, train_data_eNum, train_data_rNum, train_filter
 global engview, model
-global tf_train, centroids, clusters
+global tf_train, centroids, clusters, tf_engine, tf_query, corpus_deltas
 global boxes_pred
 
 # Initialize global variables to None
 test_data = None
 test_data_topk = None
 testNameList = None
+ntest = None
 trainNameList = None
 train_data = None
 trainTF = None
 train_data_eNum = None
 train_data_rNum = None
+train_filter = None
 engview = None
 model = None
 tf_train = None
 centroids = None
 clusters = None
+tf_engine = None
+tf_query = None
+corpus_deltas = None
 boxes_pred = []
 
-# Lock for thread-safe initialization
-_init_lock = threading.Lock()
-_is_initialized = False
+# datasets and model, loaded in the background at process start (House/wsgi.py),
+# registered below the loaders; endpoints wait only for what they use
+components = ComponentRegistry()
+requires = components.requires
 
 
 def home(request):
@@ -65,63 +77,33 @@ def home_wizard_upload(request):
 
 
 def ensure_initialized():
-    """Ensure data is initialized. Called automatically by endpoints that need data."""
-    global _is_initialized
-    
-    if _is_initialized:
-        return True
-    
-    with _init_lock:
-        # Double-check after acquiring lock
-        if _is_initialized:
-            return True
-        
-        print("Auto-initializing data...")
-        start = time.perf_counter()
-        
-        # 使用多線程並行載入資料，加快初始化速度
-        thread_test = threading.Thread(target=getTestData)
-        thread_train = threading.Thread(target=getTrainData)
-        thread_retrieval = threading.Thread(target=loadRetrieval)
-        
-        # 同時啟動三個載入線程
-        thread_test.start()
-        thread_train.start()
-        thread_retrieval.start()
-        
-        # 等待測試資料和訓練資料載入完成（loadModel 需要這些資料）
-        thread_test.join()
-        thread_train.join()
-        
-        # loadModel 依賴 train_data，必須等待完成後才能執行
-        loadModel()
-        
-        # 確保 retrieval 資料也載入完成
-        thread_retrieval.join()
-        
-        end = time.perf_counter()
-        print('Auto-Init(model+test+train+engine+retrieval) time: %s Seconds' % (end - start))
-        
-        _is_initialized = True
-        return True
+    """Wait until every component is loaded (starts the loading if needed)."""
+    components.wait()
+    return True
 
 
 def Init(request):
     start = time.perf_counter()
-    
-    global _is_initialized
-    if _is_initialized:
-        print("Already initialized, skipping...")
-        return HttpResponse(None)
-    
     ensure_initialized()
-    
     end = time.perf_counter()
     print('Init total time: %s Seconds' % (end - start))
 
     return HttpResponse(None)
 
 
+def Ready(request):
+    """
+    Readiness of the components: 200 when all of them (or the ones listed in
+    ?components=test,train) are loaded, 503 otherwise, with the state of each.
+    """
+    names = [n for n in request.GET.get('components', '').split(',') if n]
+    unknown = [n for n in names if n not in components.components]
+    if unknown:
+        return JsonResponse({'error': f'unknown components {unknown}'}, status=400)
+    ready = components.ready(*names)
+    return JsonResponse({'ready': ready, 'components': components.status()}, status=200 if ready else 503)
+
+
 def loadMatlabEng():
     pass
     # startengview = time.perf_counter()
@@ -133,47 +115,79 @@ def loadMatlabEng():
 
 
 def loadRetrieval():
-    global tf_train, centroids, clusters
+    global tf_train, centroids, clusters, tf_engine, tf_query
     t1 = time.perf_counter()
     tf_train = np.load('./retrieval/tf_train.npy')
     centroids = np.load('./retrieval/centroids_train.npy')
     clusters = np.load('./retrieval/clusters_train.npy')
+    # ANN index built by `python -m retrieval.ann_index`, falls back to cluster search if missing
+    tf_engine = ann_index.load_engine('./retrieval/tf_index')
+    # plans appended by `python -m retrieval.ingest`, the same deltas as getTrainData
+    tf_train, clusters = ingest.merge_retrieval(tf_train, clusters, corpus_deltas)
+    if tf_engine is not None and corpus_deltas:
+        tf_engine.add(np.concatenate([d.tf for d in corpus_deltas]))
+    # sampled tf of the test boundaries (rows follow testNameList), runtime boundaries are LRU-cached
+    tf_query = query_tf.load_cache('./retrieval/tf_test.npy', ntest)
     t2 = time.perf_counter()
     print('load tf/centroids/clusters', t2 - t1)
 
 
+def loadDeltas():
+    # read once, so train data and retrieval arrays are extended by the same deltas
+    # even if an ingestion finishes while they load
+    global corpus_deltas
+    corpus_deltas = ingest.load_deltas()
+    print(f'corpus deltas: {len(corpus_deltas)} ({sum(len(d) for d in corpus_deltas)} plans)')
+
+
 def getTestData():
     start = time.perf_counter()
-    global test_data, testNameList, trainNameList
+    global test_data, testNameList, ntest
  
     test_data = pickle.load(open('./static/Data/data_test_converted.pkl', 'rb'))
-    test_data, testNameList, trainNameList = test_data['data'], list(test_data['testNameList']), list(
-        test_data['trainNameList'])
+    # NameRegistry: O(1) name -> index lookups for every endpoint
+    # (trainNameList of the pickle is the same list, it is set by getTrainData with the ingested plans)
+    test_data, testNameList = test_data['data'], NameRegistry(test_data['testNameList'])
+    # plans of the test set, ProcessDimensions appends runtime boundaries after them
+    ntest = len(test_data)
     end = time.perf_counter()
     print('getTestData time: %s Seconds' % (end - start))
 
 
 def getTrainData():
     start = time.perf_counter()
-    global train_data, trainNameList, trainTF, train_data_eNum, train_data_rNum
+    global train_data, trainNameList, trainTF, train_data_eNum, train_data_rNum, train_filter
     
-    train_data = pickle.load(open('./static/Data/data_train_converted.pkl', 'rb'))
-    train_data, trainNameList, trainTF = train_data['data'], list(train_data['nameList']), list(train_data['trainTF'])
+    # memory-mapped corpus store (see model/corpus_store.py), shared by all workers through the OS page cache
+    store = corpus_store.open_store('./static/Data/train_store')
+    if store is not None:
+        train_data, trainNameList, trainTF = store, NameRegistry(store.name_list()), store.turning_functions()
+    else:
+        print('train_store not found, loading pickle (convert once with: python -m model.corpus_store)')
+        train_data = pickle.load(open('./static/Data/data_train_converted.pkl', 'rb'))
+        train_data, trainNameList, trainTF = train_data['data'], NameRegistry(train_data['nameList']), list(train_data['trainTF'])
     
     train_data_eNum = pickle.load(open('./static/Data/data_train_eNum.pkl', 'rb'))
     train_data_eNum = train_data_eNum['eNum']
     train_data_rNum = np.load('./static/Data/rNum_train.npy')
+    train_data, trainNameList, trainTF, train_data_eNum, train_data_rNum = ingest.merge_train_data(
+        train_data, trainNameList, trainTF, train_data_eNum, train_data_rNum, corpus_deltas)
+    # room-count and edge-signature buckets for GraphSearch over the whole corpus
+    train_filter = plan_filter.PlanFilterIndex(train_data_rNum, train_data_eNum)
 
     end = time.perf_counter()
     print('getTrainData time: %s Seconds' % (end - start))
 
 
 def loadModel():
-    global model, train_data, trainNameList
+    global model
     start = time.perf_counter()
     model = mltest.load_model()
     end = time.perf_counter()
     print('loadModel time: %s Seconds' % (end - start))
+
+
+def warmupModel():
     start = time.perf_counter()
     test = train_data[trainNameList.index("75119")]
     mltest.test(model, FloorPlan(test, train=True))
@@ -181,12 +195,20 @@ def loadModel():
     print('test Model time: %s Seconds' % (end - start))
 
 
+components.register('test', getTestData)
+components.register('deltas', loadDeltas)
+components.register('train', getTrainData, deps=('deltas',))
+# tf_query is checked against the loaded test set
+components.register('retrieval', loadRetrieval, deps=('test', 'deltas'))
+components.register('model', loadModel)
+# first forward pass, reported by Ready but not awaited by the endpoints
+components.register('warmup', warmupModel, deps=('model', 'train'))
+
+
+@requires('test')
 def LoadTestBoundary(request):
     global testNameList, test_data
     
-    # Auto-initialize if needed
-    ensure_initialized()
-    
     start = time.perf_counter()
     testName = request.GET.get('testName').split(".")[0]
     test_index = testNameList.index(testName)
@@ -203,13 +225,11 @@ def LoadTestBoundary(request):
     return HttpResponse(json.dumps(data_js), content_type="application/json")
 
 
+@requires('test')
 def GetExampleList(request):
     """Get a list of example floor plan names for the example page"""
     global testNameList
     
-    # Auto-initialize if needed
-    ensure_initialized()
-    
     # Priority example: 309 should be the first example
     priority_example = "309"
     
@@ -228,38 +248,10 @@ def GetExampleList(request):
     return HttpResponse(json.dumps(example_list), content_type="application/json")
 
 
-def get_filter_func(mask, acc, num):
-    filters = [
-        None if not mask else (
-            np.equal if acc[i] else np.greater_equal
-        )
-        for i in range(len(mask))
-    ]
-
-    def filter_func(data):
-        for i in range(len(filters)):
-            if (filters[i] is not None) and (not filters[i](data[i], num[i])): return False
-        return True
-
-    return filter_func
-
-
-def filter_graph(graph_):
-    filters = graph_
-
-    def filter_graphfunc(data):
-        sub = data - filters
-        return ((sub >= 0).all())
-
-    return filter_graphfunc
-
-
+@requires('test', 'train', 'retrieval')
 def NumSearch(request):
     global testNameList, test_data, trainNameList, train_data_rNum
     
-    # Auto-initialize if needed
-    ensure_initialized()
-    
     start = time.perf_counter()
     data_new = json.loads(request.GET.get("userInfo"))
     
@@ -282,7 +274,7 @@ def NumSearch(request):
 
    
     multi_clusters=False
-    test_data_topk = rt.retrieval(data, 1000,multi_clusters)
+    test_data_topk = rt.retrieval(data, 1000,multi_clusters,test_index)
     
     if len(data_new) > 1:
         roomactarr = data_new[1]
@@ -290,9 +282,7 @@ def NumSearch(request):
         roomnumarr = [int(x) for x in data_new[3]]
         
         test_num = train_data_rNum[test_data_topk]
-        filter_func = get_filter_func(roomactarr, roomexaarr, roomnumarr)
-        indices = np.where(list(map(filter_func, test_num)))
-        indices = list(indices)
+        indices = np.where(plan_filter.room_count_mask(test_num, roomactarr, roomexaarr, roomnumarr))
         if len(indices[0]) < 20:
             topk = len(indices[0])
         else:
@@ -348,6 +338,7 @@ def FindTraindata(trainname):
     return data_js
 
 
+@requires('train')
 def LoadTrainHouse(request):
     trainname = request.GET.get("roomID").split(".")[0]
     data_js = FindTraindata(trainname)
@@ -359,6 +350,7 @@ def LoadTrainHouse(request):
 '''
 
 
+@requires('test', 'train', 'model')
 def TransGraph(request):
     start = time.perf_counter()
     userInfo = request.GET.get("userInfo")
@@ -368,7 +360,7 @@ def TransGraph(request):
 
     fp_end = mlresult
    
-    sio.savemat("./static/" + userInfo.split(',')[0].split('.')[0] + ".mat", {"data": fp_end.data})
+    sio.savemat("./static/" + userInfo.split(',')[0].split('.')[0] + ".mat", {"data": fp_end.data.to_dict()})
 
     data_js = {}
     # fp_end  hsedge
@@ -469,6 +461,7 @@ def TransGraph(request):
     return HttpResponse(json.dumps(data_js), content_type="application/json")
 
 
+@requires('test', 'train', 'model')
 def AdjustGraph(request):
     start = time.perf_counter()
     # newNode index-typename-cx-cy
@@ -602,7 +595,7 @@ def AdjustGraph(request):
             tmp = [x, y, x, h + y]
             data_js["windowsline"].append(tmp)
     
-    sio.savemat("./static/" + testname.split(',')[0].split('.')[0] + ".mat", {"data": fp_end.data})
+    sio.savemat("./static/" + testname.split(',')[0].split('.')[0] + ".mat", {"data": fp_end.data.to_dict()})
 
     end = time.perf_counter()
     print('AdjustGraph time: %s Seconds' % (end - start))
@@ -653,6 +646,7 @@ def get_dir(id,relbox,reledge):
     data2 = reledge[np.where((reledge[:, [1]] == selectindex))[0]]
     reledge1 = np.vstack((data1, data2))
     return rdirgroup
+@requires('test', 'train')
 def Save_Editbox(request):
     global indxlist,boxes_pred
     NewGraph = json.loads(request.GET.get("NewGraph"))
@@ -796,11 +790,12 @@ def Save_Editbox(request):
     fp_end.data.rBoundary = [np.array(rb) for rb in rBoundary]
     fp_end.data.rType = rType.astype(int)  # Required by add_dw_fp to add doors/windows
     fp_end.data = add_dw_fp(fp_end.data)
-    sio.savemat("./static/" + userRoomID + ".mat", {"data": fp_end.data})
+    sio.savemat("./static/" + userRoomID + ".mat", {"data": fp_end.data.to_dict()})
     flag=1
     return HttpResponse(json.dumps(flag), content_type="application/json")
 
 
+@requires('test', 'train', 'model')
 def TransGraph_net(request):
     userInfo = request.GET.get("userInfo")
     testname = userInfo.split(',')[0]
@@ -844,10 +839,10 @@ def TransGraph_net(request):
     return HttpResponse(json.dumps(data_js), content_type="application/json")
 
 
+@requires('test', 'train', 'retrieval')
 def GraphSearch(request):
     s=time.perf_counter()
     # Graph
-    Searchtype = ["BedRoom", "Bathroom", "Kitchen", "Balcony", "Storage"]
     BedRoomlist = ["MasterRoom", "SecondRoom", "GuestRoom", "ChildRoom", "StudyRoom"]
     NewGraph = json.loads(request.GET.get("NewGraph"))
    
@@ -879,54 +874,20 @@ def GraphSearch(request):
     roomactarr = Numrooms[0]
     roomexaarr = Numrooms[1]
     roomnumarr = [int(x) for x in Numrooms[2]]
-    test_data_topk=np.arange(0,74995)
-
     if np.sum(roomactarr) != 1 or np.sum(roomexaarr) != 1 or np.sum(roomnumarr) != 1:
-        test_num = train_data_rNum[test_data_topk]
         # Number filter
-     
-        filter_func = get_filter_func(roomactarr, roomexaarr, roomnumarr)
-        indices = np.where(list(map(filter_func, test_num)))
-        # print("np.where(list(map(fil", test_num)
-        indices = list(indices)
-        test_data_topk = test_data_topk[indices[0]]
-
-    test_num = train_data_eNum[test_data_topk]
-    # Graph filter
-    
-    edgematrix = np.zeros((5, 5))
-    for indx1, indx2 in newEdge:
-        tmp1 = ""
-        tmp2 = ""
-        for indx, rmname, x, y, scalesize in newNode:
-            if indx1 == indx:
-                if rmname in BedRoomlist:
-                    tmp1 = "BedRoom"
-                else:
-                    tmp1 = rmname
-        for indx, rmname, x, y, scalesize in newNode:
-            if indx2 == indx:
-                if rmname in BedRoomlist:
-                    tmp2 = "BedRoom"
-                else:
-                    tmp2 = rmname
-        if tmp1 != "" and tmp2 != "":
-            edgematrix[Searchtype.index(tmp1)][Searchtype.index(tmp2)] = edgematrix[Searchtype.index(tmp1)][
-                                                                             Searchtype.index(tmp2)] + 1
-            edgematrix[Searchtype.index(tmp2)][Searchtype.index(tmp1)] = edgematrix[Searchtype.index(tmp2)][
-                                                                             Searchtype.index(tmp1)] + 1
-    edge = edgematrix.reshape((1, 25))
-    filter_graphfunc = filter_graph(edge)
-    # rNum_list
-    eNumData = []
-   
-    indices = np.where(list(map(filter_graphfunc, test_num)))
+        room_query = (roomactarr, roomexaarr, roomnumarr)
+    else:
+        room_query = ([], [], [])
 
-    indices = list(indices)
-    tf_trainsub=tf_train[test_data_topk[indices[0]]]
-    re_data = train_data[test_data_topk[indices[0]]]
-    test_data_tftopk=retrieve_bf(tf_trainsub, data, k=20)
-    re_data=re_data[test_data_tftopk]
+    # Graph filter, fused with the Number filter over the signature index
+    edge = plan_filter.edge_signature(newNode, newEdge)
+    test_data_topk = train_filter.query(*room_query, edge)
+
+    tf_trainsub=tf_train[test_data_topk]
+    test_data_tftopk=retrieve_bf(tf_trainsub, data, k=20, index=test_index)
+    # only the 20 nearest plans are read from the corpus
+    re_data = train_data[test_data_topk[test_data_tftopk]]
     if len(re_data) < 20:
         topk = len(re_data)
     else:
@@ -942,10 +903,13 @@ def GraphSearch(request):
     return HttpResponse(json.dumps(topkList), content_type="application/json")
 
 
-def retrieve_bf(tf_trainsub, datum, k=20):
-    # compute tf for the data boundary
-    x, y = rt.compute_tf(datum.boundary)
-    y_sampled = rt.sample_tf(x, y, 1000)
+def retrieve_bf(tf_trainsub, datum, k=20, index=None):
+    # compute tf for the data boundary (cached, see retrieval/query_tf.py)
+    if tf_query is not None:
+        y_sampled = tf_query.get(datum, index)
+    else:
+        x, y = rt.compute_tf(datum.boundary)
+        y_sampled = rt.sample_tf(x, y, 1000)
     dist = np.linalg.norm(y_sampled - tf_trainsub, axis=1)
     if k > np.log2(len(tf_trainsub)):
         index = np.argsort(dist)[:k]
@@ -955,6 +919,7 @@ def retrieve_bf(tf_trainsub, datum, k=20):
     return index
 
 
+@requires('test', 'model')
 def LLMGenerateGraph(request):
     """
     使用 LLM 從自然語言生成 Graph，並直接生成格局
@@ -1062,6 +1027,7 @@ def LLMGenerateGraph(request):
         return JsonResponse({"error": f"伺服器錯誤: {str(e)}"}, status=500)
 
 
+@requires('test', 'model')
 def LLMRegenerateLayout(request):
     """
     根據編輯後的 LLM Graph 重新生成房間佈局
@@ -1136,6 +1102,7 @@ def LLMRegenerateLayout(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+@requires('test')
 def LLMSaveLayout(request):
     """
     儲存 LLM 生成的格局為 .mat 檔案
@@ -1195,6 +1162,7 @@ class DynamicData:
         self.boundary = np.array(boundary)
 
 @csrf_exempt
+@requires('test')
 def ProcessDimensions(request):
     """
     API to process raw dimensions (width, depth) and return boundary data.
@@ -1287,8 +1255,9 @@ def ProcessDimensions(request):
                 test_data = test_data.tolist()
                 
             if testNameList is None:
-                testNameList = []
+                testNameList = NameRegistry()
                 
+            # keep test_data and the name registry in sync
             test_data.append(dynamic_data)
             testNameList.append(testName)
             
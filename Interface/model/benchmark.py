@@ -0,0 +1,236 @@
+"""
+Microbenchmarks for the layout model.
+Run from the Interface directory:
+    python -m model.benchmark
+Uses ./model/model.pth when present, random weights otherwise
+(parity checks do not depend on the weights).
+"""
+import os
+import copy
+import time
+import numpy as np
+import torch
+
+from model.floorplan import FloorPlan
+from model.utils import point_box_relation, vocab
+from model.corpus_store import TrainRecord
+from model.model import Model
+from model.layout import LAYOUT_BUILDERS
+import model.box_utils as box_utils
+from model.boundary_cache import boundary_cache
+import model.test as mltest
+from retrieval.benchmark import random_boundary, timeit
+
+
+def random_plan(rng, n_rooms=8):
+    '''
+    random training-like plan: boundary from random_boundary, boxes inside its
+    bounding box and a chain of edges plus a few random ones
+    '''
+    boundary = random_boundary(rng)
+    x0, y0 = boundary[:, :2].min(0)
+    x1, y1 = boundary[:, :2].max(0)
+    box = np.zeros((n_rooms, 5), dtype=int)
+    for i in range(n_rooms):
+        bx0, bx1 = np.sort(rng.integers(x0, x1 - 4, 2))
+        by0, by1 = np.sort(rng.integers(y0, y1 - 4, 2))
+        box[i] = [bx0, by0, bx1 + 4, by1 + 4, rng.integers(0, 12)]
+    box[0, 4] = 0
+    edge = [[i, i + 1, 0] for i in range(n_rooms - 1)]
+    edge += [[int(u), int(v), 0] for u, v in rng.integers(0, n_rooms, (n_rooms // 2, 2)) if u != v]
+    return TrainRecord('synthetic', boundary, box, np.array(edge), np.arange(n_rooms), [])
+
+
+def random_floorplans(n, seed=0, n_rooms=(6, 10)):
+    rng = np.random.default_rng(seed)
+    return [FloorPlan(random_plan(rng, int(rng.integers(*n_rooms))), train=True) for _ in range(n)]
+
+
+def load_benchmark_model(device='cpu'):
+    device = mltest.get_device(device)
+    if os.path.exists('./model/model.pth'):
+        return mltest.load_model(device)
+    return Model().to(device).eval()
+
+
+def max_diff(outputs, reference):
+    return max(
+        max(np.abs(a - b).max() for a, b in zip(out, ref))
+        for out, ref in zip(outputs, reference)
+    )
+
+
+def benchmark_test_batch(model, n=20):
+    fps = random_floorplans(n)
+    t_seq, seq = timeit(lambda: [mltest.test_batch(model, [fp])[0] for fp in fps])
+    t_bat, bat = timeit(lambda: mltest.test_batch(model, fps))
+
+    print(f'test_batch, {n} plans')
+    print(f'  one forward per plan: {t_seq*1e3:9.2f} ms')
+    print(f'  one batched forward:  {t_bat*1e3:9.2f} ms')
+    print(f'  max abs diff: {max_diff(bat, seq):.2e}')
+
+
+def benchmark_boundary_cache(model, n=20):
+    '''n candidate graphs on one boundary, as generated for one user session'''
+    rng = np.random.default_rng(3)
+    boundary = random_plan(rng).boundary
+    fps = []
+    for fp in random_floorplans(n):
+        fp.data.boundary = boundary
+        fps.append(fp)
+    run = lambda: [mltest.test(model, fp) for fp in fps]
+
+    boundary_cache.clear()
+    t1 = time.perf_counter()
+    cold = run()
+    t_cold = time.perf_counter() - t1
+    t_warm, warm = timeit(run)
+
+    print(f'boundary cache, {n} graphs on one boundary')
+    print(f'  first request (rasterize + inside_cnn once): {t_cold/n*1e3:8.2f} ms/graph')
+    print(f'  later requests (all cached):                {t_warm/n*1e3:8.2f} ms/graph')
+    print(f'  max abs diff: {max_diff(warm, cold):.2e}, hits {boundary_cache.hits}, misses {boundary_cache.misses}')
+
+
+def benchmark_decode(model, n_rooms=8, repeat=10):
+    '''full forward vs decode on a held encode_boundary result, the cost of one graph edit'''
+    device = next(model.parameters()).device
+    fp = random_floorplans(1, seed=n_rooms, n_rooms=(n_rooms, n_rooms + 1))[0]
+    boundary, inside_box, rooms, attrs, triples = mltest.get_data(fp, device)
+    flags = dict(generate=True, refine=True, relative=True)
+    with torch.no_grad():
+        inside_vecs = model.encode_boundary(boundary)
+        t_full, full = timeit(lambda: model(rooms, triples, boundary, attributes=attrs, inside_box=inside_box, **flags), repeat)
+        t_dec, dec = timeit(lambda: model.decode(rooms, triples, attrs, inside_vecs, inside_box, **flags), repeat)
+
+    print(f'encode_boundary + decode, {n_rooms} rooms')
+    print(f'  forward (encode + decode): {t_full*1e3:8.2f} ms')
+    print(f'  decode only:               {t_dec*1e3:8.2f} ms')
+    print(f'  max abs diff: {max((a - b).abs().max().item() for a, b in zip(full, dec)):.2e}')
+
+
+def benchmark_layout(device='cpu', room_counts=(8, 16), batch_sizes=(1, 20), D=384, H=128, repeat=5):
+    '''boxes_to_layout (grid_sample) vs boxes_to_layout_matmul at the refinement input size'''
+    device = torch.device(device)
+    print(f'boxes_to_layout, D={D}, {H}x{H}, device={device}')
+    for n_rooms in room_counts:
+        for B in batch_sizes:
+            O = n_rooms * B
+            vecs = torch.randn(O, D, device=device)
+            extents = torch.rand(O, 2, 2, device=device).sort(1)[0]
+            boxes = box_utils.extents_to_centers(extents.reshape(O, 4))
+            obj_to_img = torch.arange(B, device=device).repeat_interleave(n_rooms)
+
+            result = {}
+            for name, builder in LAYOUT_BUILDERS.items():
+                def run():
+                    out = builder(vecs, boxes, obj_to_img, H, H)
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize()
+                    return out
+                if device.type == 'cuda':
+                    torch.cuda.reset_peak_memory_stats(device)
+                    base = torch.cuda.memory_allocated(device)
+                with torch.no_grad():
+                    t, out = timeit(run, repeat)
+                # on CPU, the (O, D, H, W) float32 intermediate of grid_sample
+                peak = (torch.cuda.max_memory_allocated(device) - base if device.type == 'cuda'
+                        else (O * D * H * H * 4 if name == 'grid_sample' else O * H * H * 4))
+                result[name] = out
+                print(f'  {n_rooms:2d} rooms x {B:2d} plans, {name:11s}: {t*1e3:9.2f} ms, '
+                      f'{"peak" if device.type == "cuda" else "intermediate"} {peak/2**20:8.1f} MB')
+            print(f'    max abs diff: {(result["grid_sample"] - result["matmul"]).abs().max().item():.2e}')
+
+
+def get_triples_reference(data):
+    '''original per-edge loop of FloorPlan.get_triples'''
+    boxes = data.box[:, :4][:, [1, 0, 3, 2]]
+    triples = []
+    for u, v, _ in data.edge:
+        uy0, ux0, uy1, ux1 = boxes[u]
+        vy0, vx0, vy1, vx1 = boxes[v]
+        uc = (uy0 + uy1) / 2, (ux0 + ux1) / 2
+        if ux0 < vx0 and ux1 > vx1 and uy0 < vy0 and uy1 > vy1:
+            relation = 'surrounding'
+        elif ux0 >= vx0 and ux1 <= vx1 and uy0 >= vy0 and uy1 <= vy1:
+            relation = 'inside'
+        else:
+            relation = point_box_relation(uc, boxes[v])
+        triples.append([u, vocab['pred_name_to_idx'][relation], v])
+    return np.array(triples, dtype=int)
+
+
+def preprocess(test, train):
+    '''request preprocessing of get_userinfo: adapt the retrieved graph, then build the model inputs'''
+    fp = FloorPlan(test).adapt_graph(FloorPlan(train, train=True))
+    fp.adjust_graph()
+    return fp.get_test_data()
+
+
+def preprocess_reference(test, train):
+    '''preprocess with the original costs: three deep copies of the records and the per-edge relation loop'''
+    test, train = copy.deepcopy(test), copy.deepcopy(train)
+    fp = FloorPlan(test).adapt_graph(FloorPlan(train, train=True))
+    fp.data = copy.deepcopy(fp.data)
+    fp.adjust_graph()
+    return (fp.get_input_boundary(), fp.get_inside_box(), fp.get_rooms(), fp.get_attributes(),
+            torch.tensor(get_triples_reference(fp.data)).long())
+
+
+def benchmark_preprocess(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    pairs = [(random_plan(rng, int(rng.integers(6, 12))), random_plan(rng, int(rng.integers(6, 12)))) for _ in range(n)]
+    t_ref, ref = timeit(lambda: [preprocess_reference(*p) for p in pairs])
+    t_new, new = timeit(lambda: [preprocess(*p) for p in pairs])
+
+    print(f'preprocessing (adapt_graph + adjust_graph + get_test_data), {n} requests')
+    print(f'  deepcopy + per-edge loop: {t_ref/n*1e3:8.3f} ms/request')
+    print(f'  copy-on-write + arrays:   {t_new/n*1e3:8.3f} ms/request')
+    assert all(all(torch.equal(a, b) for a, b in zip(r, o)) for r, o in zip(ref, new))
+
+
+def benchmark_forward(model, room_counts=(4, 8, 12, 16), repeat=10):
+    '''latency of Model.forward(generate=True, refine=True, relative=True) for one plan'''
+    device = next(model.parameters()).device
+    print(f'Model.forward generate+refine, device={device}, threads={torch.get_num_threads()}, '
+          f'interop={torch.get_num_interop_threads()}')
+    for n_rooms in room_counts:
+        fp = random_floorplans(1, seed=n_rooms, n_rooms=(n_rooms, n_rooms + 1))[0]
+        boundary, inside_box, rooms, attrs, triples = mltest.get_data(fp, device)
+
+        def forward():
+            with torch.no_grad():
+                out = model(rooms, triples, boundary, obj_to_img=None, attributes=attrs, boxes_gt=None,
+                            generate=True, refine=True, relative=True, inside_box=inside_box)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            return out
+
+        forward()  # warm-up
+        times = []
+        for _ in range(repeat):
+            t1 = time.perf_counter()
+            forward()
+            times.append(time.perf_counter() - t1)
+        print(f'  {n_rooms:2d} rooms: median {np.median(times)*1e3:8.2f} ms, min {np.min(times)*1e3:8.2f} ms')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', default='cpu', help="cpu / cuda:0 / auto")
+    parser.add_argument('--threads', default=None, type=int, help='torch.set_num_threads')
+    parser.add_argument('--interop_threads', default=None, type=int, help='torch.set_num_interop_threads')
+    args = parser.parse_args()
+
+    mltest.set_cpu_threads(args.threads, args.interop_threads)
+    torch.manual_seed(0)
+    benchmark_preprocess()
+    benchmark_layout(mltest.get_device(args.device))
+    model = load_benchmark_model(args.device)
+    benchmark_forward(model)
+    benchmark_decode(model)
+    benchmark_test_batch(model)
+    benchmark_boundary_cache(model)
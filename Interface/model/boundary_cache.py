@@ -0,0 +1,86 @@
+"""
+Boundary Cache Module
+LRU cache of per-boundary model inputs, keyed by a content hash of the boundary.
+
+One user session generates many layouts on the same boundary (TransGraph,
+AdjustGraph, TransGraph_net, the LLM endpoints), so the rasterized input
+image, the inside box and the inside_cnn embedding are computed once and
+reused for every later generation on that boundary.
+"""
+import hashlib
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+
+def boundary_key(boundary):
+    '''content hash of the boundary points (x,y,dir,isNew)'''
+    b = np.ascontiguousarray(np.asarray(boundary), dtype=np.int64)
+    return hashlib.sha1(b.tobytes() + str(b.shape).encode()).hexdigest()
+
+
+_model_versions = weakref.WeakKeyDictionary()
+_next_version = itertools.count()
+_version_lock = threading.Lock()
+
+
+def model_version(model):
+    '''
+    number of the model object in this process, part of the key of its cached
+    outputs; unlike id(model) it is never reused by a model loaded (or quantized,
+    copied) after this one is freed
+    '''
+    with _version_lock:
+        version = _model_versions.get(model)
+        if version is None:
+            version = _model_versions[model] = next(_next_version)
+        return version
+
+
+class BoundaryCache():
+    def __init__(self, maxsize=128):
+        '''
+        maxsize: number of boundaries kept, the least recently used one is dropped first
+        '''
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, name, compute=None):
+        '''
+        key: boundary_key of the boundary
+        name: cached item, e.g. 'input_boundary', 'inside_box', ('inside_vecs', model_version(model))
+        compute: called on a miss, its result is cached; None only looks up
+        return: the cached value, or None on a miss without compute
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and name in entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[name]
+        if compute is None:
+            return None
+        value = compute()
+        self.put(key, name, value)
+        return value
+
+    def put(self, key, name, value):
+        with self._lock:
+            self.misses += 1
+            self._entries.setdefault(key, {})[name] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# shared by all FloorPlans / model calls of the process
+boundary_cache = BoundaryCache()
@@ -0,0 +1,319 @@
+"""
+Corpus Store Module
+Packed, memory-mapped storage for the training corpus (data_train_converted.pkl).
+
+Every variable-length field (boundary points, boxes, edges, order, rBoundary,
+turning functions) is stored as one flat .npy array plus an offset table, so the
+whole corpus is opened with np.load(mmap_mode='r') in milliseconds and all worker
+processes share the same pages through the OS cache.
+
+Convert once from the existing pickle:
+    python -m model.corpus_store ./static/Data/data_train_converted.pkl ./static/Data/train_store
+"""
+import os
+import json
+import shutil
+import pickle
+import numpy as np
+
+STORE_VERSION = 1
+
+# field name -> number of columns of each row (None: 1-D per record)
+RAGGED_FIELDS = {
+    'boundary': 4,
+    'box': 5,
+    'edge': 3,
+    'order': None,
+}
+
+
+class RaggedArray():
+    def __init__(self, values, offsets):
+        '''
+        values: flat array, rows of all records concatenated
+        offsets: (n+1,) array, rows of record i are values[offsets[i]:offsets[i+1]]
+        '''
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @staticmethod
+    def pack(arrays, ncols=None, dtype=None):
+        '''
+        arrays: list of arrays, one per record
+        return: values, offsets
+        '''
+        if ncols is None:
+            arrays = [np.atleast_1d(np.asarray(a)).reshape(-1) for a in arrays]
+        else:
+            arrays = [np.asarray(a).reshape(-1, ncols) for a in arrays]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+        if dtype is None:
+            # empty matlab arrays load as float64, they must not upcast integer fields
+            nonempty = [a.dtype for a in arrays if a.size]
+            dtype = np.result_type(*nonempty) if nonempty else np.float64
+        if len(arrays):
+            values = np.concatenate([a.astype(dtype, copy=False) for a in arrays])
+        else:
+            values = np.zeros((0,) if ncols is None else (0, ncols), dtype=dtype)
+        return values, offsets
+
+
+class TrainRecord():
+    '''Plain in-memory record, same attributes as the unpickled mat_struct.'''
+
+    def __init__(self, name, boundary, box, edge, order, rBoundary):
+        self.name = name
+        self.boundary = boundary
+        self.box = box
+        self.edge = edge
+        self.order = order
+        self.rBoundary = rBoundary
+
+
+class CorpusRecord():
+    '''
+    Lazy view of one training plan, acts like train_data[i].
+    Arrays are read-only slices of the memory-mapped store; copy.deepcopy
+    (as done by FloorPlan) returns a writable TrainRecord.
+    '''
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = int(index)
+
+    @property
+    def name(self):
+        return str(self._store.names[self._index])
+
+    @property
+    def boundary(self):
+        return self._store.fields['boundary'][self._index]
+
+    @property
+    def box(self):
+        return self._store.fields['box'][self._index]
+
+    @property
+    def edge(self):
+        return self._store.fields['edge'][self._index]
+
+    @property
+    def order(self):
+        return self._store.fields['order'][self._index]
+
+    @property
+    def rBoundary(self):
+        rooms = self._store.room_offsets[self._index:self._index + 2]
+        return [self._store.room_points[r] for r in range(rooms[0], rooms[1])]
+
+    def materialize(self):
+        return TrainRecord(
+            self.name,
+            np.array(self.boundary),
+            np.array(self.box),
+            np.array(self.edge),
+            np.array(self.order),
+            [np.array(rb) for rb in self.rBoundary]
+        )
+
+    def __deepcopy__(self, memo):
+        return self.materialize()
+
+    def __repr__(self):
+        return f'CorpusRecord({self._index}, name={self.name})'
+
+
+class CorpusStore():
+    def __init__(self, store_dir, mmap_mode='r'):
+        '''
+        store_dir: directory written by convert_pickle
+        mmap_mode: passed to np.load, None loads everything into memory
+        '''
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported corpus store version {self.meta['version']} in {store_dir}")
+
+        load = lambda name: np.load(os.path.join(store_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        self.names = load('names')
+        self.fields = {
+            field: RaggedArray(load(field), load(f'{field}_offsets'))
+            for field in RAGGED_FIELDS
+        }
+        # rBoundary: plan -> rooms -> points
+        self.room_offsets = load('rBoundary_room_offsets')
+        self.room_points = RaggedArray(load('rBoundary'), load('rBoundary_offsets'))
+        # turning function of each plan (trainTF)
+        self.tf_x = RaggedArray(load('tf_x'), load('tf_offsets'))
+        self.tf_y = RaggedArray(load('tf_y'), load('tf_offsets'))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        '''
+        int index -> CorpusRecord
+        array/list/slice index -> object array of CorpusRecord (same as indexing the pickled data array)
+        '''
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f'index {index} out of range for corpus of size {len(self)}')
+            return CorpusRecord(self, index)
+        indices = np.arange(len(self))[index]
+        records = np.empty(len(indices), dtype=object)
+        for i, idx in enumerate(indices):
+            records[i] = CorpusRecord(self, idx)
+        return records
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield CorpusRecord(self, i)
+
+    def name_list(self):
+        return self.names.tolist()
+
+    def turning_function(self, index):
+        return {'x': self.tf_x[index], 'y': self.tf_y[index]}
+
+    def turning_functions(self):
+        '''Lazy sequence of turning functions, acts like the trainTF list.'''
+        return TurningFunctions(self)
+
+
+class TurningFunctions():
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, index):
+        return self._store.turning_function(index)
+
+
+class ConcatSequence():
+    '''
+    Read-only concatenation of record sequences (pickled data array, CorpusStore,
+    trainTF list, TurningFunctions), indexed like one train_data / trainTF.
+    '''
+
+    def __init__(self, parts):
+        self.parts = list(parts)
+        self.starts = np.cumsum([0] + [len(p) for p in self.parts])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f'index {index} out of range for corpus of size {len(self)}')
+            p = int(np.searchsorted(self.starts, index, side='right')) - 1
+            return self.parts[p][int(index - self.starts[p])]
+        indices = np.arange(len(self))[index]
+        records = np.empty(len(indices), dtype=object)
+        for i, idx in enumerate(indices):
+            records[i] = self[int(idx)]
+        return records
+
+    def __iter__(self):
+        for part in self.parts:
+            for i in range(len(part)):
+                yield part[i]
+
+
+def _as_room_list(rBoundary):
+    # loadmat(squeeze_me=True) returns a 2-D array for single-room plans
+    if isinstance(rBoundary, np.ndarray) and rBoundary.dtype != object:
+        return [rBoundary]
+    return [np.asarray(rb) for rb in rBoundary]
+
+
+def write_store(store_dir, names, records, trainTF):
+    '''
+    names: list of plan names
+    records: sequence of objects with boundary/box/edge/order/rBoundary
+    trainTF: sequence of turning functions with x,y (dict or mat_struct)
+    '''
+    tmp_dir = store_dir.rstrip('/\\') + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    save = lambda name, arr: np.save(os.path.join(tmp_dir, f'{name}.npy'), arr)
+
+    save('names', np.array([str(n) for n in names]))
+    for field, ncols in RAGGED_FIELDS.items():
+        values, offsets = RaggedArray.pack([getattr(d, field) for d in records], ncols)
+        save(field, values)
+        save(f'{field}_offsets', offsets)
+
+    rooms = [_as_room_list(d.rBoundary) for d in records]
+    room_offsets = np.zeros(len(rooms) + 1, dtype=np.int64)
+    room_offsets[1:] = np.cumsum([len(r) for r in rooms])
+    values, offsets = RaggedArray.pack([rb for r in rooms for rb in r], 2)
+    save('rBoundary_room_offsets', room_offsets)
+    save('rBoundary', values)
+    save('rBoundary_offsets', offsets)
+
+    get = lambda tf, key: tf[key] if isinstance(tf, dict) else getattr(tf, key)
+    tf_x, tf_offsets = RaggedArray.pack([get(tf, 'x') for tf in trainTF], dtype=np.float64)
+    tf_y, _ = RaggedArray.pack([get(tf, 'y') for tf in trainTF], dtype=np.float64)
+    save('tf_x', tf_x)
+    save('tf_y', tf_y)
+    save('tf_offsets', tf_offsets)
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({'version': STORE_VERSION, 'size': len(names)}, f)
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.rename(tmp_dir, store_dir)
+
+
+def convert_pickle(pkl_path, store_dir):
+    '''One-shot conversion of data_train_converted.pkl into a corpus store.'''
+    data = pickle.load(open(pkl_path, 'rb'))
+    write_store(store_dir, list(data['nameList']), data['data'], data['trainTF'])
+    return CorpusStore(store_dir)
+
+
+def open_store(store_dir):
+    '''Return the CorpusStore in store_dir, or None if it has not been converted yet.'''
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return None
+    return CorpusStore(store_dir)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Convert data_train_converted.pkl to a memory-mapped corpus store')
+    parser.add_argument('pkl_path', nargs='?', default='./static/Data/data_train_converted.pkl')
+    parser.add_argument('store_dir', nargs='?', default='./static/Data/train_store')
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    store = convert_pickle(args.pkl_path, args.store_dir)
+    t2 = time.perf_counter()
+    print(f'converted {len(store)} plans to {args.store_dir} in {t2 - t1:.2f}s')
+
+    t1 = time.perf_counter()
+    store = CorpusStore(args.store_dir)
+    t2 = time.perf_counter()
+    print(f'open store: {t2 - t1:.4f}s')
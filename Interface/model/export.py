@@ -0,0 +1,122 @@
+"""
+TorchScript export of Model for serving.
+
+The serving configuration is fixed (one plan per call, generate=True,
+refine=True, relative=True), so the Python branching of Model.forward is
+traced away and the graph is frozen (weights inlined, conv+bn folded).
+
+Export and check parity/latency against the eager model (from the Interface directory):
+    python -m model.export --out ./model/model_traced.pt
+Serve it by setting MODEL_TRACED=./model/model_traced.pt (see model/test.py::load_model).
+"""
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class InferenceModel(nn.Module):
+    '''Model.forward with the serving configuration bound, the module that is traced.'''
+
+    def __init__(self, model):
+        super(InferenceModel, self).__init__()
+        self.model = model
+
+    def forward(self, objs, triples, boundary, attributes, inside_box):
+        return self.model(
+            objs,
+            triples,
+            boundary,
+            obj_to_img=None,
+            attributes=attributes,
+            boxes_gt=None,
+            generate=True,
+            refine=True,
+            relative=True,
+            inside_box=inside_box
+        )
+
+
+class TracedModel():
+    '''
+    Loaded traced module, called like InferenceModel.
+    Keeps the device, since a frozen module has no parameters to read it from.
+    '''
+
+    def __init__(self, module, device):
+        self.module = module
+        self.device = device
+
+    def __call__(self, objs, triples, boundary, attributes, inside_box):
+        return self.module(objs, triples, boundary, attributes, inside_box)
+
+    def share_memory(self):
+        self.module.share_memory()
+        return self
+
+
+def export(model, example_inputs, path, check_inputs=None, freeze=True):
+    '''
+    model: eager Model in eval mode
+    example_inputs: (objs, triples, boundary, attributes, inside_box) of one plan
+    check_inputs: list of other input tuples (e.g. other room counts) the trace is checked on
+    '''
+    model.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(InferenceModel(model), example_inputs, check_inputs=check_inputs)
+        if freeze:
+            traced = torch.jit.freeze(traced)
+    traced.save(path)
+    return traced
+
+
+def load_traced(path, device):
+    device = torch.device(device)
+    module = torch.jit.load(path, map_location=device)
+    module.eval()
+    return TracedModel(module, device)
+
+
+if __name__ == "__main__":
+    import argparse
+    import model.test as mltest
+    from model.benchmark import random_floorplans, load_benchmark_model
+
+    parser = argparse.ArgumentParser(description='Trace Model for generate+refine+relative inference')
+    parser.add_argument('--out', default='./model/model_traced.pt')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--no_freeze', action='store_true')
+    parser.add_argument('--num_plans', default=50, type=int)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    mltest.set_cpu_threads()
+    model = load_benchmark_model(args.device)
+    device = mltest.get_device(args.device)
+    inputs = lambda fp: tuple(mltest.get_data(fp, device)[i] for i in [2, 4, 0, 3, 1])
+
+    examples = random_floorplans(3, seed=1, n_rooms=(4, 14))
+    export(model, inputs(examples[0]), args.out, check_inputs=[inputs(fp) for fp in examples[1:]],
+           freeze=not args.no_freeze)
+    traced = load_traced(args.out, device)
+    print(f'exported {args.out}')
+
+    # parity on boxes and gene_layout, latency of eager vs traced
+    fps = random_floorplans(args.num_plans, seed=2, n_rooms=(4, 14))
+    box_diff, layout_diff, t_eager, t_traced = [], [], [], []
+    with torch.no_grad():
+        for fp in fps:
+            x = inputs(fp)
+            t1 = time.perf_counter()
+            eager = InferenceModel(model)(*x)
+            t2 = time.perf_counter()
+            out = traced(*x)
+            t3 = time.perf_counter()
+            t_eager.append(t2 - t1)
+            t_traced.append(t3 - t2)
+            box_diff.append(max((a - b).abs().max().item() for a, b in zip(eager[::2], out[::2])))
+            layout_diff.append((eager[1] - out[1]).abs().max().item())
+
+    print(f'parity over {len(fps)} plans: boxes max abs diff {max(box_diff):.2e}, gene_layout max abs diff {max(layout_diff):.2e}')
+    print(f'latency ({device}): eager median {np.median(t_eager)*1e3:.2f} ms, traced median {np.median(t_traced)*1e3:.2f} ms')
+    assert max(box_diff) < 1e-4 and max(layout_diff) < 1e-3
@@ -2,23 +2,64 @@ import torch
 import scipy.io as sio
 import numpy as np
 import cv2
-import copy
 from model.utils import *
+from model.boundary_cache import boundary_cache, boundary_key
+
+
+class PlanData():
+    '''
+    Copy-on-write view of a plan record (test/train datum, DynamicData, ...).
+    Reads fall through to the source record, assignments stay on the view,
+    so FloorPlan never writes into the shared data: it assigns modified
+    copies of the arrays it changes instead of deep-copying the whole record.
+    '''
+
+    def __init__(self, source):
+        if isinstance(source, PlanData):
+            # flatten, keep the fields already overridden by the other view
+            self.__dict__.update(source.__dict__)
+        else:
+            self._source = source
+
+    def __getattr__(self, name):
+        # only called for fields not assigned on this view
+        if name == '_source':
+            raise AttributeError(name)
+        return getattr(self._source, name)
+
+    def to_dict(self):
+        '''
+        fields of the source record with the ones assigned on this view, as
+        sio.savemat writes a record (public attributes only). savemat does not
+        see the fields read through _source, save views as
+        sio.savemat(path, {'data': view.to_dict()})
+        '''
+        source = self._source
+        if hasattr(source, 'materialize'):
+            # CorpusRecord: fields are properties over the memory-mapped store
+            source = source.materialize()
+        fields = {k: v for k, v in vars(source).items() if not k.startswith('_')}
+        fields.update((k, v) for k, v in self.__dict__.items() if not k.startswith('_'))
+        return fields
 
 
 class FloorPlan():
 
     def __init__(self, data, train=False, rot=None):
-        self.data = copy.deepcopy(data)
+        self.data = PlanData(data)
         self._get_rot()
         if rot is not None:
             if train:
                 boxes = self.data.box[:, :4][:, [1, 0, 3, 2]]
                 boxes = align_box(boxes, self.rot, rot)[:, [1, 0, 3, 2]]
-                self.data.box[:, :4] = boxes
+                box = np.array(self.data.box)
+                box[:, :4] = boxes
+                self.data.box = box
             points = self.data.boundary[:, :2][:, [1, 0]]
             points = align_points(points, self.rot, rot)[:, [1, 0]]
-            self.data.boundary[:, :2] = points
+            boundary = np.array(self.data.boundary)
+            boundary[:, :2] = points
+            self.data.boundary = boundary
             self._get_rot()
 
     def _get_rot(self):
@@ -27,7 +68,15 @@ class FloorPlan():
         theta = np.arctan2(c[1], c[0]) + np.pi  # [-pi,pi]
         self.rot = theta
 
+    def boundary_key(self):
+        return boundary_key(self.data.boundary)
+
     def get_input_boundary(self, tensor=True):
+        if tensor:
+            # rasterized once per boundary, see model/boundary_cache.py
+            return boundary_cache.get(
+                self.boundary_key(), 'input_boundary',
+                lambda: torch.tensor(self.get_input_boundary(tensor=False)).permute((2, 0, 1)).float())
         external = self.data.boundary[:, :2]
         door = self.data.boundary[:2, :2]
 
@@ -44,17 +93,19 @@ class FloorPlan():
         cv2.polylines(front, pts_door.reshape(1, -1, 2), True, 1.0, 3)
 
         input_image = np.stack([inside, boundary, front], -1)
-        if tensor: input_image = torch.tensor(input_image).permute((2, 0, 1)).float()
         return input_image
 
     def get_inside_box(self, tensor=True):
+        if tensor:
+            return boundary_cache.get(
+                self.boundary_key(), 'inside_box',
+                lambda: torch.tensor(self.get_inside_box(tensor=False)).float())
         external = self.data.boundary[:, :2]
 
         X, Y = np.linspace(0, 1, 256), np.linspace(0, 1, 256)
         x0, x1 = np.min(external[:, 0]), np.max(external[:, 0])
         y0, y1 = np.min(external[:, 1]), np.max(external[:, 1])
         box = np.array([[X[x0], Y[y0], X[x1], Y[y1]]])
-        if tensor: box = torch.tensor(box).float()
         return box
 
     def get_rooms(self, tensor=True):
@@ -83,36 +134,26 @@ class FloorPlan():
         abins = np.linspace(0,1,alevel+1) # [1,gsize]
         abins[0],abins[-1]=-np.inf,np.inf
 
-        attributes = np.zeros((l,gsize*gsize+alevel))
+        rows = np.arange(l)
+        attributes = np.zeros((l,gsize*gsize+alevel),dtype=np.float32)
         # pos: xc*gsize+yc*gsize*gsize
-        attributes[range(l),(np.digitize(boxes[:,0],gbins)-1)*gsize+np.digitize(boxes[:,1],gbins)-1]=1
+        attributes[rows,(np.digitize(boxes[:,0],gbins)-1)*gsize+np.digitize(boxes[:,1],gbins)-1]=1
         # area:(w*h)
-        attributes[range(l),gsize*gsize+np.digitize(boxes[:,2:].prod(1),abins)-1]=1
+        attributes[rows,gsize*gsize+np.digitize(boxes[:,2:].prod(1),abins)-1]=1
         if tensor: attributes = torch.tensor(attributes).float()
         return attributes
 
     def get_triples(self, random=False, tensor=True):
         boxes = self.data.box[:, :4][:, [1, 0, 3, 2]]
-
-        triples = []
-        # add edge relation
-        for u, v, _ in self.data.edge:
-            uy0, ux0, uy1, ux1 = boxes[u]
-            vy0, vx0, vy1, vx1 = boxes[v]
-            uc = (uy0 + uy1) / 2, (ux0 + ux1) / 2
-            vc = (vy0 + vy1) / 2, (vx0 + vx1) / 2
-
-            # surrounding/inside -> X four quadrants
-            if ux0 < vx0 and ux1 > vx1 and uy0 < vy0 and uy1 > vy1:
-                relation = 'surrounding'
-            elif ux0 >= vx0 and ux1 <= vx1 and uy0 >= vy0 and uy1 <= vy1:
-                relation = 'inside'
-            else:
-                relation = point_box_relation(uc, boxes[v])
-
-            triples.append([u, vocab['pred_name_to_idx'][relation], v])
-
-        triples = np.array(triples, dtype=int)
+        edge = np.asarray(self.data.edge).reshape(-1, 3)[:, :2].astype(int)
+
+        # add edge relation: surrounding/inside -> X four quadrants, all edges at once
+        if len(edge):
+            relations = edge_relations(boxes[edge[:, 0]], boxes[edge[:, 1]])
+            predicates = [vocab['pred_name_to_idx'][relation] for relation in relations]
+            triples = np.stack([edge[:, 0], predicates, edge[:, 1]], 1)
+        else:
+            triples = np.array([], dtype=int)
         if tensor: triples = torch.tensor(triples).long()
         return triples
 
@@ -154,7 +195,9 @@ class FloorPlan():
         box_adapter = lambda box: (((box - np.array([gx0, gy0, gx0, gy0])) * np.array([bw, bh, bw, bh])) / np.array(
             [gw, gh, gw, gh]) + np.array([bx0, by0, bx0, by0])).astype(int)
 
-        fp.data.box[:, :4] = np.apply_along_axis(box_adapter, 1, fp.data.box[:, :4])
+        box = np.array(fp.data.box)
+        box[:, :4] = box_adapter(box[:, :4])
+        fp.data.box = box
         return fp
 
     def adjust_graph(self):
@@ -200,6 +243,8 @@ class FloorPlan():
             [1, 0, 1, 0]
         ])
 
+        if outside_rooms:
+            self.data.box = np.array(self.data.box)
         for i, coords55 in outside_rooms:
             deltas = candicate_coords55[i]
             idx = np.argmin(deltas)
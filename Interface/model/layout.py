@@ -64,6 +64,59 @@ def boxes_to_layout(vecs, boxes, obj_to_img, H, W=None, pooling='sum'):
   return out
 
 
+def boxes_to_masks(boxes, H, W=None):
+  """
+  Inputs:
+  - boxes: Tensor of shape (O, 4) giving bounding boxes in the format
+    [x0, y0, x1, y1] in the [0, 1] coordinate space
+  - H, W: Size of the output
+
+  Returns:
+  - masks: Tensor of shape (O, H, W), the box masks sampled as in
+    boxes_to_layout (soft at the box edges)
+  """
+  O = boxes.size(0)
+  if W is None:
+    W = H
+  grid = _boxes_to_grid(boxes, H, W)
+  ones = torch.ones(O, 1, 8, 8, dtype=boxes.dtype, device=boxes.device)
+  return F.grid_sample(ones, grid).view(O, H, W)
+
+
+def boxes_to_layout_matmul(vecs, boxes, obj_to_img, H, W=None, pooling='sum'):
+  """
+  Same output as boxes_to_layout without the (O, D, H, W) intermediate:
+  grid_sample of a constant image is the vector times the sampled box mask,
+  so the box masks are rasterized once (O, H, W) and each image is one
+  matmul of its object vectors with the masks.
+
+  Inputs and outputs are the same as boxes_to_layout; pooling='max' is not
+  linear in the masks and falls back to boxes_to_layout.
+  """
+  if pooling == 'max':
+    return boxes_to_layout(vecs, boxes, obj_to_img, H, W, pooling=pooling)
+  O, D = vecs.size()
+  if W is None:
+    W = H
+  N = obj_to_img.data.max().item() + 1
+
+  masks = boxes_to_masks(boxes, H, W).view(O, H * W)
+  # (N, O) one-hot image assignment, weighted by 1/count for avg pooling
+  assign = torch.zeros(N, O, dtype=vecs.dtype, device=vecs.device)
+  assign[obj_to_img, torch.arange(O, device=vecs.device)] = 1
+  if pooling == 'avg':
+    assign = assign / assign.sum(1, keepdim=True).clamp(min=1)
+  img_vecs = assign.view(N, O, 1) * vecs.view(1, O, D)     # (N, O, D)
+  out = torch.matmul(img_vecs.transpose(1, 2), masks)      # (N, D, H*W)
+  return out.view(N, D, H, W)
+
+
+LAYOUT_BUILDERS = {
+  'grid_sample': boxes_to_layout,
+  'matmul': boxes_to_layout_matmul,
+}
+
+
 def masks_to_layout(vecs, boxes, masks, obj_to_img, H, W=None, pooling='sum'):
   """
   Inputs:
@@ -158,13 +211,11 @@ def _pool_samples(samples, obj_to_img, pooling='sum'):
     obj_counts = obj_counts.clamp(min=1)
     out = out / obj_counts.view(N, 1, 1, 1)
   elif pooling == 'max':
-    all_out = []
-    obj_to_img_list = [i.item() for i in list(obj_to_img)]
-    for i in range(N):
-        start = obj_to_img_list.index(i)
-        end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
-        all_out.append(torch.max(samples[start:end, :, :, :], dim=0)[0])
-    out = torch.stack(all_out)
+    if hasattr(out, 'scatter_reduce'):
+      out = out.scatter_reduce(0, idx, samples, reduce='amax', include_self=False)
+    else:
+      # torch < 1.12 has no scatter_reduce: one masked max per image
+      out = torch.stack([samples[obj_to_img == i].max(0)[0] for i in range(N)])
   elif pooling == 'sum':
     out = out.scatter_add(0, idx, samples)
     #raise ValueError('Invalid pooling "%s"' % pooling)
@@ -194,17 +245,7 @@ def masks_to_seg(boxes, masks, objs, obj_to_img, H, W=None, num_classes=15):
   N = obj_to_img.data.max().item() + 1
   grid = _boxes_to_grid(boxes, H, W)
   mask_sampled = F.grid_sample(masks.float().view(O, 1, M, M), grid)
-  seg = torch.zeros((N,num_classes,H,W)).to(device)
-  # obj_to_img_list = [i.item() for i in list(obj_to_img)]
-  for i in range(N):
-    obj_to_i = (obj_to_img==i).nonzero().view(-1)
-    # start = obj_to_img_list.index(i)
-    # end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
-    # for j in range(start,end):
-    for j in obj_to_i:
-      obj = objs[j]
-      seg[i,obj]=seg[i,obj]+mask_sampled[j]
-  return seg
+  return _sum_seg(mask_sampled, objs, obj_to_img, N, num_classes)
 
 def boxes_to_seg(boxes, objs, obj_to_img, H, W=None,num_classes=15):
   """
@@ -229,17 +270,24 @@ def boxes_to_seg(boxes, objs, obj_to_img, H, W=None,num_classes=15):
   grid = _boxes_to_grid(boxes, H, W)
   mask_sampled = F.grid_sample(torch.ones(O,1,8,8).to(boxes), grid)
   
-  seg = torch.zeros((N,num_classes,H,W)).to(device)
-  obj_to_img_list = [i.item() for i in list(obj_to_img)]
-  for i in range(N):
-    start = obj_to_img_list.index(i)
-    end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
-    for j in range(start,end):
-    #obj_to_i = (obj_to_img==i).nonzero().view(-1)
-    #for j in obj_to_i:
-      obj = objs[j]
-      seg[i,obj]=seg[i,obj]+mask_sampled[j]
-  return seg
+  return _sum_seg(mask_sampled, objs, obj_to_img, N, num_classes)
+
+
+def _sum_seg(mask_sampled, objs, obj_to_img, N, num_classes):
+  """
+  Input:
+  - mask_sampled: FloatTensor of shape (O, 1, H, W)
+  - objs: LongTensor of shape (O,) giving the class of each object
+  - obj_to_img: LongTensor of shape (O,) mapping objects to images
+
+  Output:
+  - seg: FloatTensor of shape (N, num_classes, H, W), seg[i, c] is the sum
+    of the masks of the objects of class c in image i
+  """
+  O, _, H, W = mask_sampled.size()
+  seg = torch.zeros(N * num_classes, H * W, dtype=mask_sampled.dtype, device=mask_sampled.device)
+  seg.index_add_(0, obj_to_img * num_classes + objs, mask_sampled.view(O, H * W))
+  return seg.view(N, num_classes, H, W)
 
 if __name__ == '__main__':
   vecs = torch.FloatTensor([
@@ -22,7 +22,7 @@ from torchvision.ops import RoIAlign
 
 import model.box_utils as box_utils
 from model.graph import GraphTripleConv, GraphTripleConvNet
-from model.layout import boxes_to_layout, masks_to_layout, boxes_to_seg, masks_to_seg
+from model.layout import boxes_to_layout, masks_to_layout, boxes_to_seg, masks_to_seg, LAYOUT_BUILDERS
 from model.layers import build_mlp,build_cnn
 from model.utils import vocab
 
@@ -49,7 +49,9 @@ class Model(nn.Module):
               mlp_activation='leakyrelu',
               mlp_normalization='none',
               cnn_activation='leakyrelu',
-              cnn_normalization='batch'
+              cnn_normalization='batch',
+              # layout: grid_sample / matmul, see model/layout.py
+              layout_builder='grid_sample'
               ):
     super(Model, self).__init__()
     ''' embedding '''
@@ -61,6 +63,7 @@ class Model(nn.Module):
     self.pred_embeddings = nn.Embedding(num_preds, embedding_dim)
     self.image_size = image_size
     self.feature_dim = embedding_dim+attribute_dim
+    self.boxes_to_layout = LAYOUT_BUILDERS[layout_builder]
 
     ''' graph_net '''
     self.gconv = GraphTripleConv(
@@ -140,7 +143,8 @@ class Model(nn.Module):
     generate=False,
     refine=False,
     relative=False,
-    inside_box=None
+    inside_box=None,
+    inside_vecs=None
     ):
     """
     Required Inputs:
@@ -154,13 +158,59 @@ class Model(nn.Module):
       all objects are assumed to belong to the same image.
     - boxes_gt: FloatTensor of shape (O, 4) giving boxes to use for computing
       the spatial layout; if not given then use predicted boxes.
+    - inside_vecs: FloatTensor of shape (B, D) giving encode_boundary(boundary) computed
+      before (e.g. cached per boundary); if not given then computed from boundary.
+    """
+    if inside_vecs is None:
+      inside_vecs = self.encode_boundary(boundary)
+    return self.decode(
+      objs,
+      triples,
+      attributes,
+      inside_vecs,
+      inside_box,
+      obj_to_img=obj_to_img,
+      boxes_gt=boxes_gt,
+      generate=generate,
+      refine=refine,
+      relative=relative
+    )
+
+  def encode_boundary(self, boundary):
+    """
+    Inputs:
+    - boundary: FloatTensor of shape (B, 3, H, W), see FloorPlan.get_input_boundary
+
+    Returns:
+    - inside_vecs: FloatTensor of shape (B, D), depends on the boundary only and
+      can be kept for every graph decoded on the same boundary
+    """
+    B = boundary.size(0)
+    return self.inside_cnn(boundary).view(B,-1)
+
+  def decode(
+    self,
+    objs,
+    triples,
+    attributes,
+    inside_vecs,
+    inside_box=None,
+    obj_to_img=None,
+    boxes_gt=None,
+    generate=False,
+    refine=False,
+    relative=False
+    ):
+    """
+    Graph stage of forward: GCN, box_net, refinement_net and box refine
+    on the boundary encoding inside_vecs from encode_boundary.
+    Inputs are the same as forward.
     """
     # input size
     O, T = objs.size(0), triples.size(0)
     s, p, o = triples.chunk(3, dim=1)           # All have shape (T, 1)
     s, p, o = [x.squeeze(1) for x in [s, p, o]] # Now have shape (T,)
     edges = torch.stack([s, o], dim=1)          # Shape is (T, 2)
-    B = boundary.size(0)
     H, W = self.image_size
   
     if obj_to_img is None:
@@ -180,7 +230,6 @@ class Model(nn.Module):
     obj_vecs, pred_vecs = self.gconv_net(obj_vecs, pred_vecs, edges)
 
     ''' inside '''
-    inside_vecs = self.inside_cnn(boundary).view(B,-1)
     obj_vecs = torch.cat([obj_vecs,inside_vecs[obj_to_img]],dim=1)
 
     ''' box '''
@@ -196,7 +245,7 @@ class Model(nn.Module):
     boxes_refine = None
     layout_boxes = boxes_pred if boxes_gt is None else boxes_gt
     if generate:
-      layout_features = boxes_to_layout(obj_vecs,layout_boxes,obj_to_img,H,W)
+      layout_features = self.boxes_to_layout(obj_vecs,layout_boxes,obj_to_img,H,W)
       gene_layout = self.refinement_net(layout_features)
       
     ''' box refine '''
@@ -0,0 +1,48 @@
+"""
+Name Registry Module
+List of plan names with a dict index, so name -> index lookups are O(1)
+instead of a list.index scan over ~75k names.
+"""
+
+
+class NameRegistry(list):
+    '''
+    Drop-in replacement for testNameList / trainNameList.
+    Behaves like a list; index / __contains__ use the hash map, append keeps it in sync.
+    '''
+
+    def __init__(self, names=()):
+        super(NameRegistry, self).__init__(str(n) for n in names)
+        self._index = {}
+        for i, name in enumerate(self):
+            # keep the first occurrence, same as list.index
+            self._index.setdefault(name, i)
+
+    def index(self, name, *args):
+        if args:
+            return super(NameRegistry, self).index(name, *args)
+        try:
+            return self._index[name]
+        except KeyError:
+            raise ValueError(f'{name!r} is not in list') from None
+
+    def get(self, name, default=None):
+        return self._index.get(name, default)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def append(self, name):
+        name = str(name)
+        self._index.setdefault(name, len(self))
+        super(NameRegistry, self).append(name)
+
+    def extend(self, names):
+        for name in names:
+            self.append(name)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('NameRegistry only supports append/extend, rebuild it to reorder or remove names')
+
+    insert = remove = pop = clear = sort = reverse = _readonly
+    __setitem__ = __delitem__ = __iadd__ = _readonly
@@ -0,0 +1,168 @@
+"""
+Int8 quantization of Model for CPU inference.
+
+- dynamic: Linear layers of the GCN / MLP heads (gconv, gconv_net, box_net, box_reg)
+  are quantized to int8 with per-call activation scales, no calibration needed.
+  Enabled at load time with MODEL_QUANTIZE=dynamic (see model/test.py::load_model).
+- static (optional): the inside_cnn and refinement_net convs are also quantized,
+  with activation ranges calibrated over test-set plans. The calibrated model is
+  exported as a traced module and served with MODEL_TRACED.
+
+Calibrate and report box IoU / latency against the float model (from the Interface directory):
+    python -m model.quantize --mode dynamic
+    python -m model.quantize --mode static --num_calib 200 --out ./model/model_int8_traced.pt
+"""
+import copy
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+try:
+    import torch.ao.quantization as tq
+except ImportError:
+    import torch.quantization as tq
+
+DYNAMIC_MODULES = ('gconv', 'gconv_net', 'box_net', 'box_reg')
+STATIC_MODULES = ('inside_cnn', 'refinement_net')
+
+
+class StaticQuantWrapper(nn.Module):
+    '''Quantizes the input of a float conv stack and dequantizes its output.'''
+
+    def __init__(self, module):
+        super(StaticQuantWrapper, self).__init__()
+        self.quant = tq.QuantStub()
+        self.module = module
+        self.dequant = tq.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.module(self.quant(x)))
+
+
+def quantize_dynamic(model):
+    '''
+    model: float Model in eval mode (CPU)
+    return: copy of model with int8 dynamic Linear layers in DYNAMIC_MODULES
+    '''
+    return tq.quantize_dynamic(
+        copy.deepcopy(model).eval(),
+        qconfig_spec=set(DYNAMIC_MODULES),
+        dtype=torch.qint8
+    )
+
+
+def prepare_static(model, backend='fbgemm'):
+    '''
+    return: copy of model with observers on the STATIC_MODULES convs,
+        run calibration batches through it, then call convert_static
+    '''
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).eval()
+    for name in STATIC_MODULES:
+        wrapper = StaticQuantWrapper(getattr(model, name))
+        wrapper.qconfig = tq.get_default_qconfig(backend)
+        setattr(model, name, wrapper)
+    tq.prepare(model, inplace=True)
+    return model
+
+
+def convert_static(prepared):
+    '''return: int8 model, the Linear layers of DYNAMIC_MODULES are quantized dynamically too'''
+    tq.convert(prepared, inplace=True)
+    return quantize_dynamic(prepared)
+
+
+def box_iou(boxes1, boxes2):
+    '''
+    boxes1, boxes2: (O, 4) boxes (x0, y0, x1, y1), matched row by row
+    return: (O,) IoU
+    '''
+    boxes1, boxes2 = np.atleast_2d(boxes1), np.atleast_2d(boxes2)
+    lt = np.maximum(boxes1[:, :2], boxes2[:, :2])
+    rb = np.minimum(boxes1[:, 2:], boxes2[:, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(1)
+    area = lambda b: np.clip(b[:, 2:] - b[:, :2], 0, None).prod(1)
+    union = area(boxes1) + area(boxes2) - inter
+    return inter / np.maximum(union, 1e-12)
+
+
+def accuracy_report(float_model, quant_model, fps):
+    '''
+    print box IoU (boxes_pred / boxes_refine), layout pixel agreement and latency of
+    quant_model against float_model over the floorplans fps
+    '''
+    import model.test as mltest
+
+    iou_pred, iou_refine, agree, t_float, t_quant = [], [], [], [], []
+    for fp in fps:
+        t1 = time.perf_counter()
+        ref = mltest.test(float_model, fp)
+        t2 = time.perf_counter()
+        out = mltest.test(quant_model, fp)
+        t3 = time.perf_counter()
+        t_float.append(t2 - t1)
+        t_quant.append(t3 - t2)
+        iou_pred.append(box_iou(out[0], ref[0]))
+        iou_refine.append(box_iou(out[2], ref[2]))
+        agree.append((out[1] == ref[1]).mean())
+
+    iou_pred, iou_refine = np.concatenate(iou_pred), np.concatenate(iou_refine)
+    print(f'int8 vs float over {len(fps)} plans ({len(iou_pred)} rooms)')
+    print(f'  boxes_pred   IoU: mean {iou_pred.mean():.4f}, p5 {np.percentile(iou_pred, 5):.4f}, min {iou_pred.min():.4f}')
+    print(f'  boxes_refine IoU: mean {iou_refine.mean():.4f}, p5 {np.percentile(iou_refine, 5):.4f}, min {iou_refine.min():.4f}')
+    print(f'  gene_layout pixel agreement: {np.mean(agree):.4f}')
+    print(f'  latency: float median {np.median(t_float)*1e3:.2f} ms, int8 median {np.median(t_quant)*1e3:.2f} ms')
+
+
+def load_test_floorplans(start, n):
+    '''
+    test boundaries with the graph of their top-1 retrieved training plan adapted to them,
+    the inputs the model sees when serving (see model/test.py::get_userinfo)
+    '''
+    import pickle
+    import model.corpus_store as corpus_store
+    from model.floorplan import FloorPlan
+
+    test_data = pickle.load(open('./static/Data/data_test_converted.pkl', 'rb'))['data']
+    train_data = corpus_store.open_store('./static/Data/train_store')
+    if train_data is None:
+        train_data = pickle.load(open('./static/Data/data_train_converted.pkl', 'rb'))['data']
+
+    fps = []
+    for datum in test_data[start:start + n]:
+        fp_end = FloorPlan(datum).adapt_graph(FloorPlan(train_data[int(datum.topK[0])], train=True))
+        fp_end.adjust_graph()
+        fps.append(fp_end)
+    return fps
+
+
+if __name__ == "__main__":
+    import argparse
+    import model.test as mltest
+    from model.export import export, load_traced
+
+    parser = argparse.ArgumentParser(description='Quantize Model to int8 and report box IoU against the float model')
+    parser.add_argument('--mode', default='dynamic', choices=['dynamic', 'static'])
+    parser.add_argument('--num_calib', default=200, type=int, help='test plans used for static calibration')
+    parser.add_argument('--num_eval', default=300, type=int, help='test plans used for the report (after the calibration plans)')
+    parser.add_argument('--out', default='./model/model_int8_traced.pt', help='traced static int8 model')
+    args = parser.parse_args()
+
+    mltest.set_cpu_threads()
+    float_model = mltest.load_model('cpu')
+
+    if args.mode == 'dynamic':
+        quant_model = quantize_dynamic(float_model)
+    else:
+        prepared = prepare_static(float_model)
+        for fp in load_test_floorplans(0, args.num_calib):
+            mltest.test(prepared, fp)
+        quant_model = convert_static(prepared)
+        fp = load_test_floorplans(0, 1)[0]
+        boundary, inside_box, rooms, attrs, triples = mltest.get_data(fp, torch.device('cpu'))
+        export(quant_model, (rooms, triples, boundary, attrs, inside_box), args.out)
+        quant_model = load_traced(args.out, 'cpu')
+        print(f'exported {args.out}, serve it with MODEL_TRACED={args.out}')
+
+    accuracy_report(float_model, quant_model, load_test_floorplans(args.num_calib, args.num_eval))
@@ -1,6 +1,9 @@
 from  model.floorplan import *
 from  model.box_utils import *
 from  model.model import Model
+from  model.export import TracedModel, load_traced
+from  model.quantize import quantize_dynamic
+from  model.boundary_cache import boundary_cache, model_version
 import os
 from  model.utils import *
 
@@ -15,31 +18,72 @@ import math
 global adjust,indxlist
 adjust=False
 
-def get_data(fp):
+def get_device(device=None):
+    '''
+    device: 'auto', 'cpu', 'cuda', 'cuda:0', ... (default: MODEL_DEVICE env, 'auto')
+    return: torch.device, 'auto' picks the first GPU if there is one
+    '''
+    device = device or os.getenv('MODEL_DEVICE', 'auto')
+    if device == 'auto':
+        device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    return torch.device(device)
+
+def set_cpu_threads(num_threads=None,num_interop_threads=None):
+    '''
+    intra-op / inter-op thread pools for CPU inference
+    (default: TORCH_NUM_THREADS / TORCH_NUM_INTEROP_THREADS env, torch defaults if unset)
+    '''
+    num_threads = num_threads or int(os.getenv('TORCH_NUM_THREADS', 0))
+    num_interop_threads = num_interop_threads or int(os.getenv('TORCH_NUM_INTEROP_THREADS', 0))
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work has started
+            print('set_num_interop_threads ignored, the inter-op pool is already running')
+
+def get_data(fp,device=None):
     batch = list(fp.get_test_data())
-    batch[0] = batch[0].unsqueeze(0).cuda()
-    batch[1] = batch[1].cuda()
-    batch[2] = batch[2].cuda()
-    batch[3] = batch[3].cuda()
-    batch[4] = batch[4].cuda()
-    return batch
+    batch[0] = batch[0].unsqueeze(0)
+    return [x.to(device or get_device()) for x in batch]
+
+def model_device(model):
+    if isinstance(model, TracedModel):
+        return model.device
+    return next(model.parameters()).device
+
+def get_inside_vecs(model,fp,boundary):
+    '''
+    Model.encode_boundary of the plan boundary (1,3,128,128),
+    computed once per boundary and model, see model/boundary_cache.py
+    '''
+    return boundary_cache.get(
+        fp.boundary_key(), ('inside_vecs', model_version(model)),
+        lambda: model.encode_boundary(boundary))
 
 def test(model,fp):
     with torch.no_grad():
-        batch = get_data(fp)
+        batch = get_data(fp,model_device(model))
         boundary,inside_box,rooms,attrs,triples = batch
-        model_out = model(
-            rooms, 
-            triples, 
-            boundary,
-            obj_to_img = None,
-            attributes = attrs,
-            boxes_gt= None, 
-            generate = True,
-            refine = True,
-            relative = True,
-            inside_box=inside_box
-        )
+        if isinstance(model, TracedModel):
+            # generate+refine+relative are fixed in the traced module
+            model_out = model(rooms, triples, boundary, attrs, inside_box)
+        else:
+            # graph edits on a known boundary only pay for the decode stage
+            model_out = model.decode(
+                rooms, 
+                triples, 
+                attrs,
+                get_inside_vecs(model,fp,boundary),
+                inside_box,
+                obj_to_img = None,
+                boxes_gt= None, 
+                generate = True,
+                refine = True,
+                relative = True
+            )
         boxes_pred,  gene_layout, boxes_refine= model_out
         boxes_pred = boxes_pred.detach()
         boxes_pred = centers_to_extents(boxes_pred)
@@ -49,13 +93,98 @@ def test(model,fp):
         gene_preds = torch.argmax(gene_layout.softmax(1).detach(),dim=1)
         return boxes_pred.squeeze().cpu().numpy(),gene_preds.squeeze().cpu().double().numpy(),boxes_refine.squeeze().cpu().numpy()
 
-def load_model():
-    
-    model = Model()
-    model.cuda(0)
+def collate_test_data(fps):
+    '''
+    fps: list of FloorPlan
+    return: boundary, inside_box, rooms, attrs, triples, obj_to_img of all plans
+        concatenated into one batch, as Network/model/floorplan.py::floorplan_collate_fn
+    '''
+    all_boundary, all_inside_box, all_rooms, all_attrs, all_triples, all_obj_to_img = [], [], [], [], [], []
+    obj_offset = 0
+    for i, fp in enumerate(fps):
+        boundary, inside_box, rooms, attrs, triples = fp.get_test_data()
+        triples = triples.clone()
+        triples[:, 0] += obj_offset
+        triples[:, 2] += obj_offset
+
+        all_boundary.append(boundary[None])
+        all_inside_box.append(inside_box)
+        all_rooms.append(rooms)
+        all_attrs.append(attrs)
+        all_triples.append(triples)
+        all_obj_to_img.append(torch.LongTensor(rooms.size(0)).fill_(i))
+        obj_offset += rooms.size(0)
+
+    return (
+        torch.cat(all_boundary),
+        torch.cat(all_inside_box),
+        torch.cat(all_rooms),
+        torch.cat(all_attrs),
+        torch.cat(all_triples),
+        torch.cat(all_obj_to_img)
+    )
+
+def test_batch(model,fps):
+    '''
+    run the model once for many floorplans (e.g. all retrieved graphs adapted to one boundary)
+    return: list of (boxes_pred, gene_preds, boxes_refine), the same as test(model,fp) for each fp
+    '''
+    if len(fps)==0:
+        return []
+    if isinstance(model, TracedModel):
+        # the traced module is specialised to one plan per call
+        return [test(model,fp) for fp in fps]
+    device = model_device(model)
+    with torch.no_grad():
+        batch = [x.to(device) for x in collate_test_data(fps)]
+        boundary,inside_box,rooms,attrs,triples,obj_to_img = batch
+        # candidates usually share one boundary: its embedding is computed once
+        inside_vecs = torch.cat([get_inside_vecs(model,fp,boundary[i:i+1]) for i,fp in enumerate(fps)])
+        model_out = model.decode(
+            rooms, 
+            triples, 
+            attrs,
+            inside_vecs,
+            inside_box,
+            obj_to_img = obj_to_img,
+            boxes_gt= None, 
+            generate = True,
+            refine = True,
+            relative = True
+        )
+        boxes_pred,  gene_layout, boxes_refine= model_out
+        boxes_pred = centers_to_extents(boxes_pred.detach()).cpu().numpy()
+        boxes_refine = centers_to_extents(boxes_refine.detach()).cpu().numpy()
+        gene_layout = gene_layout*boundary[:,:1]
+        gene_preds = torch.argmax(gene_layout.softmax(1).detach(),dim=1).cpu().double().numpy()
+
+    # split the outputs back per plan
+    obj_to_img = obj_to_img.cpu().numpy()
+    return [
+        (boxes_pred[obj_to_img==i].squeeze(),gene_preds[i].squeeze(),boxes_refine[obj_to_img==i].squeeze())
+        for i in range(len(fps))
+    ]
+
+def load_model(device=None):
+    device = get_device(device)
+    if device.type == 'cpu':
+        set_cpu_threads()
+    # traced module exported by model/export.py, instead of the eager model
+    traced_path = os.getenv('MODEL_TRACED')
+    if traced_path:
+        return load_traced(traced_path, device)
+    # MODEL_LAYOUT=matmul builds the refinement input without the (O,D,H,W) grid_sample tensor
+    model = Model(layout_builder=os.getenv('MODEL_LAYOUT', 'grid_sample'))
+    model.to(device)
     model.load_state_dict(
-        torch.load('./model/model.pth', map_location={'cuda:0': 'cuda:0'}))
+        torch.load('./model/model.pth', map_location=device))
     model.eval()
+    # opt-in int8 Linear layers for CPU serving, see model/quantize.py
+    if os.getenv('MODEL_QUANTIZE') == 'dynamic':
+        if device.type == 'cpu':
+            model = quantize_dynamic(model)
+        else:
+            print('MODEL_QUANTIZE=dynamic ignored, int8 kernels are CPU only')
     return model
 
 
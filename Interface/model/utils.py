@@ -306,6 +306,38 @@ def point_box_relation(u,vbox):
 
     return relation
 
+def edge_relations(ubox,vbox):
+    '''
+    array version of the relation test in FloorPlan.get_triples
+    ubox,vbox: (E,4) boxes (y0,x0,y1,x1) of the two rooms of each edge
+    return: (E,) relation names, same as the per-edge surrounding/inside/point_box_relation test
+    '''
+    uy0,ux0,uy1,ux1 = ubox.T
+    vy0,vx0,vy1,vx1 = vbox.T
+    uy,ux = (uy0+uy1)/2,(ux0+ux1)/2
+
+    # same order as the if/elif chains, the first matching condition wins
+    conditions = [
+        (ux0<vx0)&(ux1>vx1)&(uy0<vy0)&(uy1>vy1),
+        (ux0>=vx0)&(ux1<=vx1)&(uy0>=vy0)&(uy1<=vy1),
+        ((ux<vx0)&(uy<=vy0))|((ux==vx0)&(uy==vy0)),
+        (vx0<=ux)&(ux<vx1)&(uy<=vy0),
+        ((vx1<=ux)&(uy<vy0))|((ux==vx1)&(uy==vy0)),
+        (vx1<=ux)&(vy0<=uy)&(uy<vy1),
+        ((vx1<ux)&(vy1<=uy))|((ux==vx1)&(uy==vy1)),
+        (vx0<ux)&(ux<=vx1)&(vy1<=uy),
+        ((ux<=vx0)&(vy1<uy))|((ux==vx0)&(uy==vy1)),
+        (ux<=vx0)&(vy0<uy)&(uy<=vy1),
+        (vx0<ux)&(ux<vx1)&(vy0<uy)&(uy<vy1),
+    ]
+    choices = ['surrounding','inside','left-above','above','right-above','right-of',
+               'right-below','below','left-below','left-of','inside']
+    relations = np.select(conditions,choices,default='')
+    for i in np.flatnonzero(relations==''):
+        # no case matched, let point_box_relation fail as it does for the single edge
+        relations[i] = point_box_relation((uy[i],ux[i]),vbox[i])
+    return relations
+
 def get_vocab():
     room_label = [(0, 'LivingRoom', 1, "PublicArea"),
               (1, 'MasterRoom', 0, "Bedroom"),
@@ -0,0 +1,425 @@
+"""
+ANN index engine for turning-function retrieval.
+
+Stores the sampled turning functions (tf_train.npy) as float32, optionally
+PCA-reduced, in an IVF (inverted file) index. Backends:
+    - faiss: faiss.IndexIVFFlat, used when faiss-cpu is installed
+    - numpy: pure NumPy IVF, always available
+
+nprobe (number of visited clusters) is the recall-vs-latency knob. A search
+probes more clusters (doubling nprobe) for the queries whose probed lists hold
+fewer than k vectors, so a large k (NumSearch asks for 1000) still gets k results.
+
+Build the index next to tf_train.npy (run from the Interface directory):
+    python -m retrieval.ann_index --tf ./retrieval/tf_train.npy --centroids ./retrieval/centroids_train.npy
+"""
+import os
+import json
+import shutil
+import time
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+INDEX_VERSION = 1
+
+
+def squared_l2(queries, vectors, vector_norms=None):
+    '''
+    queries: (Q, D), vectors: (N, D)
+    return: (Q, N) squared L2 distances
+    '''
+    if vector_norms is None:
+        vector_norms = (vectors * vectors).sum(1)
+    dist = (queries * queries).sum(1)[:, None] - 2 * queries @ vectors.T + vector_norms[None]
+    return np.maximum(dist, 0)
+
+
+def topk(dist, k):
+    '''
+    dist: (Q, N)
+    return: (Q, k) indices of the k smallest values of each row, sorted
+    '''
+    k = min(k, dist.shape[1])
+    if k < dist.shape[1]:
+        index = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        index = np.tile(np.arange(dist.shape[1]), (len(dist), 1))
+    order = np.argsort(np.take_along_axis(dist, index, 1), axis=1, kind='stable')
+    return np.take_along_axis(index, order, 1)
+
+
+def brute_force_search(tf_train, queries, k=20, chunk=4096):
+    '''
+    exact search, the same ranking as DataRetriever.retrieve_bf
+    return: (Q, k) indices into tf_train
+    '''
+    queries = np.atleast_2d(queries)
+    norms = (tf_train * tf_train).sum(1)
+    dist = np.concatenate([
+        squared_l2(queries, tf_train[s:s + chunk], norms[s:s + chunk])
+        for s in range(0, len(tf_train), chunk)
+    ], 1)
+    return topk(dist, k)
+
+
+def kmeans(x, ncentroids, niter=20, seed=0, sample=None):
+    '''
+    plain Lloyd k-means on float32 data
+    return: (ncentroids, D) centroids
+    '''
+    rng = np.random.default_rng(seed)
+    if sample is not None and len(x) > sample:
+        x = x[rng.choice(len(x), sample, replace=False)]
+    centroids = x[rng.choice(len(x), ncentroids, replace=False)].copy()
+    for _ in range(niter):
+        assign = assign_clusters(x, centroids)
+        counts = np.bincount(assign, minlength=ncentroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # re-seed empty clusters with random points
+        if (~nonempty).any():
+            centroids[~nonempty] = x[rng.choice(len(x), (~nonempty).sum(), replace=False)]
+    return centroids
+
+
+def minibatch_kmeans(x, ncentroids, batch_size=4096, niter=200, seed=0):
+    '''
+    mini-batch k-means (Sculley 2010) on float32 data: each step assigns a random
+    batch and moves every centroid to the running mean of the points it received
+    return: (ncentroids, D) centroids
+    '''
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    centroids = x[rng.choice(len(x), ncentroids, replace=False)].copy()
+    counts = np.zeros(ncentroids)
+    for _ in range(niter):
+        batch = x[rng.choice(len(x), min(batch_size, len(x)), replace=False)]
+        assign = assign_clusters(batch, centroids)
+        n = np.bincount(assign, minlength=ncentroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, batch)
+        counts += n
+        moved = n > 0
+        centroids[moved] += ((sums[moved] - n[moved, None] * centroids[moved]) / counts[moved, None]).astype(np.float32)
+    return centroids
+
+
+def assign_clusters(x, centroids, chunk=8192):
+    norms = (centroids * centroids).sum(1)
+    return np.concatenate([
+        squared_l2(x[s:s + chunk], centroids, norms).argmin(1)
+        for s in range(0, len(x), chunk)
+    ])
+
+
+class PCAReducer():
+    def __init__(self, mean, components):
+        '''
+        mean: (D,), components: (d, D)
+        '''
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+
+    @staticmethod
+    def fit(x, dim, sample=20000, seed=0):
+        rng = np.random.default_rng(seed)
+        if len(x) > sample:
+            x = x[rng.choice(len(x), sample, replace=False)]
+        x = np.asarray(x, dtype=np.float64)
+        mean = x.mean(0)
+        _, _, vt = np.linalg.svd(x - mean, full_matrices=False)
+        return PCAReducer(mean, vt[:dim])
+
+    def transform(self, x):
+        return (np.asarray(x, dtype=np.float32) - self.mean) @ self.components.T
+
+
+class NumpyIVFIndex():
+    '''
+    Inverted file index in NumPy.
+    Vectors are stored grouped by cluster, so a probed cluster is one contiguous slice.
+    '''
+    backend = 'numpy'
+
+    def __init__(self, centroids, vectors, ids, offsets):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.centroid_norms = (centroids * centroids).sum(1)
+        self.vector_norms = (vectors * vectors).sum(1)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def ntotal(self):
+        return len(self.ids)
+
+    @staticmethod
+    def build(x, centroids):
+        assign = assign_clusters(x, centroids)
+        ids = np.argsort(assign, kind='stable')
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=len(centroids)))
+        return NumpyIVFIndex(centroids, x[ids], ids, offsets)
+
+    def search(self, queries, k, nprobe):
+        nprobe = min(nprobe, len(self.centroids))
+        probes = topk(squared_l2(queries, self.centroids, self.centroid_norms), nprobe)
+        result = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, q in enumerate(queries):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes[i]])
+            if len(rows) == 0:
+                continue
+            dist = squared_l2(q[None], self.vectors[rows], self.vector_norms[rows])
+            best = topk(dist, k)[0]
+            result[i, :len(best)] = self.ids[rows[best]]
+        return result
+
+    def add(self, x):
+        '''appends vectors x with ids len(index).. (the vectors are copied into memory)'''
+        assign = np.concatenate([np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets)),
+                                 assign_clusters(x, self.centroids)])
+        vectors = np.concatenate([self.vectors, x.astype(self.vectors.dtype)])
+        ids = np.concatenate([self.ids, np.arange(len(self.ids), len(self.ids) + len(x))])
+        order = np.argsort(assign, kind='stable')
+        offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=len(self.centroids)))
+        self.__init__(self.centroids, vectors[order], ids[order], offsets)
+
+    def save(self, index_dir):
+        np.save(os.path.join(index_dir, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(index_dir, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(index_dir, 'ids.npy'), self.ids)
+        np.save(os.path.join(index_dir, 'offsets.npy'), self.offsets)
+
+    @staticmethod
+    def load(index_dir, mmap_mode='r'):
+        load = lambda name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        return NumpyIVFIndex(np.array(load('centroids')), load('vectors'), load('ids'), load('offsets'))
+
+
+class FaissIVFIndex():
+    backend = 'faiss'
+
+    def __init__(self, index):
+        self.index = index
+
+    @property
+    def nlist(self):
+        return self.index.nlist
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @staticmethod
+    def build(x, centroids):
+        d = x.shape[1]
+        quantizer = faiss.IndexFlatL2(d)
+        index = faiss.IndexIVFFlat(quantizer, d, len(centroids))
+        # use the given centroids instead of training a new coarse quantizer
+        index.quantizer.add(np.ascontiguousarray(centroids, dtype=np.float32))
+        index.is_trained = True
+        index.add(np.ascontiguousarray(x, dtype=np.float32))
+        return FaissIVFIndex(index)
+
+    def search(self, queries, k, nprobe):
+        self.index.nprobe = nprobe
+        _, index = self.index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        return index
+
+    def add(self, x):
+        self.index.add(np.ascontiguousarray(x, dtype=np.float32))
+
+    def save(self, index_dir):
+        faiss.write_index(self.index, os.path.join(index_dir, 'faiss.index'))
+
+    @staticmethod
+    def load(index_dir, mmap_mode='r'):
+        return FaissIVFIndex(faiss.read_index(os.path.join(index_dir, 'faiss.index')))
+
+
+BACKENDS = {
+    'numpy': NumpyIVFIndex,
+    'faiss': FaissIVFIndex,
+}
+
+
+def _resolve_backend(backend):
+    if backend == 'auto':
+        backend = 'faiss' if faiss is not None else 'numpy'
+    if backend == 'faiss' and faiss is None:
+        raise ImportError('faiss backend requested but faiss is not installed (pip install faiss-cpu)')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown retrieval backend "{backend}", expected one of {list(BACKENDS)}')
+    return backend
+
+
+class RetrievalEngine():
+    def __init__(self, index, pca=None, nprobe=8):
+        '''
+        index: NumpyIVFIndex or FaissIVFIndex
+        pca: PCAReducer applied to vectors and queries, or None
+        nprobe: default number of probed clusters, higher means better recall and slower search
+        '''
+        self.index = index
+        self.pca = pca
+        self.nprobe = nprobe
+
+    @property
+    def backend(self):
+        return self.index.backend
+
+    @staticmethod
+    def build(tf_train, centroids=None, nlist=1000, pca_dim=None, nprobe=8, backend='auto'):
+        '''
+        tf_train: (N, 1000) sampled turning functions
+        centroids: (nlist, 1000) coarse centroids (e.g. centroids_train.npy), trained with k-means if None
+        pca_dim: reduce vectors to pca_dim dimensions before indexing, None keeps all
+        '''
+        backend = _resolve_backend(backend)
+        x = np.asarray(tf_train, dtype=np.float32)
+        pca = None
+        if pca_dim is not None:
+            pca = PCAReducer.fit(x, pca_dim)
+            x = pca.transform(x)
+        if centroids is None:
+            centroids = kmeans(x, nlist, sample=50 * nlist)
+        else:
+            centroids = np.asarray(centroids, dtype=np.float32)
+            if pca is not None:
+                centroids = pca.transform(centroids)
+        index = BACKENDS[backend].build(np.ascontiguousarray(x), np.ascontiguousarray(centroids))
+        return RetrievalEngine(index, pca, nprobe)
+
+    def search(self, queries, k=20, nprobe=None):
+        '''
+        queries: (Q, 1000) or (1000,) sampled turning functions
+        return: (Q, k) indices into tf_train, -1 only where the index holds fewer than k vectors
+        '''
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.pca is not None:
+            queries = self.pca.transform(queries)
+        nprobe = min(nprobe or self.nprobe, self.index.nlist)
+        result = self.index.search(queries, k, nprobe)
+        # the probed lists of some queries held fewer than k vectors: probe more clusters
+        while nprobe < self.index.nlist:
+            short = np.flatnonzero((result < 0).any(1))
+            if len(short) == 0:
+                break
+            nprobe = min(2 * nprobe, self.index.nlist)
+            result[short] = self.index.search(queries[short], k, nprobe)
+        return result
+
+    def add(self, tf):
+        '''
+        tf: (M, 1000) sampled turning functions appended to tf_train, searchable
+            with ids len(tf_train).. ; the coarse centroids are kept
+        '''
+        x = np.atleast_2d(np.asarray(tf, dtype=np.float32))
+        if self.pca is not None:
+            x = self.pca.transform(x)
+        self.index.add(np.ascontiguousarray(x))
+
+    def save(self, index_dir):
+        tmp_dir = index_dir.rstrip('/\\') + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        self.index.save(tmp_dir)
+        if self.pca is not None:
+            np.savez(os.path.join(tmp_dir, 'pca.npz'), mean=self.pca.mean, components=self.pca.components)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'backend': self.backend,
+                'pca': self.pca is not None,
+                'nprobe': self.nprobe
+            }, f)
+        if os.path.exists(index_dir):
+            shutil.rmtree(index_dir)
+        os.rename(tmp_dir, index_dir)
+
+    @staticmethod
+    def load(index_dir, nprobe=None):
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version {meta['version']} in {index_dir}")
+        index = BACKENDS[_resolve_backend(meta['backend'])].load(index_dir)
+        pca = None
+        if meta['pca']:
+            p = np.load(os.path.join(index_dir, 'pca.npz'))
+            pca = PCAReducer(p['mean'], p['components'])
+        return RetrievalEngine(index, pca, nprobe or meta['nprobe'])
+
+
+def load_engine(index_dir, nprobe=None):
+    '''Return the RetrievalEngine saved in index_dir, or None if it has not been built.'''
+    if not os.path.exists(os.path.join(index_dir, 'meta.json')):
+        return None
+    return RetrievalEngine.load(index_dir, nprobe)
+
+
+def recall_at_k(engine, tf_train, queries, k=20, nprobe=None):
+    '''
+    mean recall@k of the engine against brute-force search on tf_train
+    return: recall, mean search latency per query (seconds)
+    '''
+    exact = brute_force_search(tf_train, queries, k)
+    t1 = time.perf_counter()
+    approx = engine.search(queries, k, nprobe)
+    t2 = time.perf_counter()
+    hits = [len(np.intersect1d(a[a >= 0], e)) for a, e in zip(approx, exact)]
+    return np.sum(hits) / exact.size, (t2 - t1) / len(queries)
+
+
+def recall_report(engine, tf_train, queries, k=20, nprobes=(1, 2, 4, 8, 16, 32)):
+    '''print recall@k and latency for each nprobe, to pick the operating point'''
+    t1 = time.perf_counter()
+    brute_force_search(tf_train, queries, k)
+    t_bf = (time.perf_counter() - t1) / len(queries)
+    print(f'backend={engine.backend} pca={engine.pca is not None} queries={len(queries)} k={k}')
+    print(f'  brute force: {t_bf * 1e3:.2f} ms/query')
+    for nprobe in nprobes:
+        recall, latency = recall_at_k(engine, tf_train, queries, k, nprobe)
+        print(f'  nprobe={nprobe:3d}: recall@{k}={recall:.3f} {latency * 1e3:.2f} ms/query')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the turning-function ANN index next to tf_train.npy')
+    parser.add_argument('--tf', default='./retrieval/tf_train.npy')
+    parser.add_argument('--centroids', default='./retrieval/centroids_train.npy')
+    parser.add_argument('--out', default=None, help='index directory, default: tf_index next to --tf')
+    parser.add_argument('--backend', default='auto', choices=['auto'] + list(BACKENDS))
+    parser.add_argument('--nlist', default=1000, type=int)
+    parser.add_argument('--pca_dim', default=None, type=int)
+    parser.add_argument('--nprobe', default=8, type=int)
+    parser.add_argument('--num_queries', default=200, type=int)
+    args = parser.parse_args()
+
+    tf_train = np.load(args.tf)
+    centroids = np.load(args.centroids) if args.centroids and os.path.exists(args.centroids) else None
+    out = args.out or os.path.join(os.path.dirname(args.tf), 'tf_index')
+
+    t1 = time.perf_counter()
+    engine = RetrievalEngine.build(tf_train, centroids, args.nlist, args.pca_dim, args.nprobe, args.backend)
+    engine.save(out)
+    print(f'built {engine.backend} index in {time.perf_counter() - t1:.1f}s -> {out}')
+
+    # training vectors perturbed slightly stand in for unseen query boundaries
+    rng = np.random.default_rng(0)
+    queries = tf_train[rng.choice(len(tf_train), args.num_queries, replace=False)]
+    queries = queries + rng.normal(0, 0.05, queries.shape)
+    recall_report(engine, tf_train, queries)
@@ -0,0 +1,198 @@
+"""
+Microbenchmarks for the retrieval features.
+Run from the Interface directory:
+    python -m retrieval.benchmark
+"""
+import time
+import numpy as np
+
+from retrieval.turning_function import compute_tf, sample_tf, compute_tf_batch, sample_tf_batch
+from retrieval.plan_filter import PlanFilterIndex, room_count_mask, edge_signature, COARSE_TYPES
+
+
+def compute_tf_reference(b):
+    '''original per-vertex loop implementation'''
+    if b.shape[1]>2:
+        b=b[:,:2]
+    b = np.concatenate((b,b[:1]))
+    nPoint = len(b)-1
+    lineVec = b[1:]-b[:-1]
+    lineLength = np.linalg.norm(lineVec,axis=1)
+
+    perimeter = lineLength.sum()
+    lineVec = lineVec/perimeter
+    lineLength = lineLength/perimeter
+
+    angles = np.zeros(nPoint)
+    for i in range(nPoint):
+        u, v = lineVec[i], lineVec[(i+1)%nPoint]
+        z = u[0]*v[1]-u[1]*v[0]
+        sign = np.sign(z)
+        angles[i] = np.arccos(np.dot(u,v))*sign
+
+    x = np.zeros(nPoint+1)
+    y = np.zeros(nPoint+1)
+    s = 0
+    for i in range(1,nPoint+1):
+        x[i] = lineLength[i-1]+x[i-1]
+        y[i-1] = angles[i-1]+s
+        s = y[i-1]
+    y[-1] = s
+    return x,y
+
+
+def sample_tf_reference(x,y,ndim=1000):
+    '''original np.piecewise implementation'''
+    t = np.linspace(0,1,ndim)
+    return np.piecewise(t,[t>=xx for xx in x],y)
+
+
+def get_filter_func_reference(mask, acc, num):
+    '''original per-row room-count filter of views.NumSearch/GraphSearch'''
+    filters = [
+        None if not mask else (
+            np.equal if acc[i] else np.greater_equal
+        )
+        for i in range(len(mask))
+    ]
+
+    def filter_func(data):
+        for i in range(len(filters)):
+            if (filters[i] is not None) and (not filters[i](data[i], num[i])): return False
+        return True
+
+    return filter_func
+
+
+def graph_filter_reference(rNum,eNum,room_query,nodes,edges):
+    '''original GraphSearch: room-count map over np.arange, nested-loop edgematrix, filter_graph map'''
+    BedRoomlist = ["MasterRoom", "SecondRoom", "GuestRoom", "ChildRoom", "StudyRoom"]
+    test_data_topk = np.arange(len(rNum))
+    if room_query is not None:
+        indices = np.where(list(map(get_filter_func_reference(*room_query),rNum[test_data_topk])))
+        test_data_topk = test_data_topk[indices[0]]
+    edgematrix = np.zeros((5,5))
+    for indx1,indx2 in edges:
+        tmp1 = tmp2 = ""
+        for indx,rmname,x,y,scalesize in nodes:
+            if indx1==indx:
+                tmp1 = "BedRoom" if rmname in BedRoomlist else rmname
+        for indx,rmname,x,y,scalesize in nodes:
+            if indx2==indx:
+                tmp2 = "BedRoom" if rmname in BedRoomlist else rmname
+        if tmp1!="" and tmp2!="":
+            edgematrix[COARSE_TYPES.index(tmp1)][COARSE_TYPES.index(tmp2)] += 1
+            edgematrix[COARSE_TYPES.index(tmp2)][COARSE_TYPES.index(tmp1)] += 1
+    edge = edgematrix.reshape((1,25))
+    indices = np.where(list(map(lambda data: ((data-edge)>=0).all(),eNum[test_data_topk])))
+    return test_data_topk[indices[0]]
+
+
+def random_graph_query(rng):
+    '''user graph with coarse room types only (the original edgematrix loop rejects others)'''
+    names = ["MasterRoom","SecondRoom","Bathroom","Kitchen","Balcony","Storage"]
+    n = rng.integers(2,6)
+    nodes = [[i,names[rng.integers(len(names))],0,0,1] for i in range(n)]
+    edges = [[int(a),int(b)] for a,b in rng.integers(0,n,(rng.integers(1,4),2)) if a!=b]
+    return nodes,edges
+
+
+def random_room_query(rng,ncols=14):
+    '''frontend room query (roomactarr, roomexaarr, roomnumarr), default values are 0'''
+    mask = [0]*ncols
+    acc = [0]*ncols
+    num = [0]*ncols
+    for c in rng.choice(ncols,rng.integers(1,4),replace=False):
+        mask[c] = 1
+        acc[c] = int(rng.random()>0.5)
+        num[c] = int(rng.integers(0,3))
+    return mask,acc,num
+
+
+def random_boundary(rng):
+    '''
+    random rectilinear boundary (x,y,dir,isNew) in [0,255]^2,
+    a rectangle with a front door on the bottom edge and an optional corner notch
+    '''
+    x0, y0 = rng.integers(10,80,2)
+    x1, y1 = rng.integers(170,245,2)
+    d0 = rng.integers(x0+5,(x0+x1)//2)
+    d1 = d0+rng.integers(8,20)
+    points = [[d0,y1],[d1,y1],[x1,y1]]
+    if rng.random()>0.5:
+        nx, ny = rng.integers((x0+x1)//2+20,x1-5), rng.integers(y0+5,(y0+y1)//2)
+        points += [[x1,ny],[nx,ny],[nx,y0]]
+    else:
+        points += [[x1,y0]]
+    points += [[x0,y0],[x0,y1]]
+    b = np.zeros((len(points),4),dtype=int)
+    b[:,:2] = points
+    b[:2,3] = 1
+    return b
+
+
+def timeit(fn,repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        out = fn()
+        best = min(best,time.perf_counter()-t1)
+    return best,out
+
+
+def benchmark_tf(n=2000,ndim=1000,seed=0):
+    rng = np.random.default_rng(seed)
+    boundaries = [random_boundary(rng) for _ in range(n)]
+
+    t_ref,ref = timeit(lambda: np.stack([sample_tf_reference(*compute_tf_reference(b),ndim) for b in boundaries]),1)
+    t_vec,vec = timeit(lambda: np.stack([sample_tf(*compute_tf(b),ndim) for b in boundaries]))
+    t_bat,bat = timeit(lambda: sample_tf_batch(*compute_tf_batch(boundaries),ndim))
+
+    print(f'turning function, {n} boundaries, ndim={ndim}')
+    print(f'  reference loop/piecewise: {t_ref*1e3:9.2f} ms ({t_ref/n*1e6:.1f} us/boundary)')
+    print(f'  vectorized:               {t_vec*1e3:9.2f} ms ({t_vec/n*1e6:.1f} us/boundary)')
+    print(f'  batched:                  {t_bat*1e3:9.2f} ms ({t_bat/n*1e6:.1f} us/boundary)')
+    print(f'  max abs diff: vectorized {np.abs(vec-ref).max():.2e}, batched {np.abs(bat-ref).max():.2e}')
+    assert np.allclose(vec,ref) and np.allclose(bat,ref)
+
+
+def benchmark_room_filter(n=74995,nquery=20,seed=0):
+    rng = np.random.default_rng(seed)
+    rNum = rng.poisson(0.8,(n,14)).astype(np.int64)
+    rNum[:,0] = 1
+    index = PlanFilterIndex(rNum)
+    queries = [random_room_query(rng) for _ in range(nquery)]
+
+    t_ref,ref = timeit(lambda: [np.where(list(map(get_filter_func_reference(*q),rNum)))[0] for q in queries],1)
+    t_vec,vec = timeit(lambda: [np.flatnonzero(room_count_mask(rNum,*q)) for q in queries])
+    t_idx,idx = timeit(lambda: [index.query_rooms(*q) for q in queries])
+
+    print(f'room-count filter, {n} plans, {nquery} queries')
+    print(f'  reference map:  {t_ref/nquery*1e3:9.2f} ms/query')
+    print(f'  vectorized:     {t_vec/nquery*1e3:9.2f} ms/query')
+    print(f'  bucket index:   {t_idx/nquery*1e3:9.2f} ms/query')
+    assert all(np.array_equal(a,b) and np.array_equal(a,c) for a,b,c in zip(ref,vec,idx))
+
+
+def benchmark_graph_filter(n=74995,nquery=10,seed=0):
+    rng = np.random.default_rng(seed)
+    rNum = rng.poisson(0.8,(n,14)).astype(np.int64)
+    rNum[:,0] = 1
+    eNum = rng.poisson(0.4,(n,25)).astype(np.uint8)
+    eNum = np.minimum(eNum,eNum.reshape(n,5,5).transpose(0,2,1).reshape(n,25))
+    index = PlanFilterIndex(rNum,eNum)
+    queries = [(random_room_query(rng) if rng.random()>0.3 else None,*random_graph_query(rng)) for _ in range(nquery)]
+
+    t_ref,ref = timeit(lambda: [graph_filter_reference(rNum,eNum,*q) for q in queries],1)
+    t_idx,idx = timeit(lambda: [index.query(*(q[0] or ([],[],[])),edge_signature(q[1],q[2])) for q in queries])
+
+    print(f'graph filter (room count + adjacency), {n} plans, {nquery} queries')
+    print(f'  reference map/loops: {t_ref/nquery*1e3:9.2f} ms/query')
+    print(f'  fused index:         {t_idx/nquery*1e3:9.2f} ms/query')
+    assert all(np.array_equal(a,b) for a,b in zip(ref,idx))
+
+
+if __name__ == "__main__":
+    benchmark_tf()
+    benchmark_room_filter()
+    benchmark_graph_filter()
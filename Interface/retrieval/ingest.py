@@ -0,0 +1,229 @@
+"""
+Incremental corpus ingestion.
+
+New plans are appended to the training corpus without rerunning DataPreparation:
+their turning functions, sampled turning functions, rNum and eNum rows are
+computed, and every cluster member list of clusters_train.npy (the nNN training
+samples nearest to each fixed centroid) is updated with the new samples that are
+nearer than its current members. Each ingestion writes one versioned delta:
+    corpus_deltas/v00001/
+        store/        plans and turning functions (model/corpus_store.py format)
+        tf.npy        sampled turning functions, appended to tf_train.npy
+        rNum.npy      appended to rNum_train.npy
+        eNum.npy      appended to data_train_eNum.pkl
+        assign.npy    nearest centroid of each new plan
+        clusters.npy  member lists of all centroids after this delta
+        meta.json
+The new plans get the training ids len(corpus).. in ingestion order.
+views.loadRetrieval / getTrainData merge the deltas at startup; the ANN index
+(tf_index) is built from tf_train.npy and gets the delta vectors added on load.
+Recluster with DataPreparation (and delete the deltas) when the centroids no
+longer fit the corpus.
+
+Run from the Interface directory, with plans in the data.mat format:
+    python -m retrieval.ingest new_plans.mat
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import numpy as np
+
+from model.corpus_store import TrainRecord, CorpusStore, ConcatSequence, open_store, write_store
+from retrieval.turning_function import compute_tf, boundaries_to_tf
+from retrieval.plan_filter import plan_room_counts, plan_edge_signature
+from retrieval.ann_index import squared_l2, topk
+
+DELTA_VERSION = 1
+DELTA_DIR = './static/Data/corpus_deltas'
+
+
+class CorpusDelta():
+    def __init__(self, delta_dir, mmap_mode='r'):
+        self.delta_dir = delta_dir
+        with open(os.path.join(delta_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['format'] != DELTA_VERSION:
+            raise ValueError(f"Unsupported corpus delta format {self.meta['format']} in {delta_dir}")
+        load = lambda name: np.load(os.path.join(delta_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        self.store = CorpusStore(os.path.join(delta_dir, 'store'), mmap_mode)
+        self.tf = load('tf')
+        self.rNum = load('rNum')
+        self.eNum = load('eNum')
+        self.assign = load('assign')
+        self.clusters = load('clusters')
+
+    @property
+    def version(self):
+        return self.meta['version']
+
+    @property
+    def base_size(self):
+        return self.meta['base_size']
+
+    def __len__(self):
+        return len(self.store)
+
+
+def load_deltas(delta_dir=DELTA_DIR):
+    '''return: the deltas in delta_dir in version order, [] if there are none'''
+    if not os.path.isdir(delta_dir):
+        return []
+    names = sorted(n for n in os.listdir(delta_dir) if n.startswith('v') and not n.endswith('.tmp'))
+    deltas = [CorpusDelta(os.path.join(delta_dir, n)) for n in names]
+    for prev, delta in zip(deltas, deltas[1:]):
+        if delta.base_size != prev.base_size + len(prev):
+            raise ValueError(f'corpus delta v{delta.version:05d} does not follow v{prev.version:05d}')
+    return deltas
+
+
+def _check_base(deltas, size):
+    if deltas and deltas[0].base_size != size:
+        raise ValueError(f'corpus deltas start at {deltas[0].base_size} plans, the base corpus has {size}; '
+                         f'remove {os.path.dirname(deltas[0].delta_dir)} after rebuilding the corpus')
+
+
+def merge_retrieval(tf_train, clusters, deltas):
+    '''return: tf_train with the delta rows appended, the member lists of the last delta'''
+    if not deltas:
+        return tf_train, clusters
+    _check_base(deltas, len(tf_train))
+    tf_train = np.concatenate([tf_train] + [d.tf for d in deltas])
+    return tf_train, np.array(deltas[-1].clusters)
+
+
+def merge_train_data(train_data, trainNameList, trainTF, eNum, rNum, deltas):
+    '''
+    return: train_data, trainNameList, trainTF, eNum, rNum with the delta plans appended;
+        trainNameList (NameRegistry) is extended in place
+    '''
+    if not deltas:
+        return train_data, trainNameList, trainTF, eNum, rNum
+    _check_base(deltas, len(train_data))
+    train_data = ConcatSequence([train_data] + [d.store for d in deltas])
+    trainTF = ConcatSequence([trainTF] + [d.store.turning_functions() for d in deltas])
+    for d in deltas:
+        trainNameList.extend(d.store.name_list())
+    eNum = np.concatenate([eNum] + [d.eNum for d in deltas])
+    rNum = np.concatenate([rNum] + [d.rNum for d in deltas])
+    return train_data, trainNameList, trainTF, eNum, rNum
+
+
+def _gather(parts, index):
+    '''rows index of the concatenation of parts, without concatenating them'''
+    out = np.empty(index.shape + parts[0].shape[1:], dtype=parts[0].dtype)
+    start = 0
+    for part in parts:
+        sel = (index >= start) & (index < start + len(part))
+        out[sel] = part[index[sel] - start]
+        start += len(part)
+    return out
+
+
+def update_clusters(tf_parts, centroids, clusters, tf_new, chunk=16):
+    '''
+    tf_parts: sampled tf of the current corpus (list of arrays, in id order)
+    clusters: (C, nNN) member lists, tf_new: (M, D) new samples with ids len(corpus)..
+    return: (C, nNN) member lists of the nNN samples nearest to each centroid
+        among the current members and the new samples
+    '''
+    size = sum(len(p) for p in tf_parts)
+    new_ids = np.arange(size, size + len(tf_new))
+    dist_new = squared_l2(centroids, np.asarray(tf_new, dtype=np.float64))
+    out = np.empty_like(clusters)
+    for s in range(0, len(centroids), chunk):
+        members = _gather(tf_parts, clusters[s:s + chunk]).astype(np.float64)
+        dist = ((members - centroids[s:s + chunk, None]) ** 2).sum(-1)
+        dist = np.concatenate([dist, dist_new[s:s + chunk]], 1)
+        ids = np.concatenate([clusters[s:s + chunk], np.broadcast_to(new_ids, (len(dist), len(new_ids)))], 1)
+        out[s:s + chunk] = np.take_along_axis(ids, topk(dist, clusters.shape[1]), 1)
+    return out
+
+
+def as_train_record(datum):
+    '''data.mat plan (gtBoxNew, rType, rEdge) -> TrainRecord as in data_train_converted'''
+    box = np.concatenate([np.asarray(datum.gtBoxNew).reshape(-1, 4), np.asarray(datum.rType).reshape(-1, 1)], -1)
+    return TrainRecord(str(datum.name), np.asarray(datum.boundary), box, np.asarray(datum.rEdge).reshape(-1, 3),
+                       np.asarray(datum.order), datum.rBoundary)
+
+
+def base_names(data_dir='./static/Data'):
+    store = open_store(os.path.join(data_dir, 'train_store'))
+    if store is not None:
+        return store.name_list()
+    return [str(n) for n in pickle.load(open(os.path.join(data_dir, 'data_train_converted.pkl'), 'rb'))['nameList']]
+
+
+def ingest(plans, retrieval_dir='./retrieval', data_dir='./static/Data', delta_dir=DELTA_DIR):
+    '''
+    plans: data.mat plans (name, boundary, gtBoxNew, rType, rEdge, order, rBoundary)
+    return: the written CorpusDelta, None if every plan is already in the corpus
+    '''
+    tf_base = np.load(os.path.join(retrieval_dir, 'tf_train.npy'), mmap_mode='r')
+    centroids = np.load(os.path.join(retrieval_dir, 'centroids_train.npy')).astype(np.float64)
+    deltas = load_deltas(delta_dir)
+    _check_base(deltas, len(tf_base))
+    clusters = np.array(deltas[-1].clusters) if deltas else np.load(os.path.join(retrieval_dir, 'clusters_train.npy'))
+
+    known = set(base_names(data_dir))
+    for d in deltas:
+        known.update(d.store.name_list())
+    records = []
+    for datum in plans:
+        if str(datum.name) in known:
+            print(f'skipping {datum.name}: already in the corpus')
+            continue
+        known.add(str(datum.name))
+        records.append(as_train_record(datum))
+    if not records:
+        return None
+
+    tf = [dict(zip('xy', compute_tf(r.boundary))) for r in records]
+    tf_sampled = boundaries_to_tf([r.boundary for r in records])
+    rNum = np.stack([plan_room_counts(r.box[:, -1]) for r in records])
+    eNum = np.stack([plan_edge_signature(r.box[:, -1], r.edge) for r in records])
+    tf_parts = [tf_base] + [d.tf for d in deltas]
+    assign = topk(squared_l2(tf_sampled, centroids), 1)[:, 0]
+    clusters = update_clusters(tf_parts, centroids, clusters, tf_sampled)
+
+    version = deltas[-1].version + 1 if deltas else 1
+    path = os.path.join(delta_dir, f'v{version:05d}')
+    tmp_dir = path + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    write_store(os.path.join(tmp_dir, 'store'), [r.name for r in records], records, tf)
+    for name, array in [('tf', tf_sampled.astype(tf_base.dtype)), ('rNum', rNum), ('eNum', eNum),
+                        ('assign', assign), ('clusters', clusters)]:
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'format': DELTA_VERSION,
+            'version': version,
+            'base_size': sum(len(p) for p in tf_parts),
+            'size': len(records),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }, f)
+    os.rename(tmp_dir, path)
+
+    size = sum(len(p) for p in tf_parts)
+    entered = np.isin(clusters, np.arange(size, size + len(records)))
+    print(f'delta v{version:05d}: {len(records)} plans (ids {size}..{size + len(records) - 1}), '
+          f'{entered.sum()} entries in {entered.any(1).sum()} cluster member lists -> {path}')
+    return CorpusDelta(path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import scipy.io as sio
+
+    parser = argparse.ArgumentParser(description='Append plans (data.mat format) to the retrieval corpus as a delta')
+    parser.add_argument('data_path')
+    parser.add_argument('--retrieval_dir', default='./retrieval')
+    parser.add_argument('--data_dir', default='./static/Data')
+    parser.add_argument('--delta_dir', default=DELTA_DIR)
+    args = parser.parse_args()
+
+    data = sio.loadmat(args.data_path, squeeze_me=True, struct_as_record=False)['data']
+    ingest(np.atleast_1d(data), args.retrieval_dir, args.data_dir, args.delta_dir)
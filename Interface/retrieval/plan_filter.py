@@ -0,0 +1,191 @@
+"""
+Vectorized candidate filters over the training corpus.
+
+Room-count constraints of NumSearch / GraphSearch are evaluated as one NumPy
+expression over train_data_rNum, the adjacency constraint of GraphSearch as one
+dominance test over train_data_eNum. PlanFilterIndex keeps every column sorted
+(per-room-type count buckets and edge-signature buckets), so a fused query over
+the whole corpus only tests the rows in the bucket of its most selective constraint.
+"""
+import numpy as np
+
+# coarse room types of the (5,5) adjacency signature (data_train_eNum)
+COARSE_TYPES = ["BedRoom", "Bathroom", "Kitchen", "Balcony", "Storage"]
+BEDROOM_TYPES = ["MasterRoom", "SecondRoom", "GuestRoom", "ChildRoom", "StudyRoom"]
+
+
+def edge_signature(nodes, edges):
+    '''
+    nodes: [[index, room name, x, y, scale], ...] of the user graph
+    edges: [[index1, index2], ...]
+    return: (25,) adjacency counts between coarse room types, the query of GraphSearch
+
+    Every edge is counted in both directions (twice on the diagonal), edges
+    touching a room outside COARSE_TYPES are ignored.
+    '''
+    coarse = {}
+    for indx, rmname, *_ in nodes:
+        rmname = "BedRoom" if rmname in BEDROOM_TYPES else rmname
+        coarse[indx] = COARSE_TYPES.index(rmname) if rmname in COARSE_TYPES else -1
+    pairs = np.array([[coarse.get(i, -1), coarse.get(j, -1)] for i, j in edges], dtype=int).reshape(-1, 2)
+    pairs = pairs[(pairs >= 0).all(1)]
+    edgematrix = np.zeros((5, 5))
+    np.add.at(edgematrix, (pairs[:, 0], pairs[:, 1]), 1)
+    np.add.at(edgematrix, (pairs[:, 1], pairs[:, 0]), 1)
+    return edgematrix.reshape(25)
+
+
+# rType (data.mat room label) -> coarse type of data_train_eNum (1..5 in COARSE_TYPES order, 6.. ignored)
+ROOM_TYPE_TO_COARSE = np.array([1, 2, 3, 4, 1, 2, 2, 2, 2, 5, 1, 6, 1, 10, 7, 8, 9, 10]) - 1
+COARSE_REORDER = np.array([0, 1, 3, 2, 4, 5])
+
+
+def plan_room_counts(rType):
+    '''
+    rType: room types of one plan
+    return: (14,) uint8 row of rNum_train: counts of types 0..12, then the bedrooms
+    '''
+    rNum = np.zeros(14, dtype=np.uint8)
+    rNum[:13] = np.bincount(np.asarray(rType, dtype=int), minlength=13)[:13]
+    rNum[13] = rNum[[1, 5, 6, 7, 8]].sum()
+    return rNum
+
+
+def plan_edge_signature(rType, rEdge):
+    '''
+    rType: room types of one plan, rEdge: (u,v,r) rows
+    return: (25,) uint8 row of data_train_eNum, counted as edge_signature
+    '''
+    edge = np.asarray(rEdge, dtype=int).reshape(-1, 3)
+    edge = COARSE_REORDER[ROOM_TYPE_TO_COARSE[np.asarray(rType, dtype=int)[edge[:, :2]]]]
+    edge = edge[((edge >= 1) & (edge <= 5)).all(1)] - 1
+    e = np.zeros((5, 5), dtype=np.uint8)
+    np.add.at(e, (edge[:, 0], edge[:, 1]), 1)
+    off = edge[:, 0] != edge[:, 1]
+    np.add.at(e, (edge[off, 1], edge[off, 0]), 1)
+    return e.reshape(25)
+
+
+def edge_mask(eNum, edge):
+    '''
+    eNum: (N, 25) adjacency signatures of the candidates
+    edge: (25,) query signature
+    return: (N,) bool, the candidates having at least the query adjacencies
+    '''
+    return (eNum >= edge).all(axis=1)
+
+
+def room_constraints(mask, acc, num):
+    '''
+    mask/acc/num: roomactarr/roomexaarr/roomnumarr sent by the frontend
+    return: (exact, num) arrays for the constrained columns, None if nothing is constrained
+
+    As in the original per-row filter, a non-empty mask constrains every one of
+    its columns: exact count if acc[i], at least num[i] otherwise.
+    '''
+    if not mask:
+        return None
+    n = len(mask)
+    exact = np.array([bool(acc[i]) for i in range(n)])
+    num = np.array([num[i] for i in range(n)])
+    return exact, num
+
+
+def room_count_mask(rNum, mask, acc, num):
+    '''
+    rNum: (N, C) room counts of the candidates
+    return: (N,) bool, the candidates satisfying the room-count constraints
+    '''
+    constraints = room_constraints(mask, acc, num)
+    if constraints is None:
+        return np.ones(len(rNum), dtype=bool)
+    exact, num = constraints
+    sub = np.asarray(rNum)[:, :len(num)]
+    return np.where(exact, sub == num, sub >= num).all(1)
+
+
+def _sorted_columns(values):
+    '''
+    return: order, counts with order[c] the row ids sorted by column c and counts[c] the sorted values
+    '''
+    order = np.argsort(values, axis=0, kind='stable').T.astype(np.int32)
+    counts = np.take_along_axis(np.asarray(values), order.T, 0).T.copy()
+    return order, counts
+
+
+def _smallest_bucket(order, counts, exact, num, best=None):
+    '''
+    order, counts: from _sorted_columns
+    exact, num: one constraint per column (== num if exact else >= num)
+    best: (size, order row, lo, hi) of the best bucket so far
+    return: (size, order row, lo, hi) of the smallest bucket
+    '''
+    n = counts.shape[1]
+    for c in range(len(num)):
+        lo = np.searchsorted(counts[c], num[c], side='left')
+        hi = np.searchsorted(counts[c], num[c], side='right') if exact[c] else n
+        if best is None or hi - lo < best[0]:
+            best = (hi - lo, order[c], lo, hi)
+    return best
+
+
+class PlanFilterIndex():
+    def __init__(self, rNum, eNum=None):
+        '''
+        rNum: (N, C) room counts of the training data (train_data_rNum)
+        eNum: (N, 25) adjacency signatures of the training data (train_data_eNum), optional
+        '''
+        self.rNum = rNum
+        # order[c]: row ids sorted by the count of room type c, counts[c]: the sorted counts
+        self.order, self.counts = _sorted_columns(rNum)
+        self.eNum = None
+        if eNum is not None:
+            eNum = np.asarray(eNum)
+            self.eNum = np.ascontiguousarray(eNum, dtype=np.uint8) if eNum.max(initial=0) < 256 else eNum
+            # edge-signature buckets: every adjacency cell, plus the total edge count
+            signature = np.concatenate((self.eNum, self.eNum.sum(1, dtype=np.int64)[:, None]), 1)
+            self.edge_order, self.edge_counts = _sorted_columns(signature)
+
+    def __len__(self):
+        return len(self.rNum)
+
+    def _room_bucket(self, exact, num):
+        '''row ids of the smallest bucket implied by one constraint'''
+        best = _smallest_bucket(self.order, self.counts, exact, num)
+        if best is None or best[0] == len(self):
+            return None
+        return np.sort(best[1][best[2]:best[3]])
+
+    def query_rooms(self, mask, acc, num):
+        '''
+        return: sorted ids of all training rows satisfying the room-count constraints,
+            the same as np.where(list(map(get_filter_func(mask, acc, num), rNum)))[0]
+        '''
+        constraints = room_constraints(mask, acc, num)
+        if constraints is None:
+            return np.arange(len(self))
+        rows = self._room_bucket(*constraints)
+        if rows is None:
+            return np.flatnonzero(room_count_mask(self.rNum, mask, acc, num))
+        return rows[room_count_mask(self.rNum[rows], mask, acc, num)]
+
+    def query(self, mask, acc, num, edge):
+        '''
+        fused room-count and adjacency filter of GraphSearch
+        mask/acc/num: room-count constraints, an empty mask disables them
+        edge: (25,) query signature from edge_signature
+        return: sorted ids of all training rows satisfying both filters
+        '''
+        edge = np.asarray(edge)
+        constraints = room_constraints(mask, acc, num)
+        best = None
+        if constraints is not None:
+            best = _smallest_bucket(self.order, self.counts, *constraints)
+        signature = np.append(edge, edge.sum())
+        best = _smallest_bucket(self.edge_order, self.edge_counts, np.zeros(len(signature), dtype=bool), signature, best)
+        rows = np.sort(best[1][best[2]:best[3]])
+
+        keep = edge_mask(self.eNum[rows], edge)
+        if constraints is not None:
+            keep &= room_count_mask(self.rNum[rows], mask, acc, num)
+        return rows[keep]
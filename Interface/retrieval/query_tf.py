@@ -0,0 +1,94 @@
+"""
+Turning functions of query boundaries.
+
+Test boundaries are sampled offline into tf_test.npy (row i belongs to
+testNameList[i], written by DataPreparation/1.tf_train.py or
+`python -m retrieval.query_tf`). Boundaries registered at runtime
+(ProcessDimensions) are computed on first use and kept in an LRU cache,
+so repeated searches on one boundary skip the feature extraction.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from retrieval.turning_function import compute_tf, sample_tf, boundaries_to_tf
+
+
+class QueryTFCache():
+    def __init__(self, tf_test=None, maxsize=256, ndim=1000):
+        '''
+        tf_test: (ntest, ndim) precomputed sampled tf of the test set, None to compute everything lazily
+        maxsize: number of runtime boundaries kept in the LRU cache
+        '''
+        self.tf_test = tf_test
+        self.maxsize = maxsize
+        self.ndim = ndim
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(boundary):
+        b = np.ascontiguousarray(np.asarray(boundary)[:, :2], dtype=np.float64)
+        return b.tobytes()
+
+    def get(self, datum, index=None):
+        '''
+        datum: test datum with boundary
+        index: row of datum in test_data, rows covered by tf_test are read from it directly
+        return: (ndim,) sampled tf, read-only
+        '''
+        if index is not None and self.tf_test is not None and 0 <= index < len(self.tf_test):
+            self.hits += 1
+            return self.tf_test[index]
+
+        key = self._key(datum.boundary)
+        with self._lock:
+            y_sampled = self._cache.get(key)
+            if y_sampled is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return y_sampled
+
+        x, y = compute_tf(datum.boundary)
+        y_sampled = sample_tf(x, y, self.ndim)
+        y_sampled.flags.writeable = False
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = y_sampled
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return y_sampled
+
+
+def load_cache(tf_test_path, ntest=None, maxsize=256):
+    '''
+    Return a QueryTFCache backed by tf_test_path, or a purely lazy one if it has not
+    been built or (ntest: number of served test plans) was built for another test set.
+    '''
+    tf_test = np.load(tf_test_path) if os.path.exists(tf_test_path) else None
+    if tf_test is not None and ntest is not None and len(tf_test) != ntest:
+        print(f'{tf_test_path} has {len(tf_test)} rows for {ntest} test plans, ignored '
+              f'(rebuild it with python -m retrieval.query_tf)')
+        tf_test = None
+    return QueryTFCache(tf_test, maxsize)
+
+
+if __name__ == "__main__":
+    import argparse
+    import pickle
+    import time
+
+    parser = argparse.ArgumentParser(description='Precompute the sampled turning functions of the test set')
+    parser.add_argument('test_pkl', nargs='?', default='./static/Data/data_test_converted.pkl')
+    parser.add_argument('out', nargs='?', default='./retrieval/tf_test.npy')
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    test_data = pickle.load(open(args.test_pkl, 'rb'))['data']
+    tf_test = boundaries_to_tf([d.boundary for d in test_data])
+    np.save(args.out, tf_test)
+    print(f'saved {tf_test.shape} to {args.out} in {time.perf_counter() - t1:.2f}s')
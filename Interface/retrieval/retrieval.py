@@ -1,61 +1,37 @@
 import numpy as np
 import time
 import Houseweb.views as vw
-def compute_tf(b):
-    '''
-    input: boundary points array (x,y,dir,isNew)
-    return: tf.x, tf.y
-    '''
-    if b.shape[1]>2:
-        b=b[:,:2]
-    b = np.concatenate((b,b[:1]))
-    nPoint = len(b)-1
-    lineVec = b[1:]-b[:-1]
-    lineLength = np.linalg.norm(lineVec,axis=1)
-    
-    perimeter = lineLength.sum()
-    lineVec = lineVec/perimeter
-    lineLength = lineLength/perimeter
-
-    angles = np.zeros(nPoint)
-    for i in range(nPoint):
-        z = np.cross(lineVec[i],lineVec[(i+1)%nPoint])
-        sign = np.sign(z)
-        angles[i] = np.arccos(np.dot(lineVec[i],lineVec[(i+1)%nPoint]))*sign
-
-    x = np.zeros(nPoint+1)
-    y = np.zeros(nPoint+1)
-    s = 0
-    for i in range(1,nPoint+1):
-        x[i] = lineLength[i-1]+x[i-1]
-        y[i-1] = angles[i-1]+s
-        s = y[i-1]
-    y[-1] = s
-    return x,y
-
-def sample_tf(x,y,ndim=1000):
-    '''
-    input: tf.x,tf.y, ndim
-    return: n-dim tf values
-    '''
-    t = np.linspace(0,1,ndim)
-    return np.piecewise(t,[t>=xx for xx in x],y)
+from retrieval.turning_function import compute_tf, sample_tf, boundaries_to_tf
 
 class DataRetriever():
-    def __init__(self,tf_train,centroids,clusters):
+    def __init__(self,tf_train,centroids,clusters,engine=None,tf_cache=None):
         '''
         tf_train: tf of training data
         centroids: tf cluster centroids of training data
         clusters: data index for each cluster of training data
+        engine: optional ann_index.RetrievalEngine built over tf_train
+        tf_cache: optional query_tf.QueryTFCache for the query boundaries
         '''
         self.tf_train = tf_train
         self.centroids = centroids
         self.clusters = clusters
+        self.engine = engine
+        self.tf_cache = tf_cache
+
+    def query_tf(self,datum,index=None):
+        '''
+        datum: test data
+        index: row of datum in test_data, lets the cache use the precomputed tf_test
+        return: 1000-d sampled tf of the data boundary
+        '''
+        if self.tf_cache is not None:
+            return self.tf_cache.get(datum,index)
+        x,y = compute_tf(datum.boundary)
+        return sample_tf(x,y,1000)
     
-    def retrieve_bf(self,datum,k=20):
+    def retrieve_bf(self,datum,k=20,index=None):
         # compute tf for the data boundary
-        x,y = compute_tf(datum.boundary)
-        y_sampled = sample_tf(x,y,1000)
+        y_sampled = self.query_tf(datum,index)
         dist = np.linalg.norm(y_sampled-self.tf_train,axis=1)
         if k>np.log2(len(self.tf_train)):
             index = np.argsort(dist)[:k]
@@ -64,15 +40,15 @@ class DataRetriever():
             index = index[np.argsort(dist[index])]
         return index
 
-    def retrieve_cluster(self,datum,k=20,multi_clusters=False):
+    def retrieve_cluster(self,datum,k=20,multi_clusters=False,index=None):
         '''
         datum: test data
         k: retrieval num
+        index: row of datum in test_data (optional)
         return: index for training data 
         '''
         # compute tf for the data boundary
-        x,y = compute_tf(datum.boundary)
-        y_sampled = sample_tf(x,y,1000)
+        y_sampled = self.query_tf(datum,index)
         # compute distance to cluster centers
         dist = np.linalg.norm(y_sampled-self.centroids,axis=1)
 
@@ -91,16 +67,42 @@ class DataRetriever():
         index = cluster[np.argsort(dist)[:k]]
         return index
 
-def retrieval(test_data,k,multi_clusters):
+    def retrieve_ann(self,data,k=20,nprobe=None,index=None):
+        '''
+        data: test datum, or list of test data queried as one batch
+        k: retrieval num
+        nprobe: clusters visited by the engine, None uses the engine default
+        index: row of a single datum in test_data (optional)
+        return: index for training data, (k,) for one datum, (len(data),k) for a list
+        '''
+        batch = isinstance(data,(list,tuple,np.ndarray))
+        if batch:
+            y_sampled = boundaries_to_tf([datum.boundary for datum in data],1000)
+        else:
+            y_sampled = self.query_tf(data,index)[None]
+        result = self.engine.search(y_sampled,k,nprobe)
+        if not batch:
+            result = result[0]
+            return result[result>=0]
+        return result
+
+def retrieval(test_data,k,multi_clusters,test_index=None):
 
-    retriever = DataRetriever(vw.tf_train,vw.centroids,vw.clusters)
+    retriever = DataRetriever(vw.tf_train,vw.centroids,vw.clusters,vw.tf_engine,vw.tf_query)
     datum = test_data
     # vis_boundary(datum.boundary)
 
     t1 = time.perf_counter()
-    index = retriever.retrieve_cluster(datum,k,multi_clusters)
-    t2 = time.perf_counter()
-    print('cluster',t2-t1)
+    if retriever.engine is not None:
+        # more candicates: probe twice as many clusters as the engine default
+        nprobe = 2*retriever.engine.nprobe if multi_clusters else None
+        index = retriever.retrieve_ann(datum,k,nprobe,test_index)
+        t2 = time.perf_counter()
+        print('ann',retriever.engine.backend,t2-t1)
+    else:
+        index = retriever.retrieve_cluster(datum,k,multi_clusters,test_index)
+        t2 = time.perf_counter()
+        print('cluster',t2-t1)
     data_retrieval = vw.train_data[index]
     # data_retrieval= trainNameList[index]
     # vis_boundary(data_retrieval[0].boundary)
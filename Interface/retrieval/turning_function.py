@@ -0,0 +1,172 @@
+import numpy as np
+
+
+def compute_tf(b):
+    '''
+    input: boundary points array (x,y,dir,isNew)
+    return: tf.x, tf.y
+    '''
+    b = np.asarray(b,dtype=float)
+    if b.shape[1]>2:
+        b=b[:,:2]
+    lineVec = np.concatenate((b[1:],b[:1]))-b
+    lineLength = np.sqrt((lineVec*lineVec).sum(1))
+
+    perimeter = lineLength.sum()
+    lineVec = lineVec/perimeter
+    lineLength = lineLength/perimeter
+
+    # angle between segment i and segment i+1 (same formula as the original per-vertex loop)
+    nextVec = np.concatenate((lineVec[1:],lineVec[:1]))
+    z = lineVec[:,0]*nextVec[:,1]-lineVec[:,1]*nextVec[:,0]
+    angles = np.arccos((lineVec*nextVec).sum(1))*np.sign(z)
+
+    x = np.concatenate(([0.],np.cumsum(lineLength)))
+    y = np.cumsum(angles)
+    y = np.concatenate((y,y[-1:]))
+    return x,y
+
+
+def sample_tf(x,y,ndim=1000):
+    '''
+    input: tf.x,tf.y, ndim
+    return: n-dim tf values
+    '''
+    t = np.linspace(0,1,ndim)
+    # value of the last breakpoint x[j]<=t, as np.piecewise(t,[t>=xx for xx in x],y)
+    idx = np.searchsorted(x,t,side='right')-1
+    out = np.asarray(y,dtype=float)[np.clip(idx,0,None)]
+    out[idx<0] = 0
+    return out
+
+
+def compute_tf_batch(boundaries):
+    '''
+    input: list of boundary points arrays (x,y,dir,isNew)
+    return: tf.x, tf.y with shape (B, max_points+1)
+        rows are padded with x=inf, so padded breakpoints are never selected by sample_tf_batch
+    '''
+    B = len(boundaries)
+    n = np.array([len(b) for b in boundaries])
+    L = n.max() if B else 0
+    valid = np.arange(L)[None]<n[:,None]
+
+    points = np.zeros((B,L,2))
+    for i,b in enumerate(boundaries):
+        points[i,:n[i]] = np.asarray(b)[:,:2]
+
+    # index of the next vertex inside each closed polygon
+    nxt = np.arange(1,L+1)[None].repeat(B,0)
+    nxt[np.arange(B),n-1] = 0
+    nxt[~valid] = 0
+    lineVec = np.take_along_axis(points,nxt[...,None],1)-points
+    lineVec[~valid] = 0
+    lineLength = np.linalg.norm(lineVec,axis=2)
+
+    perimeter = lineLength.sum(1,keepdims=True)
+    lineVec = lineVec/perimeter[...,None]
+    lineLength = lineLength/perimeter
+
+    nextVec = np.take_along_axis(lineVec,nxt[...,None],1)
+    z = lineVec[...,0]*nextVec[...,1]-lineVec[...,1]*nextVec[...,0]
+    angles = np.arccos((lineVec*nextVec).sum(2))*np.sign(z)
+    angles[~valid] = 0
+
+    x = np.zeros((B,L+1))
+    x[:,1:] = np.cumsum(lineLength,1)
+    y = np.zeros((B,L+1))
+    y[:,:L] = np.cumsum(angles,1)
+    # y[n] = y[n-1], then pad
+    y[np.arange(B),n] = y[np.arange(B),n-1]
+    x[:,1:][~valid] = np.inf
+    return x,y
+
+
+def sample_tf_batch(x,y,ndim=1000,chunk=1024):
+    '''
+    input: tf.x,tf.y with shape (B, P) from compute_tf_batch, ndim
+    return: (B, ndim) tf values
+    '''
+    x, y = np.asarray(x), np.asarray(y)
+    t = np.linspace(0,1,ndim)
+    out = np.zeros((len(x),ndim))
+    for s in range(0,len(x),chunk):
+        xc, yc = x[s:s+chunk], y[s:s+chunk]
+        # index of the last breakpoint with t>=x
+        idx = (t[None,None,:]>=xc[:,:,None]).sum(1)-1
+        out[s:s+chunk] = np.take_along_axis(yc,np.clip(idx,0,None),1)
+        out[s:s+chunk][idx<0] = 0
+    return out
+
+
+def boundaries_to_tf(boundaries,ndim=1000):
+    '''
+    input: list of boundary points arrays
+    return: (B, ndim) sampled turning functions, the retrieval feature of each boundary
+    '''
+    x,y = compute_tf_batch(boundaries)
+    return sample_tf_batch(x,y,ndim)
+
+
+def sample_tfs(tfs,ndim=1000):
+    '''
+    input: list of turning functions {'x','y'} (compute_tf)
+    return: (B, ndim) sampled turning functions, boundaries_to_tf without recomputing them
+    '''
+    L = max(len(tf['x']) for tf in tfs)
+    x = np.full((len(tfs),L),np.inf)
+    y = np.zeros((len(tfs),L))
+    for i,tf in enumerate(tfs):
+        x[i,:len(tf['x'])] = tf['x']
+        y[i,:len(tf['y'])] = tf['y']
+    return sample_tf_batch(x,y,ndim)
+
+
+def pack_tf(tfs):
+    '''
+    input: list of turning functions {'x','y'} (compute_tf)
+    return: x, y (all breakpoints concatenated), offsets (n+1,), rows of tf j are [offsets[j]:offsets[j+1]]
+    '''
+    offsets = np.zeros(len(tfs)+1,dtype=np.int64)
+    offsets[1:] = np.cumsum([len(tf['x']) for tf in tfs])
+    x = np.concatenate([np.asarray(tf['x'],dtype=float) for tf in tfs])
+    y = np.concatenate([np.asarray(tf['y'],dtype=float) for tf in tfs])
+    return x,y,offsets
+
+
+def tf_dist_to_many(x1,y1,x2,y2,offsets):
+    '''
+    L1 distance between the piecewise-constant turning function (x1,y1) and
+    every function of pack_tf, the same value as the pairwise merge loop
+    (compute_tf_dist in DataPreparation/1.tf_train.py).
+
+    The merged breakpoints of each pair are never materialised: every
+    segment of the merge starts at a breakpoint of x1 or of x2 and ends at
+    the next breakpoint of either function, both found with searchsorted.
+    return: (n,) distances
+    '''
+    x1, y1 = np.asarray(x1,dtype=float), np.asarray(y1,dtype=float)
+    n1, J = len(x1), len(offsets)-1
+    rows = np.repeat(np.arange(J),np.diff(offsets))
+    k = np.arange(len(x2))
+    left = np.searchsorted(x1,x2,'left')    # breakpoints of x1 < x2[k]
+    right = np.searchsorted(x1,x2,'right')  # breakpoints of x1 <= x2[k]
+
+    # segments starting at a breakpoint of x2 that is not one of x1
+    last = k==offsets[rows+1]-1
+    end = np.minimum(
+        np.where(last,np.inf,x2[np.minimum(k+1,len(x2)-1)]),
+        np.where(right<n1,x1[np.minimum(right,n1-1)],np.inf))
+    seg = np.where(np.isfinite(end),end-x2,0)*(left==right)
+    dist = np.bincount(rows,weights=seg*np.abs(y1[np.maximum(right-1,0)]-y2),minlength=J)
+
+    # segments starting at a breakpoint of x1: breakpoints of each x2 <= x1[i]
+    hist = np.bincount(rows*(n1+1)+left,minlength=J*(n1+1)).reshape(J,n1+1)
+    count = np.cumsum(hist,1)[:,:n1]
+    nxt2 = offsets[:-1,None]+count
+    end = np.minimum(
+        np.where(count<np.diff(offsets)[:,None],x2[np.minimum(nxt2,len(x2)-1)],np.inf),
+        np.append(x1[1:],np.inf)[None])
+    seg = np.where(np.isfinite(end),end-x1[None],0)
+    dist += (seg*np.abs(y1[None]-y2[np.maximum(nxt2-1,0)])).sum(1)
+    return dist
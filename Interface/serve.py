@@ -0,0 +1,294 @@
+"""
+Pre-fork server: loads the read-only assets once, then forks the workers.
+
+With `manage.py runserver` or a WSGI server that imports the app in every
+worker, each process loads its own test/train data, tf_train (75k x 1000
+float64, ~600 MB) and model. Here the master loads the components
+(Houseweb/components.py) before forking:
+    - gc.freeze() moves every object loaded so far to the permanent
+      generation, so garbage collections in the workers do not write to
+      (and copy) the pages holding them;
+    - the model parameters are moved to shared memory (share_memory_);
+    - numpy arrays and memory-mapped stores are shared copy-on-write.
+The model warm-up runs in every worker after the fork (threads and CUDA
+contexts do not survive a fork); on a GPU device the model itself is loaded
+per worker.
+
+The endpoints keep session state in module globals of the process: boundaries
+registered by ProcessDimensions (test_data, testNameList), the last
+AdjustGraph result read by RelBox and Save_Editbox (boxes_pred, relbox,
+reledge) and model.test.adjust / indxlist. A client has to reach the same
+worker for a whole session, so every worker listens on its own port (port,
+port+1, ...). One worker (the default) needs nothing else; with several, a
+front proxy must pin each client to one worker port (sticky routing, e.g.
+nginx `hash $remote_addr consistent;` over the worker ports).
+
+POSIX only (os.fork), the memory report reads /proc (Linux). Run from the
+Interface directory:
+    python serve.py --threads 4 --port 8000
+    python serve.py --workers 4 --memory_report 60     # ports 8000-8003, per-worker RSS/PSS/USS after 60 s
+    python serve.py --benchmark_memory --workers 4     # same measurement on synthetic assets
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+
+PRELOADED = ('test', 'train', 'retrieval', 'model')
+
+
+def require_fork():
+    if not hasattr(os, 'fork'):
+        sys.exit('serve.py forks its workers and needs a POSIX system (Linux, macOS); '
+                 'on Windows run `python manage.py runserver`')
+
+
+def memory_usage(pid):
+    '''
+    return: dict of rss, pss, uss (private pages) and shared in MB, from /proc/<pid>/smaps_rollup
+    pss splits every shared page between the processes mapping it, so the sum
+    over master and workers is the memory the server really uses
+    '''
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+
+def print_memory_report(master, workers):
+    print(f'{"process":>14s} {"rss MB":>9s} {"pss MB":>9s} {"uss MB":>9s} {"shared MB":>10s}')
+    total = 0
+    for name, pid in [('master', master)] + [(f'worker {i}', pid) for i, pid in enumerate(workers)]:
+        try:
+            m = memory_usage(pid)
+        except OSError:
+            continue
+        total += m['pss']
+        print(f'{name:>14s} {m["rss"]:9.1f} {m["pss"]:9.1f} {m["uss"]:9.1f} {m["shared"]:10.1f}')
+    print(f'{"total pss":>14s} {total:9.1f}')
+    sys.stdout.flush()
+
+
+def preload(components):
+    '''
+    master: loads the read-only components in this thread (no thread may run
+    across the fork), shares the model weights and freezes the loaded objects
+    '''
+    import Houseweb.views as views
+    import model.test as mltest
+
+    names = list(components)
+    # CUDA cannot be used across a fork, a GPU model is loaded by every worker
+    if 'model' in names and mltest.get_device().type != 'cpu':
+        names.remove('model')
+    start = time.perf_counter()
+    views.components.load(*names)
+    if views.model is not None:
+        views.model.share_memory()
+    gc.collect()
+    gc.freeze()
+    print(f'preloaded {names} in {time.perf_counter() - start:.2f} Seconds')
+
+
+def make_server(sock, application, threads):
+    '''threads: size of the request thread pool, further requests wait for a free thread'''
+    from socketserver import ThreadingMixIn
+    from concurrent.futures import ThreadPoolExecutor
+    from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+    class Server(ThreadingMixIn, WSGIServer):
+        pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+
+        def process_request(self, request, client_address):
+            # ThreadingMixIn would start one thread per request
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            sys.stderr.write(f'[{os.getpid()}] {self.address_string()} - {format % args}\n')
+
+    server_class = Server if threads > 1 else WSGIServer
+    server = server_class(sock.getsockname(), Handler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    # what server_bind sets on the listening socket of the master
+    server.server_address = sock.getsockname()
+    host, server.server_port = server.server_address[:2]
+    server.server_name = socket.getfqdn(host)
+    server.setup_environ()
+    server.set_app(application)
+    return server
+
+
+def run_worker(sock, application, threads):
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    import Houseweb.views as views
+    # remaining components (the warm-up, a GPU model) in this worker's own threads
+    views.components.start()
+    make_server(sock, application, threads).serve_forever()
+
+
+def fork_worker(target, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            target(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def supervise(workers, spawn, memory_report=None):
+    '''
+    workers: pids, spawn(i) forks worker i again
+    restarts workers that exit, stops all of them on SIGTERM / SIGINT
+    '''
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    started = time.perf_counter()
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            i = workers.index(pid)
+            print(f'worker {i} (pid {pid}) exited with status {status}, restarting')
+            workers[i] = spawn(i)
+        if memory_report is not None and time.perf_counter() - started > memory_report:
+            print_memory_report(os.getpid(), workers)
+            memory_report = None
+        time.sleep(0.5)
+
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+
+def serve(host='0.0.0.0', port=8000, workers=1, threads=4, static=True, memory_report=None):
+    '''worker i serves port + i, see the module docstring for the session state'''
+    require_fork()
+    # the master loads synchronously, House/wsgi.py must not start loader threads
+    os.environ['PRELOAD_COMPONENTS'] = '0'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'House.settings')
+    from House.wsgi import application
+    if static:
+        from django.contrib.staticfiles.handlers import StaticFilesHandler
+        application = StaticFilesHandler(application)
+
+    preload(PRELOADED)
+
+    socks = [listen(host, port + i) for i in range(workers)]
+    for i in range(workers):
+        print(f'worker {i}: http://{host}:{port + i} with {threads} threads')
+    if workers > 1:
+        print('session state is per worker, route each client to one port (sticky routing)')
+    sys.stdout.flush()
+
+    spawn = lambda i: fork_worker(run_worker, socks[i], application, threads)
+    supervise([spawn(i) for i in range(workers)], spawn, memory_report)
+
+
+def benchmark_memory(workers=4, rows=75000, dim=1000, records=75000, seconds=3):
+    '''
+    per-worker memory with synthetic assets of the size of the real ones: a
+    (rows, dim) float64 array as tf_train and a list of record objects with
+    small arrays as the train pickle. Every worker reads all of them and runs
+    garbage collections, as request handling does.
+      load after fork: every worker loads its own copy (runserver / plain WSGI workers)
+      preload:         loaded in the master, no gc.freeze
+      preload+freeze:  loaded in the master, gc.freeze before the fork
+    '''
+    import numpy as np
+    require_fork()
+
+    class Record():
+        def __init__(self, i, rng):
+            self.name = str(i)
+            self.boundary = rng.integers(0, 256, (12, 4))
+            self.box = rng.integers(0, 256, (8, 5))
+            self.edge = rng.integers(0, 8, (10, 3))
+
+    def load():
+        rng = np.random.default_rng(0)
+        return rng.random((rows, dim)), [Record(i, rng) for i in range(records)]
+
+    def work(assets, ready):
+        tf, data = assets if assets is not None else load()
+        for _ in range(seconds):
+            tf.sum()
+            sum(len(d.name) + int(d.box[0, 0]) for d in data)
+            [object() for _ in range(100000)]
+            gc.collect()
+        os.write(ready, b'1')
+        time.sleep(3600)
+
+    for mode in ('load after fork', 'preload', 'preload+freeze'):
+        gc.unfreeze()
+        assets = load() if mode != 'load after fork' else None
+        if mode == 'preload+freeze':
+            gc.collect()
+            gc.freeze()
+        r, w = os.pipe()
+        pids = [fork_worker(work, assets, w) for _ in range(workers)]
+        for _ in pids:
+            os.read(r, 1)
+        print(f'{mode}, {workers} workers, tf {rows}x{dim} float64, {records} records')
+        print_memory_report(os.getpid(), pids)
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        os.close(r)
+        os.close(w)
+        del assets
+        gc.collect()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pre-fork server sharing the loaded datasets and model across workers')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', default=8000, type=int, help='port of worker 0, worker i serves port + i')
+    parser.add_argument('--workers', default=1, type=int, help='more than one needs sticky routing in front, see above')
+    parser.add_argument('--threads', default=4, type=int, help='size of the request thread pool of each worker')
+    parser.add_argument('--no_static', action='store_true', help='do not serve /static/ (behind a web server)')
+    parser.add_argument('--memory_report', default=None, type=float, help='print per-worker memory after this many seconds')
+    parser.add_argument('--benchmark_memory', action='store_true', help='measure per-worker memory on synthetic assets and exit')
+    args = parser.parse_args()
+
+    if args.benchmark_memory:
+        benchmark_memory(args.workers)
+    else:
+        serve(args.host, args.port, args.workers, args.threads, not args.no_static, args.memory_report)
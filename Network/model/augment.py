@@ -0,0 +1,166 @@
+"""
+Batched rotation/flip augmentation of collated training batches.
+
+The augmentation of FloorPlanDataset (rot, fliplr) turns the plan by a
+multiple of 90 degrees and mirrors it left-right. Every field of a
+floorplan_collate_fn batch has a closed form under these maps, so the whole
+batch is augmented with tensor ops on the training device instead of
+per-sample NumPy work and re-rasterization in the workers:
+    boundary, layout    torch.rot90 / flip of the rasters
+    inside_box, boxes   coordinate permutation in the [0,1] box frame
+    inside_coords       (x,y) -> (y,1-x) / (1-x,y)
+    attrs               the 5x5 position one-hot is a grid, turned like the rasters
+    triples             predicate permutation (left-of -> below, ...)
+Compared to FloorPlan(data, rot, fliplr) on the same turn/flip, the boundary
+raster, inside_box and inside_coords are identical; room edges of the layout
+image can move by one pixel (the rooms are not re-rasterized at half
+resolution), boxes keep their width under the flip (fliplr_box shrinks them
+by one pixel), and box centers exactly on a position bin edge or relations
+decided by ties in point_box_relation can land in the neighbouring bin /
+relation (<1% of rooms and triples on synthetic plans).
+The number of turns is uniform in 0..3, while FloorPlanDataset derives it
+from the front door direction and a random rot.
+"""
+import torch
+
+from model.utils import get_vocab
+
+# predicate name -> direction (dx, dy) in image coordinates (y down)
+DIRECTIONS = {
+    'left-of': (-1, 0), 'right-of': (1, 0), 'above': (0, -1), 'below': (0, 1),
+    'left-above': (-1, -1), 'left-below': (-1, 1), 'right-above': (1, -1), 'right-below': (1, 1),
+}
+
+
+def direction_name(dx, dy):
+    x = {-1: 'left', 0: None, 1: 'right'}[dx]
+    y = {-1: 'above', 0: None, 1: 'below'}[dy]
+    if x and y: return f'{x}-{y}'
+    return f'{x}-of' if x else y
+
+
+def predicate_tables(vocab=None):
+    '''
+    return: rot, flip LongTensors (P,), the predicate of a triple after one
+        90-degree turn (x,y) -> (y,1-x) / after the left-right flip
+    '''
+    vocab = vocab or get_vocab()
+    names = vocab['pred_idx_to_name']
+    index = vocab['pred_name_to_idx']
+    rot, flip = list(range(len(names))), list(range(len(names)))
+    for i, name in enumerate(names):
+        if name in DIRECTIONS:
+            dx, dy = DIRECTIONS[name]
+            rot[i] = index[direction_name(dy, -dx)]
+            flip[i] = index[direction_name(-dx, dy)]
+    return torch.tensor(rot), torch.tensor(flip)
+
+
+def rot_centers(boxes):
+    '''(cx,cy,w,h) -> (cy,1-cx,h,w)'''
+    cx, cy, w, h = boxes.unbind(-1)
+    return torch.stack([cy, 1 - cx, h, w], -1)
+
+
+def flip_centers(boxes):
+    cx, cy, w, h = boxes.unbind(-1)
+    return torch.stack([1 - cx, cy, w, h], -1)
+
+
+def rot_extents(boxes):
+    '''(x0,y0,x1,y1) -> (y0,1-x1,y1,1-x0)'''
+    x0, y0, x1, y1 = boxes.unbind(-1)
+    return torch.stack([y0, 1 - x1, y1, 1 - x0], -1)
+
+
+def flip_extents(boxes):
+    x0, y0, x1, y1 = boxes.unbind(-1)
+    return torch.stack([1 - x1, y0, 1 - x0, y1], -1)
+
+
+def rot_points(points):
+    '''(x,y) -> (y,1-x)'''
+    x, y = points.unbind(-1)
+    return torch.stack([y, 1 - x], -1)
+
+
+def flip_points(points):
+    x, y = points.unbind(-1)
+    return torch.stack([1 - x, y], -1)
+
+
+def apply_rows(x, k, fliplr, rot, flip):
+    '''
+    x: [R,...] rows, k: [R] number of turns, fliplr: [R] bool
+    rot, flip: functions of a block of rows
+    '''
+    x = x.clone()
+    for step in range(3):
+        turn = k > step
+        if turn.any(): x[turn] = rot(x[turn])
+    if fliplr.any(): x[fliplr] = flip(x[fliplr])
+    return x
+
+
+def apply_images(x, k, fliplr):
+    '''x: [N,...,H,W] rasters, each image turned k[i] times then flipped if fliplr[i]'''
+    x = x.clone()
+    for kk in range(4):
+        for ff in (False, True):
+            group = ((k == kk) & (fliplr == ff)).nonzero().view(-1)
+            if len(group) == 0 or (kk == 0 and not ff): continue
+            img = torch.rot90(x[group], kk, dims=(-2, -1))
+            x[group] = img.flip(-1) if ff else img
+    return x
+
+
+class BatchAugment():
+    def __init__(self, gsize=5, vocab=None):
+        '''gsize: position grid of FloorPlan.get_attributes'''
+        self.gsize = gsize
+        self.rot_pred, self.flip_pred = predicate_tables(vocab)
+
+    def sample(self, N, device):
+        '''k uniform in 0..3 turns, flip with probability 0.5'''
+        return torch.randint(0, 4, (N,), device=device), torch.rand(N, device=device) > 0.5
+
+    def __call__(self, batch, k=None, fliplr=None):
+        '''
+        batch: floorplan_collate_fn output (on any device), boxes relative to inside_box
+        k, fliplr: [N] per-plan turns / flips, random if not given
+        return: augmented batch, same layout
+        '''
+        boundary, inside_box, objs, attrs, triples, layout, boxes, inside_coords, obj_to_img, triple_to_img, name = batch
+        N, device = boundary.size(0), boundary.device
+        if k is None:
+            k, fliplr = self.sample(N, device)
+        k, fliplr = k.to(device), fliplr.to(device).bool()
+
+        boundary = apply_images(boundary, k, fliplr)
+        layout = apply_images(layout, k, fliplr)
+        inside_box = apply_rows(inside_box, k, fliplr, rot_extents, flip_extents)
+
+        # objects and triples follow their plan
+        ok, of = k[obj_to_img], fliplr[obj_to_img]
+        boxes = apply_rows(boxes, ok, of, rot_centers, flip_centers)
+        G = self.gsize
+        grid = attrs[:, :G * G].reshape(-1, G, G)
+        grid = apply_images(grid, ok, of).reshape(-1, G * G)
+        attrs = torch.cat([grid, attrs[:, G * G:]], 1)
+
+        rot_pred, flip_pred = self.rot_pred.to(device), self.flip_pred.to(device)
+        tk, tf = k[triple_to_img], fliplr[triple_to_img]
+        p = triples[:, 1]
+        for step in range(3):
+            p = torch.where(tk > step, rot_pred[p], p)
+        p = torch.where(tf, flip_pred[p], p)
+        triples = torch.stack([triples[:, 0], p, triples[:, 2]], 1)
+
+        # inside_coords: list of [1,P_i,2], one block for the batch
+        sizes = [c.size(1) for c in inside_coords]
+        coords = torch.cat([c.view(-1, 2) for c in inside_coords])
+        point_to_img = torch.repeat_interleave(torch.arange(N, device=device), torch.tensor(sizes, device=device))
+        coords = apply_rows(coords, k[point_to_img], fliplr[point_to_img], rot_points, flip_points)
+        inside_coords = [c.view(1, -1, 2) for c in coords.split(sizes)]
+
+        return boundary, inside_box, objs, attrs, triples, layout, boxes, inside_coords, obj_to_img, triple_to_img, name
@@ -0,0 +1,227 @@
+"""
+Parity checks and microbenchmarks for the training-side layout utilities and losses.
+Run from the Network directory:
+    python -m model.benchmark --batch_size 32
+"""
+import time
+import torch
+import torch.nn.functional as F
+
+import model.box_utils as box_utils
+from model.layout import _boxes_to_grid, _pool_samples, boxes_to_seg, masks_to_seg
+from model.loss import InsideLoss, CoverageLoss, MutexLoss, DoorLoss
+
+
+def timeit(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        out = fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - t1)
+    return best, out
+
+
+def random_batch(batch_size, rooms=(4, 12), num_classes=15, device='cpu', seed=0):
+    '''
+    boxes (centers, [0,1] space), objs and obj_to_img of batch_size plans,
+    the objects of each plan contiguous as in floorplan_collate_fn
+    '''
+    g = torch.Generator().manual_seed(seed)
+    counts = torch.randint(rooms[0], rooms[1], (batch_size,), generator=g)
+    obj_to_img = torch.arange(batch_size).repeat_interleave(counts)
+    O = obj_to_img.size(0)
+    extents = torch.rand(O, 2, 2, generator=g).sort(1)[0].reshape(O, 4)
+    boxes = box_utils.extents_to_centers(extents)
+    objs = torch.randint(0, num_classes, (O,), generator=g)
+    return boxes.to(device), objs.to(device), obj_to_img.to(device)
+
+
+def pool_max_reference(samples, obj_to_img):
+    '''original _pool_samples(pooling='max'): python list and .index per image'''
+    all_out = []
+    obj_to_img_list = [i.item() for i in list(obj_to_img)]
+    N = obj_to_img.data.max().item() + 1
+    for i in range(N):
+        start = obj_to_img_list.index(i)
+        end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
+        all_out.append(torch.max(samples[start:end, :, :, :], dim=0)[0])
+    return torch.stack(all_out)
+
+
+def sum_seg_reference(mask_sampled, objs, obj_to_img, num_classes):
+    '''original per-object accumulation of boxes_to_seg / masks_to_seg'''
+    N = obj_to_img.data.max().item() + 1
+    H, W = mask_sampled.shape[-2:]
+    seg = torch.zeros((N, num_classes, H, W)).to(mask_sampled.device)
+    for j in range(obj_to_img.size(0)):
+        i, obj = obj_to_img[j], objs[j]
+        seg[i, obj] = seg[i, obj] + mask_sampled[j]
+    return seg
+
+
+def boxes_to_seg_reference(boxes, objs, obj_to_img, H, num_classes=15):
+    O = boxes.size(0)
+    mask_sampled = F.grid_sample(torch.ones(O, 1, 8, 8).to(boxes), _boxes_to_grid(boxes, H, H))
+    return sum_seg_reference(mask_sampled, objs, obj_to_img, num_classes)
+
+
+def masks_to_seg_reference(boxes, masks, objs, obj_to_img, H, num_classes=15):
+    O, M = boxes.size(0), masks.size(1)
+    mask_sampled = F.grid_sample(masks.float().view(O, 1, M, M), _boxes_to_grid(boxes, H, H))
+    return sum_seg_reference(mask_sampled, objs, obj_to_img, num_classes)
+
+
+def benchmark_layout(batch_size=32, H=64, D=64, M=16, num_classes=15, device='cpu'):
+    boxes, objs, obj_to_img = random_batch(batch_size, num_classes=num_classes, device=device)
+    O = boxes.size(0)
+    masks = (torch.rand(O, M, M) > 0.5).to(device)
+    samples = torch.randn(O, D, H, H, device=device)
+    print(f'layout utilities, batch {batch_size} ({O} rooms), {H}x{H}, device={device}')
+
+    cases = [
+        ('_pool_samples max', lambda: pool_max_reference(samples, obj_to_img),
+         lambda: _pool_samples(samples, obj_to_img, pooling='max')),
+        ('boxes_to_seg', lambda: boxes_to_seg_reference(boxes, objs, obj_to_img, H, num_classes),
+         lambda: boxes_to_seg(boxes, objs, obj_to_img, H, num_classes=num_classes)),
+        ('masks_to_seg', lambda: masks_to_seg_reference(boxes, masks, objs, obj_to_img, H, num_classes),
+         lambda: masks_to_seg(boxes, masks, objs, obj_to_img, H, num_classes=num_classes)),
+    ]
+    with torch.no_grad():
+        for name, reference, vectorized in cases:
+            t_ref, ref = timeit(reference)
+            t_vec, out = timeit(vectorized)
+            diff = (ref - out).abs().max().item()
+            print(f'  {name:18s}: loop {t_ref*1e3:9.2f} ms, vectorized {t_vec*1e3:8.2f} ms, max abs diff {diff:.2e}')
+            assert ref.shape == out.shape and diff < 1e-5
+
+
+def inside_loss_reference(loss, boxes, fragment_boxes, obj_to_img):
+    '''original InsideLoss.forward, one _inside_loss per image'''
+    N = obj_to_img.data.max().item() + 1
+    boxes = box_utils.centers_to_extents(boxes)
+    losses = [loss._inside_loss(boxes[(obj_to_img == i).nonzero().view(-1)], fragment_boxes[[i]]) for i in range(N)]
+    return torch.mean(torch.stack(losses))
+
+
+def coverage_loss_reference(loss, boxes, fragments, obj_to_img):
+    N = obj_to_img.data.max().item() + 1
+    boxes = box_utils.centers_to_extents(boxes)
+    losses = [loss._coverage_loss(boxes[(obj_to_img == i).nonzero().view(-1)], fragments[i]) for i in range(N)]
+    return torch.mean(torch.stack(losses))
+
+
+def mutex_loss_reference(loss, boxes, obj_to_img, objs):
+    N = obj_to_img.data.max().item() + 1
+    boxes = box_utils.centers_to_extents(boxes)
+    losses = [loss._mutex_loss(boxes[((obj_to_img == i) * (objs != 0)).nonzero().view(-1)]) for i in range(N)]
+    return torch.mean(torch.stack(losses))
+
+
+def door_loss_reference(loss, boxes, doors, obj_to_img, objs):
+    N = obj_to_img.data.max().item() + 1
+    boxes = box_utils.centers_to_extents(boxes)
+    losses = [loss._door_loss(boxes[(obj_to_img == i).nonzero().view(-1)], doors[[i]],
+                              (objs[obj_to_img == i] != 0).long()) for i in range(N)]
+    return torch.mean(torch.stack(losses))
+
+
+def random_fragments(batch_size, device='cpu', seed=1):
+    '''inside_boxes [N,4] (extents) and inside_coords, a list of [1,P_i,2] points in them'''
+    g = torch.Generator().manual_seed(seed)
+    inside_box = torch.rand(batch_size, 2, 2, generator=g).sort(1)[0].reshape(batch_size, 4)
+    inside_coords = []
+    for box in inside_box:
+        P = int(torch.randint(100, 400, (1,), generator=g))
+        points = box[:2] + torch.rand(P, 2, generator=g) * (box[2:] - box[:2])
+        inside_coords.append(points.view(1, P, 2).to(device))
+    return inside_box.to(device), inside_coords
+
+
+def benchmark_losses(batch_size=32, nsample=100, device='cpu', repeat=5):
+    '''forward+backward of the geometric losses, per-image loops vs padded batch'''
+    cuda = torch.device(device).type == 'cuda'
+    boxes, objs, obj_to_img = random_batch(batch_size, device=device)
+    inside_box, inside_coords = random_fragments(batch_size, device=device)
+    print(f'losses forward+backward, batch {batch_size} ({boxes.size(0)} rooms), nsample={nsample}, device={device}')
+
+    inside, coverage = InsideLoss(nsample, cuda), CoverageLoss(nsample, cuda)
+    mutex, door = MutexLoss(nsample, cuda), DoorLoss(nsample, cuda)
+    cases = [
+        ('InsideLoss', lambda b: inside_loss_reference(inside, b, inside_box, obj_to_img),
+         lambda b: inside(b, inside_box, obj_to_img)),
+        ('CoverageLoss', lambda b: coverage_loss_reference(coverage, b, inside_coords, obj_to_img),
+         lambda b: coverage(b, inside_coords, obj_to_img)),
+        ('MutexLoss', lambda b: mutex_loss_reference(mutex, b, obj_to_img, objs),
+         lambda b: mutex(b, obj_to_img, objs)),
+        ('DoorLoss', lambda b: door_loss_reference(door, b, inside_box, obj_to_img, objs),
+         lambda b: door(b, inside_box, obj_to_img, objs)),
+    ]
+
+    def step(fn):
+        b = boxes.clone().requires_grad_(True)
+        loss = fn(b)
+        loss.backward()
+        return loss.detach(), b.grad
+
+    t_ref_all, t_bat_all = 0, 0
+    for name, reference, batched in cases:
+        t_ref, (ref, ref_grad) = timeit(lambda: step(reference), repeat)
+        t_bat, (out, out_grad) = timeit(lambda: step(batched), repeat)
+        t_ref_all, t_bat_all = t_ref_all + t_ref, t_bat_all + t_bat
+        diff = (ref - out).abs().item() / max(ref.abs().item(), 1e-12)
+        grad_diff = (ref_grad - out_grad).abs().max().item()
+        print(f'  {name:12s}: per-image {t_ref*1e3:9.2f} ms, batched {t_bat*1e3:8.2f} ms, '
+              f'rel diff {diff:.2e}, grad max abs diff {grad_diff:.2e}')
+        assert diff < 1e-4 and grad_diff < 1e-4
+    print(f'  loss step throughput: per-image {batch_size/t_ref_all:8.1f} plans/s, batched {batch_size/t_bat_all:8.1f} plans/s')
+
+
+def benchmark_augment(batch_size=32, device='cpu', repeat=10):
+    '''BatchAugment on a collated batch of batch_size plans'''
+    from model.augment import BatchAugment
+
+    boxes, objs, obj_to_img = random_batch(batch_size, device=device)
+    inside_box, inside_coords = random_fragments(batch_size, device=device)
+    O = boxes.size(0)
+    triples = torch.stack([torch.arange(O - 1), torch.randint(0, 10, (O - 1,)), torch.arange(1, O)], 1).to(device)
+    batch = (torch.rand(batch_size, 3, 128, 128, device=device), inside_box, objs,
+             torch.rand(O, 35, device=device), triples, torch.randint(0, 15, (batch_size, 128, 128), device=device),
+             boxes, inside_coords, obj_to_img, obj_to_img[triples[:, 0]], [str(i) for i in range(batch_size)])
+    augment = BatchAugment()
+    t, _ = timeit(lambda: augment(batch), repeat)
+    print(f'BatchAugment, batch {batch_size}, device={device}: {t*1e3:8.2f} ms/batch, {t/batch_size*1e3:8.3f} ms/plan')
+
+
+def benchmark_dataset(data_path, store_dir, n=500, seed=0):
+    '''per-sample __getitem__ time of FloorPlanDataset (loadmat structs) vs FloorPlanStoreDataset'''
+    import numpy as np
+    from model.floorplan import FloorPlanDataset
+    from model.sample_store import FloorPlanStoreDataset
+
+    datasets = [('loadmat', FloorPlanDataset(data_path)), ('sample store', FloorPlanStoreDataset(store_dir, train=True))]
+    datasets[0][1].train = True
+    indices = np.random.default_rng(seed).integers(0, len(datasets[1][1]), n)
+    print(f'dataset __getitem__ with augmentation, {n} samples')
+    for name, dataset in datasets:
+        t, _ = timeit(lambda: [dataset[int(i)] for i in indices], repeat=1)
+        print(f'  {name:12s}: {t/n*1e3:8.3f} ms/sample')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--data_path', default=None, help='data_{split}.mat, with --store_dir times the dataset')
+    parser.add_argument('--store_dir', default=None)
+    args = parser.parse_args()
+
+    if args.data_path and args.store_dir:
+        benchmark_dataset(args.data_path, args.store_dir)
+
+    benchmark_layout(batch_size=args.batch_size, device=args.device)
+    benchmark_losses(batch_size=args.batch_size, device=args.device)
+    benchmark_augment(batch_size=args.batch_size, device=args.device)
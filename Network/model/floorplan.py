@@ -120,12 +120,23 @@ class FloorPlan():
         if tensor: triples = torch.tensor(triples).long()
         return triples
 
-    def get_layout_image(self,tensor=True):
+    def get_layout_base(self):
+        """boundary part of the layout image: 13 outside, 0 inside, 14 on the boundary line"""
         img = np.full((128,128),13,dtype=np.uint8)
         boundary = self.data.boundary[:,:2]
         boundary = np.concatenate([boundary, boundary[:1]])
 
         cv2.fillPoly(img, (boundary//2).reshape(1, -1, 2), 0)
+        cv2.polylines(img, (boundary//2).reshape(1, -1, 2), True,14)
+        return img
+
+    def get_layout_image(self,tensor=True,base=None):
+        """
+        base: get_layout_base of this plan when already available
+        rooms are drawn on the base, the boundary line stays on top
+        """
+        if base is None: base = self.get_layout_base()
+        img = base.copy()
 
         order = self.data.order-1
         rType = self.data.rType[order]
@@ -137,7 +148,7 @@ class FloorPlan():
             b = rBox[i]//2
             img[b[1]:b[3],b[0]:b[2]]=t
         
-        cv2.polylines(img, (boundary//2).reshape(1, -1, 2), True,14)
+        img[base==14] = 14
 
         if tensor: img = torch.tensor(img).long()
         return img
@@ -169,20 +180,16 @@ class FloorPlan():
             boxes = torch.tensor(boxes).float()
         return boxes
 
-    def get_inside_coords(self,size=(32,32),tensor=True):
-        h,w = size
-        X = np.linspace(0,1,w)
-        Y = np.linspace(0,1,h)
+    def get_inside_mask(self,size=(32,32)):
         img = np.zeros(size)
         boundary = self.data.boundary[:,:2]
         boundary = boundary*np.array(size)//256
 
         cv2.fillPoly(img, boundary.reshape(1, -1, 2), 1)
+        return img
 
-        coords = np.where(img>0)
-        coords = np.stack((X[coords[1]],Y[coords[0]]),1)
-        if tensor: coords = torch.tensor(coords).unsqueeze(0).float()
-        return coords
+    def get_inside_coords(self,size=(32,32),tensor=True):
+        return mask_to_coords(self.get_inside_mask(size),tensor=tensor)
 
     def get_test_data(self, tensor=True):
         name = self.data.name
@@ -212,6 +219,16 @@ class FloorPlan():
         
         return boundary,inside_box,rooms,attrs,triples,layout,boxes,inside_coords,name
 
+def mask_to_coords(img,tensor=True):
+    """(x,y) in [0,1] of the pixels inside the boundary, see FloorPlan.get_inside_coords"""
+    h,w = img.shape
+    X = np.linspace(0,1,w)
+    Y = np.linspace(0,1,h)
+    coords = np.where(img>0)
+    coords = np.stack((X[coords[1]],Y[coords[0]]),1)
+    if tensor: coords = torch.tensor(coords).unsqueeze(0).float()
+    return coords
+
 class FloorPlanDataset(Dataset):
     def __init__(self,data_path):
         self.data = sio.loadmat(data_path, squeeze_me=True, struct_as_record=False)['data']
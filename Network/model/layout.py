@@ -158,13 +158,11 @@ def _pool_samples(samples, obj_to_img, pooling='sum'):
     obj_counts = obj_counts.clamp(min=1)
     out = out / obj_counts.view(N, 1, 1, 1)
   elif pooling == 'max':
-    all_out = []
-    obj_to_img_list = [i.item() for i in list(obj_to_img)]
-    for i in range(N):
-        start = obj_to_img_list.index(i)
-        end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
-        all_out.append(torch.max(samples[start:end, :, :, :], dim=0)[0])
-    out = torch.stack(all_out)
+    if hasattr(out, 'scatter_reduce'):
+      out = out.scatter_reduce(0, idx, samples, reduce='amax', include_self=False)
+    else:
+      # torch < 1.12 has no scatter_reduce: one masked max per image
+      out = torch.stack([samples[obj_to_img == i].max(0)[0] for i in range(N)])
   elif pooling == 'sum':
     out = out.scatter_add(0, idx, samples)
     #raise ValueError('Invalid pooling "%s"' % pooling)
@@ -194,17 +192,7 @@ def masks_to_seg(boxes, masks, objs, obj_to_img, H, W=None, num_classes=15):
   N = obj_to_img.data.max().item() + 1
   grid = _boxes_to_grid(boxes, H, W)
   mask_sampled = F.grid_sample(masks.float().view(O, 1, M, M), grid)
-  seg = torch.zeros((N,num_classes,H,W)).to(device)
-  # obj_to_img_list = [i.item() for i in list(obj_to_img)]
-  for i in range(N):
-    obj_to_i = (obj_to_img==i).nonzero().view(-1)
-    # start = obj_to_img_list.index(i)
-    # end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
-    # for j in range(start,end):
-    for j in obj_to_i:
-      obj = objs[j]
-      seg[i,obj]=seg[i,obj]+mask_sampled[j]
-  return seg
+  return _sum_seg(mask_sampled, objs, obj_to_img, N, num_classes)
 
 def boxes_to_seg(boxes, objs, obj_to_img, H, W=None,num_classes=15):
   """
@@ -229,17 +217,24 @@ def boxes_to_seg(boxes, objs, obj_to_img, H, W=None,num_classes=15):
   grid = _boxes_to_grid(boxes, H, W)
   mask_sampled = F.grid_sample(torch.ones(O,1,8,8).to(boxes), grid)
   
-  seg = torch.zeros((N,num_classes,H,W)).to(device)
-  obj_to_img_list = [i.item() for i in list(obj_to_img)]
-  for i in range(N):
-    start = obj_to_img_list.index(i)
-    end = len(obj_to_img_list) - obj_to_img_list[::-1].index(i)
-    for j in range(start,end):
-    #obj_to_i = (obj_to_img==i).nonzero().view(-1)
-    #for j in obj_to_i:
-      obj = objs[j]
-      seg[i,obj]=seg[i,obj]+mask_sampled[j]
-  return seg
+  return _sum_seg(mask_sampled, objs, obj_to_img, N, num_classes)
+
+
+def _sum_seg(mask_sampled, objs, obj_to_img, N, num_classes):
+  """
+  Input:
+  - mask_sampled: FloatTensor of shape (O, 1, H, W)
+  - objs: LongTensor of shape (O,) giving the class of each object
+  - obj_to_img: LongTensor of shape (O,) mapping objects to images
+
+  Output:
+  - seg: FloatTensor of shape (N, num_classes, H, W), seg[i, c] is the sum
+    of the masks of the objects of class c in image i
+  """
+  O, _, H, W = mask_sampled.size()
+  seg = torch.zeros(N * num_classes, H * W, dtype=mask_sampled.dtype, device=mask_sampled.device)
+  seg.index_add_(0, obj_to_img * num_classes + objs, mask_sampled.view(O, H * W))
+  return seg.view(N, num_classes, H, W)
 
 if __name__ == '__main__':
   vecs = torch.FloatTensor([
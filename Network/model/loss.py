@@ -218,6 +218,89 @@ def mutex_loss(boxes,step=2):
 
     return (f_b_dist*f_out_box).sum()/(B*FP-B)
 
+def pad_by_image(x,obj_to_img,N):
+    """
+    rows of each image gathered into one padded row block
+
+    Parameters:
+    ----------
+    x: [O,...], rows of all images
+    obj_to_img: [O], image of each row in [0,N)
+
+    Return:
+    ----------
+    padded: [N,M,...], padded[i,:count_i] are the rows of image i in order, zeros after
+    valid: [N,M], True for the rows of padded taken from x
+    """
+    O = obj_to_img.size(0)
+    device = obj_to_img.device
+    onehot = torch.zeros(O,N,dtype=torch.long,device=device)
+    onehot[torch.arange(O,device=device),obj_to_img] = 1
+    # position of each row in its image
+    rank = onehot.cumsum(0)[torch.arange(O,device=device),obj_to_img]-1
+    M = max(int(onehot.sum(0).max().item()),1)
+
+    padded = x.new_zeros((N,M)+tuple(x.shape[1:]))
+    padded[obj_to_img,rank] = x
+    valid = torch.zeros(N,M,dtype=torch.bool,device=device)
+    valid[obj_to_img,rank] = True
+    return padded,valid
+
+def batch_fragment_outside_box(fragments,boxes):
+    """
+    fragment_outside_box for N images at once
+
+    Parameters:
+    ----------
+    fragments: [N,F,FP,2]
+    boxes: [N,B,4]
+
+    Return:
+    ----------
+    ret: [N,F,FP,B]
+    """
+    N,F,FP,_ = fragments.shape
+    B = boxes.shape[1]
+
+    diff = torch.cat([
+        fragments.view(N,F,FP,1,2)-boxes[...,:2].view(N,1,1,B,2),
+        boxes[...,2:].view(N,1,1,B,2)-fragments.view(N,F,FP,1,2)
+    ],dim=-1)
+    
+    return ((diff>=0).sum(-1)!=4).float()
+
+def batch_fragment_box_distance(fragments,box_points):
+    """
+    fragment_box_distance for N images at once
+
+    Parameters:
+    ----------
+    fragments: [N,F,FP,2]
+    box_points: [N,B,BP,2]
+
+    Return:
+    ----------
+    ret: [N,F,FP,B]
+    """
+    N,F,FP,_ = fragments.shape
+    _,B,BP,_ = box_points.shape
+    return (fragments.view(N,F,FP,1,1,2)-box_points.view(N,1,1,B,BP,2)).pow(2).sum(-1).min(-1)[0]
+
+def sample_boxes(samples,boxes):
+    """
+    Parameters:
+    ----------
+    samples: [1,P,2], points in the unit box (sample_boundary / sample_fragment)
+    boxes: [...,4], boxes with (x0,y0,x1,y1)
+
+    Return:
+    ----------
+    ret: [...,P,2], the points placed in each box
+    """
+    P = samples.shape[1]
+    wh = boxes[...,2:]-boxes[...,:2]
+    return samples.view(P,2)*wh.unsqueeze(-2)+boxes[...,:2].unsqueeze(-2)
+
 class InsideLoss(nn.Module):
     def __init__(self,nsample=100,cuda=True):
         super(InsideLoss,self).__init__()
@@ -254,15 +337,25 @@ class InsideLoss(nn.Module):
             return self._inside_loss(boxes,fragment_boxes)
 
     def forward(self,boxes,fragment_boxes,obj_to_img,reduction="mean"):
+        """
+        mean over images of _inside_loss(boxes of image i, fragment_boxes[[i]]),
+        all images at once with the boxes padded per image
+        """
         N = obj_to_img.data.max().item() + 1
         boxes = box_utils.centers_to_extents(boxes)
-
-        losses = []
-        for i in range(N):
-            obj_to_i = (obj_to_img==i).nonzero().view(-1)
-            loss = self._inside_loss(boxes[obj_to_i],fragment_boxes[[i]])
-            losses.append(loss)
-        return torch.mean(torch.stack(losses))
+        # [N,B,4], [N,B]
+        boxes,valid = pad_by_image(boxes,obj_to_img,N)
+
+        # [N,B,FP,2]
+        box_fragments = sample_boxes(self.fragment,boxes)
+        # [N,1,BP,2]
+        fragment_boundaries = sample_boxes(self.boundary,fragment_boxes).view(N,1,self.BP,2)
+        # [N,B,FP,1]
+        f_out_box = batch_fragment_outside_box(box_fragments,fragment_boxes.view(N,1,4))
+        f_b_dist = batch_fragment_box_distance(box_fragments,fragment_boundaries)
+        # [N]
+        losses = (f_b_dist*f_out_box).sum((2,3)).mul(valid).sum(1)/(valid.sum(1)*self.FP)
+        return torch.mean(losses)
 
 class CoverageLoss(nn.Module):
     def __init__(self,nsample=100,cuda=True):
@@ -270,7 +363,8 @@ class CoverageLoss(nn.Module):
         self.step = round(nsample/4)
         self.BP = self.step*4
         self.boundary = sample_boundary(step=self.step).view(1,self.BP,2)
-        self.boundary = self.boundary.cuda()
+        if cuda:
+            self.boundary = self.boundary.cuda()
 
     def _coverage_loss(self,boxes,fragments):
         B, _ = boxes.shape
@@ -291,15 +385,33 @@ class CoverageLoss(nn.Module):
             return self._coverage_loss(boxes,fragments)
 
     def forward(self,boxes,fragments,obj_to_img,reduction="mean"):
+        """
+        mean over images of _coverage_loss(boxes of image i, fragments[i]),
+        all images at once with the boxes and the fragment points padded per image
+
+        fragments: list of [1,FP_i,2] (inside_coords of floorplan_collate_fn)
+        """
         N = obj_to_img.data.max().item() + 1
         boxes = box_utils.centers_to_extents(boxes)
-
-        losses = []
-        for i in range(N):
-            obj_to_i = (obj_to_img==i).nonzero().view(-1)
-            loss = self._coverage_loss(boxes[obj_to_i],fragments[i])
-            losses.append(loss)
-        return torch.mean(torch.stack(losses))
+        # [N,B,4], [N,B]
+        boxes,valid = pad_by_image(boxes,obj_to_img,N)
+
+        # [N,FP,2], [N,FP]
+        points = [fragments[i].reshape(-1,2) for i in range(N)]
+        counts = torch.tensor([len(p) for p in points],device=boxes.device)
+        points = nn.utils.rnn.pad_sequence(points,batch_first=True)
+        point_valid = torch.arange(points.shape[1],device=boxes.device).view(1,-1)<counts.view(-1,1)
+
+        # [N,B,BP,2]
+        box_points = sample_boxes(self.boundary,boxes)
+        # [N,1,FP,B]
+        f_out_box = batch_fragment_outside_box(points.unsqueeze(1),boxes)
+        f_b_dist = batch_fragment_box_distance(points.unsqueeze(1),box_points)
+        # padded boxes never give the min, padded points count 0
+        dist = (f_b_dist*f_out_box).masked_fill(~valid.view(N,1,1,-1),float('inf')).min(-1)[0].view(N,-1)
+        dist = torch.where(point_valid,dist,torch.zeros_like(dist))
+        losses = dist.sum(1)/counts
+        return torch.mean(losses)
 
 class MutexLoss(nn.Module):
     def __init__(self,nsample=100,cuda=True):
@@ -337,14 +449,30 @@ class MutexLoss(nn.Module):
             return self._mutex_loss(boxes)
     
     def forward(self,boxes,obj_to_img,objs=None,reduction="mean"):
+        """
+        mean over images of _mutex_loss(boxes of image i except objs==0),
+        all images at once with the boxes padded per image
+        """
         N = obj_to_img.data.max().item() + 1
         boxes = box_utils.centers_to_extents(boxes)
-        losses = []
-        for i in range(N):
-            obj_to_i = ((obj_to_img==i)*(objs!=0)).nonzero().view(-1)
-            loss = self._mutex_loss(boxes[obj_to_i])
-            losses.append(loss)
-        return torch.mean(torch.stack(losses))
+        keep = objs!=0
+        # [N,B,4], [N,B]
+        boxes,valid = pad_by_image(boxes[keep],obj_to_img[keep],N)
+        B = boxes.shape[1]
+
+        # [N,B,FP,2]
+        fragments = sample_boxes(self.fragment,boxes)
+        # [N,B,BP,2]
+        box_points = sample_boxes(self.boundary,boxes)
+
+        # [N,B,FP,B], pairs of different valid boxes
+        pair = valid.view(N,B,1)*valid.view(N,1,B)*(1-torch.eye(B,device=boxes.device)).bool()
+        f_in_box = (1-batch_fragment_outside_box(fragments,boxes))*pair.view(N,B,1,B)
+        f_b_dist = batch_fragment_box_distance(fragments,box_points)
+
+        count = valid.sum(1)
+        losses = (f_b_dist*f_in_box).sum((1,2,3))/(count*self.FP-count)
+        return torch.mean(losses)
 
 class BoxRenderLoss(nn.Module):
     def __init__(self,nsample=100,cuda=True):
@@ -439,16 +567,26 @@ class DoorLoss(nn.Module):
         return (f_b_dist*f_out_box).sum()/(F*self.FP) 
 
     def forward(self,boxes,doors,obj_to_img,objs=None,reduction="mean"):
+        """
+        mean over images of _door_loss(boxes of image i, doors[[i]], objs of image i != 0),
+        all images at once with the boxes padded per image
+        """
         N = obj_to_img.data.max().item() + 1
         boxes = box_utils.centers_to_extents(boxes)
-
-        losses = []
-        for i in range(N):
-            obj_to_i = ((obj_to_img==i)).nonzero().view(-1)
-            objs_i = (objs[obj_to_img==i]!=0).long()
-            loss = self._door_loss(boxes[obj_to_i],doors[[i]],objs_i)
-            losses.append(loss)
-        return torch.mean(torch.stack(losses))
+        # [N,B,4], [N,B]
+        boxes,valid = pad_by_image(boxes,obj_to_img,N)
+        is_room,_ = pad_by_image((objs!=0).float(),obj_to_img,N)
+        B = boxes.shape[1]
+
+        # [N,B,BP,2]
+        box_boundaries = sample_boxes(self.boundary,boxes)
+        # [N,1,FP,2]
+        door_fragments = sample_boxes(self.fragment,doors).view(N,1,self.FP,2)
+        # [N,1,FP,B]
+        f_out_box = (is_room.view(N,1,1,B)-batch_fragment_outside_box(door_fragments,boxes)).abs()
+        f_b_dist = batch_fragment_box_distance(door_fragments,box_boundaries)
+        losses = (f_b_dist*f_out_box*valid.view(N,1,1,B)).sum((1,2,3))/self.FP
+        return torch.mean(losses)
 
 if __name__ == "__main__":
     # [4]
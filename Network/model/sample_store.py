@@ -0,0 +1,272 @@
+"""
+Sample Store Module
+Sharded, memory-mapped cache of preprocessed training samples.
+
+FloorPlanDataset rebuilds every sample from the loadmat struct on each epoch
+(deep copy, boundary/layout/inside rasters, attributes, triples). The store
+keeps, per sample, the rasters in the stored orientation as uint8 arrays and
+the plan geometry as flat arrays with offsets:
+    input.npy   (n,3,128,128) FloorPlan.get_input_boundary * 2
+    layout.npy  (n,128,128)   FloorPlan.get_layout_base
+    inside.npy  (n,32,32)     FloorPlan.get_inside_mask
+    boundary / gtBoxNew / rType / rEdge / order (+ _offsets), names
+The rotation/flip augmentation turns the cached rasters with np.rot90 / flips
+and transforms the geometry with the same align_* functions as FloorPlan;
+attributes, triples, boxes and the rooms of the layout image are recomputed
+from the (small) geometry. The boundary vertices map exactly under the
+90-degree turns and flips, so the samples equal FloorPlan.get_train_data.
+
+Build once per split (from the Network directory):
+    python -m model.sample_store ./data/data_train.mat ./data/train_store --workers 8
+train.py uses {dataset_dir}/{split}_store when it exists.
+"""
+import os
+import json
+import shutil
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from model.floorplan import FloorPlan, mask_to_coords
+from model.utils import rot_k
+
+STORE_VERSION = 1
+
+# field name -> number of columns of each row (None: 1-D per sample)
+GEOMETRY_FIELDS = {
+    'boundary': 4,
+    'gtBoxNew': 4,
+    'rType': None,
+    'rEdge': 3,
+    'order': None,
+}
+RASTER_FIELDS = ('input', 'layout', 'inside')
+
+
+class PlanRecord():
+    '''Plain plan record, the attributes of the loadmat struct used by FloorPlan.'''
+
+    def __init__(self, name, boundary, gtBoxNew, rType, rEdge, order):
+        self.name = name
+        self.boundary = boundary
+        self.gtBoxNew = gtBoxNew
+        self.rType = rType
+        self.rEdge = rEdge
+        self.order = order
+
+    @staticmethod
+    def from_struct(datum):
+        return PlanRecord(str(datum.name), *[np.asarray(getattr(datum, f)) for f in GEOMETRY_FIELDS])
+
+
+def pack(arrays, ncols=None):
+    '''
+    arrays: list of arrays, one per sample
+    return: values (rows of all samples concatenated), offsets (n+1,)
+    '''
+    if ncols is None:
+        arrays = [np.atleast_1d(a).reshape(-1) for a in arrays]
+    else:
+        arrays = [np.asarray(a).reshape(-1, ncols) for a in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    nonempty = [a.dtype for a in arrays if a.size]
+    dtype = np.result_type(*nonempty) if nonempty else np.int64
+    return np.concatenate([a.astype(dtype, copy=False) for a in arrays]), offsets
+
+
+def preprocess(record):
+    '''
+    record: PlanRecord in the stored orientation
+    return: input (3,128,128), layout base (128,128), inside (32,32) uint8 rasters
+    '''
+    fp = FloorPlan(record)
+    input_image = fp.get_input_boundary(tensor=False).transpose(2, 0, 1)
+    return (
+        np.round(input_image * 2).astype(np.uint8),
+        fp.get_layout_base(),
+        fp.get_inside_mask().astype(np.uint8)
+    )
+
+
+def write_shard(records, shard_dir):
+    '''writes the shard to shard_dir.tmp and renames it, so a finished shard is always complete'''
+    tmp_dir = shard_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    save = lambda name, array: np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+
+    rasters = [preprocess(record) for record in records]
+    for name, arrays in zip(RASTER_FIELDS, zip(*rasters)):
+        save(name, np.stack(arrays))
+    for field, ncols in GEOMETRY_FIELDS.items():
+        values, offsets = pack([getattr(record, field) for record in records], ncols)
+        save(field, values)
+        save(f'{field}_offsets', offsets)
+    save('names', np.array([record.name for record in records]))
+    os.rename(tmp_dir, shard_dir)
+    return len(records)
+
+
+def _write_shard(args):
+    return write_shard(*args)
+
+
+def build_store(data_path, store_dir, shard_size=10000, workers=1):
+    '''
+    data_path: data_{split}.mat
+    store_dir: output directory; shards already written by an interrupted run are kept
+    '''
+    import scipy.io as sio
+    from multiprocessing import Pool
+
+    data = sio.loadmat(data_path, squeeze_me=True, struct_as_record=False)['data']
+    records = [PlanRecord.from_struct(datum) for datum in data]
+    os.makedirs(store_dir, exist_ok=True)
+
+    shards, todo = [], []
+    for start in range(0, len(records), shard_size):
+        name = f'shard_{start // shard_size:05d}'
+        shards.append({'dir': name, 'size': len(records[start:start + shard_size])})
+        if not os.path.exists(os.path.join(store_dir, name)):
+            todo.append((records[start:start + shard_size], os.path.join(store_dir, name)))
+
+    if workers > 1 and len(todo) > 1:
+        with Pool(workers) as pool:
+            for n in pool.imap_unordered(_write_shard, todo):
+                print(f'shard of {n} samples written')
+    else:
+        for args in todo:
+            print(f'shard of {_write_shard(args)} samples written')
+
+    meta = {'version': STORE_VERSION, 'source': os.path.basename(data_path),
+            'num_samples': len(records), 'shards': shards}
+    with open(os.path.join(store_dir, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(os.path.join(store_dir, 'meta.json.tmp'), os.path.join(store_dir, 'meta.json'))
+    print(f'{len(records)} samples in {len(shards)} shards -> {store_dir}')
+
+
+class SampleShard():
+    def __init__(self, shard_dir, mmap_mode='r'):
+        load = lambda name: np.load(os.path.join(shard_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+        self.names = load('names')
+        self.rasters = {name: load(name) for name in RASTER_FIELDS}
+        self.geometry = {field: (load(field), load(f'{field}_offsets')) for field in GEOMETRY_FIELDS}
+
+    def record(self, i):
+        '''writable PlanRecord of sample i (a copy, FloorPlan modifies it)'''
+        fields = {}
+        for field, (values, offsets) in self.geometry.items():
+            fields[field] = np.array(values[offsets[i]:offsets[i + 1]])
+        return PlanRecord(str(self.names[i]), **fields)
+
+
+class SampleStore():
+    def __init__(self, store_dir, mmap_mode='r'):
+        '''
+        store_dir: directory written by build_store
+        Shards are opened lazily, so the store is cheap to send to DataLoader
+        workers and every worker maps the same files.
+        '''
+        self.store_dir = store_dir
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported sample store version {self.meta['version']} in {store_dir}")
+        self.starts = np.cumsum([0] + [shard['size'] for shard in self.meta['shards']])
+        self._shards = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def shard(self, s):
+        if self._shards is None:
+            self._shards = [None] * len(self.meta['shards'])
+        if self._shards[s] is None:
+            shard_dir = os.path.join(self.store_dir, self.meta['shards'][s]['dir'])
+            self._shards[s] = SampleShard(shard_dir, self.mmap_mode)
+        return self._shards[s]
+
+    def __getitem__(self, i):
+        '''return: PlanRecord, input, layout, inside rasters of sample i (stored orientation)'''
+        if not 0 <= i < len(self):
+            raise IndexError(f'index {i} out of range for store of size {len(self)}')
+        s = int(np.searchsorted(self.starts, i, side='right')) - 1
+        shard, j = self.shard(s), i - self.starts[s]
+        return (shard.record(j),) + tuple(shard.rasters[name][j] for name in RASTER_FIELDS)
+
+
+def open_store(store_dir):
+    '''return: SampleStore, or None if store_dir has not been built'''
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        return None
+    return SampleStore(store_dir)
+
+
+def augment_sample(record, input_image, layout, inside, rot=None, fliplr=False):
+    '''
+    record, rasters: a sample of SampleStore in the stored orientation
+    rot, fliplr: as FloorPlan(data, rot, fliplr)
+    return: the tuple of FloorPlan.get_train_data for the transformed plan
+    '''
+    k = 0
+    if rot is not None:
+        door_line = record.boundary[:2, :2]
+        c = door_line.mean(0) - np.array([127.5, 127.5])
+        k = int(rot_k(np.arctan2(c[1], c[0]) + np.pi, rot))
+    # geometry: same transform as FloorPlan, rasters: rotate/flip the pixels
+    fp = FloorPlan(record, rot=rot, fliplr=fliplr)
+    turn = lambda img: np.rot90(img, k, axes=(-2, -1))
+    input_image, layout, inside = turn(input_image), turn(layout), turn(inside)
+    if fliplr:
+        input_image, layout, inside = input_image[..., ::-1], layout[..., ::-1], inside[..., ::-1]
+
+    boundary = torch.tensor(np.ascontiguousarray(input_image)).float() / 2
+    inside_box = fp.get_inside_box()
+    rooms = fp.get_rooms()
+    attrs = fp.get_attributes()
+    triples = fp.get_triples(random=False)
+    layout = fp.get_layout_image(base=np.ascontiguousarray(layout))
+    boxes = fp.get_boxes()
+    inside_coords = mask_to_coords(inside)
+    return boundary, inside_box, rooms, attrs, triples, layout, boxes, inside_coords, record.name
+
+
+class FloorPlanStoreDataset(Dataset):
+    '''FloorPlanDataset served from a SampleStore'''
+
+    def __init__(self, store_dir, train=False):
+        self.store = SampleStore(store_dir)
+        self.train = train
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        sample = self.store[i]
+        if self.train:
+            rot = np.random.randint(0, 4)
+            fliplr = np.random.random() > 0.5
+            return augment_sample(*sample, rot=rot, fliplr=fliplr)
+        return augment_sample(*sample)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Preprocess data_{split}.mat into a sharded sample store')
+    parser.add_argument('data_path')
+    parser.add_argument('store_dir')
+    parser.add_argument('--shard_size', default=10000, type=int)
+    parser.add_argument('--workers', default=8, type=int)
+    args = parser.parse_args()
+
+    build_store(args.data_path, args.store_dir, args.shard_size, args.workers)
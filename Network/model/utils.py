@@ -25,13 +25,17 @@ def rot90_2D(pts,k=1,cnt=np.array([127.5,127.5])):
 def fliplr_2D(pts,size=255):
     return np.stack([pts[:,0],size-pts[:,1]],1)
 
+def rot_k(rot_old,rot_new=0):
+    """number of 90 degree turns (rot90_2D / np.rot90) used by the align_* functions"""
+    return np.ceil((rot_old-rot_new+2*np.pi)%(2*np.pi)/(np.pi/4))//2
+
 def align_image(image,rot_old,rot_new=0):
-    k = np.ceil((rot_old-rot_new+2*np.pi)%(2*np.pi)/(np.pi/4))//2
+    k = rot_k(rot_old,rot_new)
     return np.rot90(image,k)
     
 def align_box(box,rot_old,rot_new=0):
     box = box-np.array([0,0,1,1])
-    k = np.ceil((rot_old-rot_new+2*np.pi)%(2*np.pi)/(np.pi/4))//2
+    k = rot_k(rot_old,rot_new)
     box = rot90_2D(box.reshape(-1,2),k).reshape(-1,4)
     return np.concatenate([np.minimum(box[:,:2],box[:,2:]),np.maximum(box[:,:2],box[:,2:])+1],-1).round().astype(int)
 
@@ -41,7 +45,7 @@ def fliplr_box(box,size=255):
     return np.concatenate([np.minimum(box[:,:2],box[:,2:]),np.maximum(box[:,:2],box[:,2:]+1)],-1).round().astype(int)
 
 def align_points(pts, rot_old, rot_new=0):
-    k = np.ceil((rot_old - rot_new + 2 * np.pi) % (2 * np.pi) / (np.pi / 4)) // 2
+    k = rot_k(rot_old, rot_new)
     pts = rot90_2D(pts, k)
     return pts.round().astype(int)
 
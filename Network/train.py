@@ -21,6 +21,8 @@ from model.utils import int_tuple, str_tuple, bool_flag
 from model.metrics import iou,MetricAverage,image_acc,image_acc_ignore,binary_image_acc
 from model.model import Model
 from model.floorplan import FloorPlanDataset,floorplan_collate_fn
+from model.sample_store import FloorPlanStoreDataset
+from model.augment import BatchAugment
 from model.loss import *
 from model.box_utils import *
 from model.utils import *
@@ -48,6 +50,8 @@ def parse_args():
     parser.add_argument('--batch_size', default=20, type=int)
     parser.add_argument('--workers', default=8, type=int)
     parser.add_argument('--train_shuffle', default='1', type=bool_flag)
+    # rotate/flip whole batches on the GPU (model/augment.py) instead of per sample in the workers
+    parser.add_argument('--batch_augment', default='0', type=bool_flag)
 
     ''' Model '''
     # architecture
@@ -117,7 +121,16 @@ def get_model(args):
     roi_cat_feature=args.roi_cat_feature)
 
 def get_dataset(args,split='valid'):
-    return FloorPlanDataset(f'{args.dataset_dir}/data_{split}.mat')
+    # preprocessed store of model/sample_store.py when built
+    store_dir = f'{args.dataset_dir}/{split}_store'
+    if os.path.exists(f'{store_dir}/meta.json'):
+        dataset = FloorPlanStoreDataset(store_dir,train=split=='train')
+    else:
+        dataset = FloorPlanDataset(f'{args.dataset_dir}/data_{split}.mat')
+    if args.batch_augment:
+        # augmented after collate by BatchAugment
+        dataset.train = False
+    return dataset
 
 def get_dataloader(args,dataset,split):
     print(f"{split},shuffle:",split=='train' and args.train_shuffle and (not args.debug))
@@ -261,11 +274,15 @@ def main(args):
     print("Cuda...")
     model.cuda()
 
+    augment = BatchAugment() if args.batch_augment else None
+
     def update(engine,batch):
         model.train()
         optimizer.zero_grad()
         
-        boundary,inside_box,objs,attrs,triples,layout,boxes,inside_coords,obj_to_img,triple_to_img,name = batch_cuda(batch)
+        batch = batch_cuda(batch)
+        if augment is not None: batch = augment(batch)
+        boundary,inside_box,objs,attrs,triples,layout,boxes,inside_coords,obj_to_img,triple_to_img,name = batch
 
         if args.relative: boxes = box_rel2abs(boxes,inside_box,obj_to_img)
 